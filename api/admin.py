@@ -36,6 +36,7 @@ class CommentInline(admin.TabularInline):
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
     list_display = ('title', 'type', 'author', 'contributor_count', 'issue_count', 'created_time')
+    list_select_related = ('author',)
     search_fields = ('title', 'description', 'author__username')
     list_filter = ('type', 'created_time')
     readonly_fields = ('created_time',)
@@ -51,24 +52,28 @@ class ProjectAdmin(admin.ModelAdmin):
         }),
     )
 
+    # The counts are columns of the project (see api.counters)
     def contributor_count(self, obj):
-        count = obj.contributors.count()
+        count = obj.contributor_count
         url = reverse('admin:api_contributor_changelist') + f'?project__id__exact={obj.id}'
         return format_html('<a href="{}">{} contributors</a>', url, count)
 
     contributor_count.short_description = "Contributors"
+    contributor_count.admin_order_field = 'contributor_count'
 
     def issue_count(self, obj):
-        count = obj.issues.count()
+        count = obj.issue_count
         url = reverse('admin:api_issue_changelist') + f'?project__id__exact={obj.id}'
         return format_html('<a href="{}">{} issues</a>', url, count)
 
     issue_count.short_description = "Issues"
+    issue_count.admin_order_field = 'issue_count'
 
 
 @admin.register(Contributor)
 class ContributorAdmin(admin.ModelAdmin):
     list_display = ('user', 'project_link', 'created_time')
+    list_select_related = ('user', 'project')
     search_fields = ('user__username', 'user__email', 'project__title')
     list_filter = ('created_time', 'project__type')
     readonly_fields = ('created_time',)
@@ -92,6 +97,7 @@ class IssueAdmin(admin.ModelAdmin):
     autocomplete_fields = ['project', 'author', 'assignee']
     inlines = [CommentInline]
     list_editable = ('status', 'priority')
+    list_select_related = ('project', 'author', 'assignee')
 
     fieldsets = (
         (None, {
@@ -116,18 +122,20 @@ class IssueAdmin(admin.ModelAdmin):
     project_link.short_description = "Project"
 
     def comment_count(self, obj):
-        count = obj.comments.count()
+        count = obj.comment_count
         if count == 0:
             return '0 comments'
         url = reverse('admin:api_comment_changelist') + f'?issue__id__exact={obj.id}'
         return format_html('<a href="{}">{} comments</a>', url, count)
 
     comment_count.short_description = "Comments"
+    comment_count.admin_order_field = 'comment_count'
 
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('comment_preview', 'issue_link', 'project_name', 'author', 'created_time')
+    list_select_related = ('issue__project', 'author')
     search_fields = ('description', 'issue__title', 'author__username', 'issue__project__title')
     list_filter = ('created_time', 'issue__status', 'issue__project__type')
     readonly_fields = ('created_time',)
@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, using, **kwargs):
+    from .search import create_search_index
+    create_search_index(connections[using])
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Register the signal receivers
+        from . import signals  # noqa: F401
+        post_migrate.connect(create_search_index, sender=self)
+        # Let RequestMetricsMiddleware time the queries of every connection
+        from .instrumentation import install_execute_wrapper
+        connection_created.connect(install_execute_wrapper)
@@ -0,0 +1,175 @@
+"""
+Async versions of the read endpoints (list and retrieve of projects, issues and comments).
+
+They return the same bodies as the viewsets but read through the async ORM, so under ASGI a request waiting on the
+database does not hold a worker thread. Cursor pagination, ETags and the response cache are served by the sync
+endpoints only.
+"""
+import math
+
+from django.conf import settings
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from authentication.authentication import async_jwt_required, json_response
+from .membership import membership_filter
+from .models import Project, Issue, Comment
+from .serializers import (ProjectSerializer, DetailedProjectSerializer, IssueSerializer, DetailedIssueSerializer,
+                          CommentSerializer)
+from .versioning import parse_uuid
+
+
+PAGE_QUERY_PARAM = 'page'
+
+# Same whitelists as the viewsets' filterset_fields and ordering_fields
+PROJECT_FILTERS = {f'{name}{lookup}': int for name in ('issue_count', 'open_issue_count', 'contributor_count')
+                   for lookup in ('', '__gte', '__lte')}
+PROJECT_ORDERING_FIELDS = ('issue_count', 'open_issue_count', 'contributor_count', 'created_time', 'updated_time')
+ISSUE_FILTERS = {'project': parse_uuid, 'assignee': int, 'author': int,
+                 'comment_count': int, 'comment_count__gte': int, 'comment_count__lte': int}
+ISSUE_ORDERING_FIELDS = ('priority', 'status', 'tag', 'comment_count')
+COMMENT_FILTERS = {'issue': parse_uuid}
+COMMENT_ORDERING_FIELDS = ('created_time', 'issue')
+
+
+def not_found(model):
+    detail = ErrorDetail(f'No {model._meta.object_name} matches the given query.', code='not_found')
+    return json_response({'detail': detail}, status=status.HTTP_404_NOT_FOUND)
+
+
+def filter_queryset(request, queryset, filters, ordering_fields):
+    """
+    Apply the ?field= filters and the ?ordering= parameter the way DjangoFilterBackend and OrderingFilter do.
+    Return None when a filter value is invalid.
+    """
+    for field, parse in filters.items():
+        value = request.GET.get(field)
+        if not value:
+            continue
+        try:
+            value = parse(value)
+        except ValueError:
+            value = None
+        if value is None:
+            return None
+        queryset = queryset.filter(**{field: value})
+
+    ordering = [term.strip() for term in request.GET.get('ordering', '').split(',')
+                if term.strip().lstrip('-') in ordering_fields]
+    if ordering:
+        queryset = queryset.order_by(*ordering)
+    return queryset
+
+
+async def paginated_response(request, queryset, serializer_class):
+    """ Same page and body as PageNumberPagination, with the count and the page read through the async ORM """
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    count = await queryset.acount()
+    page_count = max(math.ceil(count / page_size), 1)
+    try:
+        page_number = int(request.GET.get(PAGE_QUERY_PARAM, 1))
+    except ValueError:
+        page_number = 0
+    if not 1 <= page_number <= page_count:
+        return json_response({'detail': ErrorDetail('Invalid page.', code='not_found')},
+                             status=status.HTTP_404_NOT_FOUND)
+
+    offset = (page_number - 1) * page_size
+    objects = [obj async for obj in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    next_link = replace_query_param(url, PAGE_QUERY_PARAM, page_number + 1) if page_number < page_count else None
+    if page_number == 1:
+        previous_link = None
+    elif page_number == 2:
+        previous_link = remove_query_param(url, PAGE_QUERY_PARAM)
+    else:
+        previous_link = replace_query_param(url, PAGE_QUERY_PARAM, page_number - 1)
+
+    return json_response({
+        'count': count,
+        'next': next_link,
+        'previous': previous_link,
+        'results': serializer_class(objects, many=True).data,
+    })
+
+
+@require_GET
+@async_jwt_required
+async def project_list(request):
+    queryset = filter_queryset(request, Project.objects.filter(membership_filter(request.user, 'pk')),
+                               PROJECT_FILTERS, PROJECT_ORDERING_FIELDS)
+    if queryset is None:
+        return json_response({'detail': 'Invalid filter value.'}, status=status.HTTP_400_BAD_REQUEST)
+    return await paginated_response(request, ProjectSerializer.setup_eager_loading(queryset), ProjectSerializer)
+
+
+@require_GET
+@async_jwt_required
+async def project_detail(request, pk):
+    project_id = parse_uuid(pk)
+    if project_id is None:
+        return not_found(Project)
+    queryset = Project.objects.filter(membership_filter(request.user, 'pk'))
+    try:
+        project = await DetailedProjectSerializer.setup_eager_loading(queryset).aget(pk=project_id)
+    except Project.DoesNotExist:
+        return not_found(Project)
+    return json_response(DetailedProjectSerializer(project).data)
+
+
+def issue_queryset(user):
+    return Issue.objects.filter(membership_filter(user, 'project'))
+
+
+@require_GET
+@async_jwt_required
+async def issue_list(request):
+    queryset = filter_queryset(request, issue_queryset(request.user).order_by('-created_time'),
+                               ISSUE_FILTERS, ISSUE_ORDERING_FIELDS)
+    if queryset is None:
+        return json_response({'detail': 'Invalid filter value.'}, status=status.HTTP_400_BAD_REQUEST)
+    return await paginated_response(request, IssueSerializer.setup_eager_loading(queryset), IssueSerializer)
+
+
+@require_GET
+@async_jwt_required
+async def issue_detail(request, pk):
+    issue_id = parse_uuid(pk)
+    if issue_id is None:
+        return not_found(Issue)
+    try:
+        issue = await DetailedIssueSerializer.setup_eager_loading(issue_queryset(request.user)).aget(pk=issue_id)
+    except Issue.DoesNotExist:
+        return not_found(Issue)
+    return json_response(DetailedIssueSerializer(issue).data)
+
+
+def comment_queryset(user):
+    queryset = Comment.objects.filter(membership_filter(user, 'issue__project')).order_by('-created_time')
+    return CommentSerializer.setup_eager_loading(queryset)
+
+
+@require_GET
+@async_jwt_required
+async def comment_list(request):
+    queryset = filter_queryset(request, comment_queryset(request.user),
+                               COMMENT_FILTERS, COMMENT_ORDERING_FIELDS)
+    if queryset is None:
+        return json_response({'detail': 'Invalid filter value.'}, status=status.HTTP_400_BAD_REQUEST)
+    return await paginated_response(request, queryset, CommentSerializer)
+
+
+@require_GET
+@async_jwt_required
+async def comment_detail(request, pk):
+    comment_id = parse_uuid(pk)
+    if comment_id is None:
+        return not_found(Comment)
+    try:
+        comment = await comment_queryset(request.user).aget(pk=comment_id)
+    except Comment.DoesNotExist:
+        return not_found(Comment)
+    return json_response(CommentSerializer(comment).data)
@@ -0,0 +1,98 @@
+"""
+Denormalized counts: issue_count, open_issue_count and contributor_count of Project, comment_count of Issue.
+
+Every write adds its delta with UPDATE ... SET count = count + delta, so concurrent requests never lose an increment,
+and the bulk paths add the deltas of a whole batch at once; issue and contributor counts ride on the UPDATE that
+bumps the project version, so a write updates the project row once. Each of these UPDATEs also sets updated_time,
+so the next delta sync (api.sync) sends the row with its new counts. Saves leave the counters alone
+(CounterFieldsMixin). repair_counts recomputes them from the rows, after a bulk import or to fix a drift.
+"""
+from collections import Counter
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Project, Contributor, Issue, Comment
+
+
+OPEN_STATUSES = ('TODO', 'IN_PROGRESS')
+
+
+def add_counts(model, pks, **deltas):
+    """ Add the deltas to the counters of the rows in one UPDATE """
+    deltas = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if pks and deltas:
+        model.objects.filter(pk__in=pks).update(updated_time=timezone.now(), **deltas)
+
+
+def add_counts_by_row(model, field, deltas):
+    """ Add a {pk: delta} mapping to one counter, with one UPDATE per distinct delta """
+    by_delta = {}
+    for pk, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(pk)
+    for delta, pks in by_delta.items():
+        add_counts(model, pks, **{field: delta})
+
+
+def issue_counts(stat_deltas):
+    """
+    Deltas of the issue counts of a project from the deltas of its status statistics (see api.stats.issue_deltas),
+    for the UPDATE that bumps its version
+    """
+    statuses = {value: delta for (dimension, value), delta in stat_deltas.items() if dimension == 'status'}
+    return {'issue_count': sum(statuses.values()),
+            'open_issue_count': sum(delta for value, delta in statuses.items() if value in OPEN_STATUSES)}
+
+
+def remove_comments(issue_ids):
+    """ Comments deleted in bulk, given the issue of each of them """
+    add_counts_by_row(Issue, 'comment_count', {issue_id: -count for issue_id, count in Counter(issue_ids).items()})
+
+
+def count_of(queryset, outer_field):
+    """ COUNT(*) of the queryset rows whose outer_field is the outer row, as a subquery """
+    count = queryset.filter(**{outer_field: OuterRef('pk')}).order_by().values(outer_field).annotate(
+        total=Count('pk')).values('total')
+    return Coalesce(Subquery(count, output_field=IntegerField()), Value(0))
+
+
+def contributor_count():
+    """ Contributors of the project being updated, for the writes that cannot tell how many rows they added """
+    return count_of(Contributor.objects.all(), 'project')
+
+
+def repair_counts(project_ids=None, batch_size=1000):
+    """
+    Recompute the counters of the projects (all of them by default) and of their issues, batch_size rows per
+    UPDATE. Return the number of projects and of issues whose counters were wrong.
+    """
+    projects = Project.objects.order_by('pk')
+    if project_ids is not None:
+        projects = projects.filter(pk__in=project_ids)
+    project_counts = {
+        'issue_count': count_of(Issue.objects.all(), 'project'),
+        'open_issue_count': count_of(Issue.objects.filter(status__in=OPEN_STATUSES), 'project'),
+        'contributor_count': contributor_count(),
+    }
+    comment_count = count_of(Comment.objects.all(), 'issue')
+
+    fixed_projects = fixed_issues = 0
+    ids = list(projects.values_list('pk', flat=True))
+    for index in range(0, len(ids), batch_size):
+        batch = ids[index:index + batch_size]
+        # Only the rows that drifted are written
+        wrong = list(Project.objects.filter(pk__in=batch)
+                     .annotate(**{f'actual_{name}': value for name, value in project_counts.items()})
+                     .exclude(**{name: F(f'actual_{name}') for name in project_counts})
+                     .values_list('pk', flat=True))
+        fixed_projects += Project.objects.filter(pk__in=wrong).update(updated_time=timezone.now(), **project_counts)
+
+        issue_ids = list(Issue.objects.filter(project_id__in=batch).order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(issue_ids), batch_size):
+            wrong = list(Issue.objects.filter(pk__in=issue_ids[start:start + batch_size])
+                         .annotate(actual=comment_count).exclude(comment_count=F('actual'))
+                         .values_list('pk', flat=True))
+            fixed_issues += Issue.objects.filter(pk__in=wrong).update(updated_time=timezone.now(),
+                                                                      comment_count=comment_count)
+    return fixed_projects, fixed_issues
@@ -0,0 +1,235 @@
+"""
+Deletion of projects and users without Django's collector.
+
+Model.delete() loads every row under the object and sends post_delete for each of them, in one transaction, before
+anything is deleted. Here the rows are deleted bottom-up in chunks of at most CHUNK_SIZE primary keys, each chunk with
+one DELETE ... WHERE id IN (...) per table in its own transaction, and the work of the post_delete receivers
+(statistics, counters, search documents, membership cache, project versions) is done once per chunk. Memory does
+not grow with the number of rows, and a deletion that stopped halfway is finished by running it again.
+"""
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+from authentication.models import User
+from .counters import remove_comments
+from .events import publish_deleted_comments, publish_issues, publish_project_deletion
+from .membership import invalidate_many_project_ids, invalidate_user_project_ids
+from .models import Project, Contributor, Issue, Comment, ProjectIssueStat, DeletionJob, Tombstone
+from .search import delete_search_documents, update_search_documents
+from .stats import DIMENSIONS, lock_loaded_values, record_issues
+from .sync import record_tombstones
+from .versioning import bump_project_version
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CHUNK_SIZE': 500,
+    # Run the background deletions in a thread of the web process; False runs them when the request commits,
+    # for tests and for deployments calling run_deletion_jobs from a worker instead
+    'RUN_IN_THREAD': True,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DELETION', {})}
+
+
+def chunks(queryset, chunk_size, *fields):
+    """
+    Yield the primary keys (or the (pk, *fields) rows) of the queryset by chunks until it is empty.
+    Each chunk must be deleted before the next one is read, since every chunk is read from the start.
+    """
+    while True:
+        if fields:
+            rows = list(queryset.values_list('pk', *fields)[:chunk_size])
+        else:
+            rows = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+
+
+def delete_rows(model, ids):
+    """
+    One DELETE FROM <table> WHERE <pk> IN (...), without loading the rows, sending signals or following relations.
+    Return the number of deleted rows.
+    """
+    if not ids:
+        return 0
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    pk = model._meta.pk
+    sql = 'DELETE FROM {} WHERE {} IN ({})'.format(quote(model._meta.db_table), quote(pk.column),
+                                                   ', '.join(['%s'] * len(ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [pk.get_db_prep_value(value, connection) for value in ids])
+        return cursor.rowcount
+
+
+class Deleter:
+    """ Deletes by chunks and counts the deleted rows by model; progress is called after every chunk """
+
+    def __init__(self, chunk_size=None, progress=None):
+        self.chunk_size = chunk_size or get_config()['CHUNK_SIZE']
+        self.progress = progress
+        self.deleted = Counter()
+
+    def raw_delete(self, model, ids):
+        self.deleted[model._meta.label] += delete_rows(model, ids)
+
+    def chunk_done(self):
+        if self.progress is not None:
+            self.progress(self)
+
+    def delete_comments(self, queryset, record=True):
+        """
+        Comments whose issues are deleted too, so their search documents and counters are left alone;
+        record=False skips their tombstones
+        """
+        for rows in chunks(queryset, self.chunk_size, 'issue__project_id'):
+            with transaction.atomic():
+                self.raw_delete(Comment, [pk for pk, _ in rows])
+                if record:
+                    record_tombstones('COMMENT', [(project_id, pk) for pk, project_id in rows])
+            self.chunk_done()
+
+    def delete_issues(self, queryset, record=True):
+        """
+        Issues with their comments; record=False skips the statistics and tombstones of a project that is deleted
+        next. Clients drop the comments of a deleted issue, so no comment.deleted event is sent for them.
+        """
+        while True:
+            issues = list(queryset.only('id', 'project_id', *DIMENSIONS.values())[:self.chunk_size])
+            if not issues:
+                return
+            ids = [issue.pk for issue in issues]
+            self.delete_comments(Comment.objects.filter(issue_id__in=ids), record)
+            with transaction.atomic():
+                if record:
+                    # Counted from the rows as they are now, not as they were before the comments were deleted
+                    issues = lock_loaded_values(issues)
+                delete_search_documents(ids)
+                self.raw_delete(Issue, ids)
+                if record:
+                    record_issues(issues, deleted=True)
+                    record_tombstones('ISSUE', [(issue.project_id, issue.pk) for issue in issues])
+                    publish_issues('deleted', issues)
+                else:
+                    bump_project_version(*{issue.project_id for issue in issues})
+            self.chunk_done()
+
+    def delete_project(self, project_id):
+        # Members first, so the project leaves every list and event stream at once when the deletion takes a while.
+        # Nobody can reach the project after that, so a deletion that stopped halfway is finished by its job (see
+        # delete_now)
+        for rows in chunks(Contributor.objects.filter(project_id=project_id), self.chunk_size, 'user_id'):
+            with transaction.atomic():
+                self.raw_delete(Contributor, [pk for pk, _ in rows])
+            invalidate_many_project_ids([user_id for _, user_id in rows])
+            self.chunk_done()
+        publish_project_deletion(project_id)
+        self.delete_issues(Issue.objects.filter(project_id=project_id), record=False)
+        with transaction.atomic():
+            self.raw_delete(ProjectIssueStat, list(ProjectIssueStat.objects.filter(project_id=project_id)
+                                                   .values_list('pk', flat=True)))
+            self.raw_delete(Project, [project_id])
+        # No sync can ask about the project any more
+        for ids in chunks(Tombstone.objects.filter(project_id=project_id), self.chunk_size):
+            self.raw_delete(Tombstone, ids)
+        self.chunk_done()
+
+    def delete_user(self, user_id):
+        """ The user's projects, issues they authored or are assigned (the foreign keys cascade), their comments """
+        for project_ids in chunks(Project.objects.filter(author_id=user_id), self.chunk_size):
+            for project_id in project_ids:
+                self.delete_project(project_id)
+        self.delete_issues(Issue.objects.filter(Q(author_id=user_id) | Q(assignee_id=user_id)))
+
+        for rows in chunks(Comment.objects.filter(author_id=user_id), self.chunk_size, 'issue_id', 'issue__project_id'):
+            with transaction.atomic():
+                self.raw_delete(Comment, [pk for pk, _, _ in rows])
+                update_search_documents({issue_id for _, issue_id, _ in rows})
+                record_tombstones('COMMENT', [(project_id, pk) for pk, _, project_id in rows])
+                publish_deleted_comments(rows)
+                remove_comments([issue_id for _, issue_id, _ in rows])
+                bump_project_version(*{project_id for _, _, project_id in rows})
+            self.chunk_done()
+
+        for rows in chunks(Contributor.objects.filter(user_id=user_id), self.chunk_size, 'project_id'):
+            with transaction.atomic():
+                self.raw_delete(Contributor, [pk for pk, _ in rows])
+                # A user is a contributor of a project once, so each project loses one
+                bump_project_version(*[project_id for _, project_id in rows], contributor_count=-1)
+            self.chunk_done()
+        invalidate_user_project_ids(user_id)
+
+        # What is left (groups, permissions, admin log) is small: the collector deletes it with the user
+        user = User.objects.filter(pk=user_id).first()
+        if user is not None:
+            self.deleted.update(user.delete()[1])
+        self.chunk_done()
+
+
+def is_background_request(request):
+    """ DELETE ...?background=true asks for a deletion job instead of deleting during the request """
+    return request.query_params.get('background', '').lower() in ('1', 'true')
+
+
+def start_deletion_job(kind, target_id):
+    """ Record a background deletion; it starts once the current transaction commits """
+    job = DeletionJob.objects.create(kind=kind, target_id=str(target_id))
+    if get_config()['RUN_IN_THREAD']:
+        transaction.on_commit(lambda: threading.Thread(target=run_in_thread, args=(job.pk,), daemon=True).start())
+    else:
+        transaction.on_commit(lambda: run_deletion_job(job.pk))
+    return job
+
+
+def delete_now(kind, target_id):
+    """
+    Delete during the request, through a job all the same: a deletion that stops halfway is left FAILED for
+    run_deletion_jobs to finish. The job is dropped once DONE. Return it.
+    """
+    job = run_deletion_job(DeletionJob.objects.create(kind=kind, target_id=str(target_id)).pk)
+    if job.status == 'DONE':
+        job.delete()
+    return job
+
+
+def run_in_thread(job_id):
+    try:
+        run_deletion_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def run_deletion_job(job_id):
+    job = DeletionJob.objects.get(pk=job_id)
+    job.status = 'RUNNING'
+    job.save(update_fields=['status', 'updated_time'])
+
+    def progress(deleter):
+        job.deleted = dict(deleter.deleted)
+        job.save(update_fields=['deleted', 'updated_time'])
+
+    # A job run again starts its counts from zero: the rows deleted by the first run are gone
+    deleter = Deleter(progress=progress)
+    try:
+        if job.kind == 'PROJECT':
+            deleter.delete_project(job.target_id)
+        else:
+            deleter.delete_user(int(job.target_id))
+    except Exception as error:
+        logger.exception('Deletion job %s failed', job.pk)
+        job.status, job.error = 'FAILED', str(error)
+    else:
+        job.status, job.error = 'DONE', ''
+    job.deleted = dict(deleter.deleted)
+    job.save(update_fields=['status', 'error', 'deleted', 'updated_time'])
+    return job
@@ -0,0 +1,459 @@
+"""
+Live events of the projects, pushed to the clients over Server-Sent Events or a WebSocket.
+
+Writes publish one event per created, updated or deleted issue or comment once their transaction commits. The broker
+carries the events to the Hub of every web process, and the hub hands each of them to the connections subscribed to
+its project. EventStream is a plain ASGI application mounted by softdesk_api/asgi.py in front of Django: Django's ASGI
+handler keeps a thread for each request until it ends, while here an idle connection is one coroutine waiting on a
+bounded queue. Events missed while disconnected are fetched with the delta sync of the project.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from authentication.authentication import CachedJWTAuthentication
+from .membership import get_user_project_ids
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'PATH': '/api/events/',
+    # Dotted path of the broker class and its keyword arguments; InMemoryBroker only reaches this process
+    'BROKER': 'api.events.InMemoryBroker',
+    'BROKER_OPTIONS': {},
+    # Events a slow client may leave unread before its stream is closed with an overflow event
+    'QUEUE_SIZE': 100,
+    # Seconds between two keep-alive comments on an idle Server-Sent Events stream
+    'HEARTBEAT': 15,
+    # Milliseconds an EventSource waits before reconnecting
+    'RETRY': 3000,
+}
+
+# Events after which a connection reloads the projects of its user
+MEMBERSHIP_EVENTS = ('membership.changed', 'project.deleted')
+
+# Events of a user's channel that are not sent to the client: after the first the connection checks its token again
+# (deactivation, deletion, password change), the second ends it
+USER_CHANGED = 'user.changed'
+LOGGED_OUT = 'user.logged_out'
+
+# Queue items that end a stream
+OVERFLOW = ('overflow', b'{}')
+UNAUTHORIZED = ('unauthorized', b'{}')
+CLOSED = (None, None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'API_EVENTS', {})}
+
+
+def project_channel(project_id):
+    return f'project:{project_id}'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def user_channels(user_id, project_ids):
+    return frozenset([user_channel(user_id), *map(project_channel, project_ids)])
+
+
+class Subscriber:
+    """ One connection: the channels it listens to and the events it has not written yet """
+
+    def __init__(self, user, loop, queue_size, raw_token=None, expires_at=float('inf')):
+        self.user = user
+        self.loop = loop
+        # The access token, checked again when the user changes, and its expiry as a timestamp
+        self.raw_token = raw_token
+        self.expires_at = expires_at
+        self.queue = asyncio.Queue(queue_size)
+        self.channels = frozenset()
+
+    def deliver(self, event_type, payload):
+        """ Called by the hub from any thread """
+        self.loop.call_soon_threadsafe(self.put, (event_type, payload))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.put, CLOSED)
+
+    def put(self, item):
+        if item is CLOSED or self.queue.full():
+            # A client this far behind syncs again: what it has not read is dropped and the stream ends
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            item = item if item is CLOSED else OVERFLOW
+        self.queue.put_nowait(item)
+
+
+class Hub:
+    """ The subscribers of this process by channel; an event is encoded once for all of them """
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscriber, channels):
+        """ Set the channels of the subscriber, replacing those it had """
+        with self._lock:
+            for channel in subscriber.channels - channels:
+                subscribers = self._channels[channel]
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._channels[channel]
+            for channel in channels - subscriber.channels:
+                self._channels.setdefault(channel, set()).add(subscriber)
+            subscriber.channels = frozenset(channels)
+
+    def unsubscribe(self, subscriber):
+        self.subscribe(subscriber, frozenset())
+
+    def has_subscribers(self, channel):
+        return channel in self._channels
+
+    def count(self):
+        with self._lock:
+            return len({subscriber for subscribers in self._channels.values() for subscriber in subscribers})
+
+    def dispatch(self, channel, event):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        if not subscribers:
+            return
+        payload = JSONRenderer().render(event)
+        for subscriber in subscribers:
+            subscriber.deliver(event['type'], payload)
+
+
+class InMemoryBroker:
+    """ Hands the events straight to the hub of this process: one web process, or the tests """
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def start(self):
+        pass
+
+    def publish(self, channel, event):
+        self.hub.dispatch(channel, event)
+
+    def has_subscribers(self, channel):
+        return self.hub.has_subscribers(channel)
+
+
+class RedisBroker:
+    """
+    Redis pub/sub between the web processes: every event is published once to one Redis channel, and each process
+    listens to it from a thread started with its first connection. Needs the redis package.
+    """
+
+    def __init__(self, hub, url='redis://localhost:6379/0', channel='softdesk:events'):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker needs the redis package')
+        self.hub = hub
+        self.redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    self.hub.dispatch(data['channel'], data['event'])
+            except self.redis.RedisError:
+                logger.exception('Lost the connection to the event broker, reconnecting')
+                time.sleep(1)
+
+    def publish(self, channel, event):
+        self.client.publish(self.channel, JSONRenderer().render({'channel': channel, 'event': event}))
+
+    def has_subscribers(self, channel):
+        # The connections of the other processes are not known here
+        return True
+
+
+hub = Hub()
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        config = get_config()
+        _broker = import_string(config['BROKER'])(hub, **config['BROKER_OPTIONS'])
+    return _broker
+
+
+def publish(channel, event):
+    """ Publish once the current transaction commits, so no client sees a write that is rolled back """
+    broker = get_broker()
+    transaction.on_commit(lambda: broker.publish(channel, event))
+
+
+def publish_issues(action, issues):
+    """ issue.created, issue.updated or issue.deleted for each issue; the issue is only serialized when watched """
+    from .serializers import IssueSerializer
+
+    broker = get_broker()
+    for issue in issues:
+        channel = project_channel(issue.project_id)
+        if not broker.has_subscribers(channel):
+            continue
+        event = {'type': f'issue.{action}', 'project': str(issue.project_id), 'id': str(issue.pk)}
+        if action != 'deleted':
+            event['data'] = IssueSerializer(issue).data
+        publish(channel, event)
+
+
+def publish_comments(action, rows):
+    """ comment.created, comment.updated or comment.deleted for each (project ID, comment) pair """
+    from .serializers import CommentSerializer
+
+    broker = get_broker()
+    for project_id, comment in rows:
+        channel = project_channel(project_id)
+        if not broker.has_subscribers(channel):
+            continue
+        event = {'type': f'comment.{action}', 'project': str(project_id), 'issue': str(comment.issue_id),
+                 'id': str(comment.pk)}
+        if action != 'deleted':
+            event['data'] = CommentSerializer(comment).data
+        publish(channel, event)
+
+
+def publish_deleted_comments(rows):
+    """ comment.deleted for each (comment ID, issue ID, project ID) row of the bulk deletions """
+    broker = get_broker()
+    for comment_id, issue_id, project_id in rows:
+        channel = project_channel(project_id)
+        if broker.has_subscribers(channel):
+            publish(channel, {'type': 'comment.deleted', 'project': str(project_id), 'issue': str(issue_id),
+                              'id': str(comment_id)})
+
+
+def publish_membership(project_id, user_ids):
+    """ Tell the connections of the users that they joined or left the project """
+    broker = get_broker()
+    for user_id in user_ids:
+        channel = user_channel(user_id)
+        if broker.has_subscribers(channel):
+            publish(channel, {'type': 'membership.changed', 'project': str(project_id)})
+
+
+def publish_project_deletion(project_id):
+    channel = project_channel(project_id)
+    if get_broker().has_subscribers(channel):
+        publish(channel, {'type': 'project.deleted', 'project': str(project_id)})
+
+
+def publish_user_change(user_id, event_type=USER_CHANGED):
+    """ Have the connections of the user check their token again (USER_CHANGED), or end them (LOGGED_OUT) """
+    channel = user_channel(user_id)
+    if get_broker().has_subscribers(channel):
+        publish(channel, {'type': event_type})
+
+
+def release_connections():
+    # Django closes the connections when its requests end; this application is outside its handler
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def authenticate(raw_token):
+    """
+    The user of the access token, the IDs of their projects and the token's expiry; blocking, so run through
+    sync_to_async
+    """
+    try:
+        authenticator = CachedJWTAuthentication()
+        validated_token = authenticator.get_validated_token(raw_token)
+        user = authenticator.get_user(validated_token)
+        return user, get_user_project_ids(user), validated_token.get('exp', float('inf'))
+    finally:
+        release_connections()
+
+
+def is_still_valid(raw_token):
+    """ Whether the token still authenticates its user, read from the database rather than the user cache """
+    try:
+        authenticator = JWTAuthentication()
+        authenticator.get_user(authenticator.get_validated_token(raw_token))
+    except AuthenticationFailed:
+        return False
+    finally:
+        release_connections()
+    return True
+
+
+def load_project_ids(user):
+    try:
+        return get_user_project_ids(user)
+    finally:
+        release_connections()
+
+
+def get_raw_token(scope):
+    """ The token of the Authorization header, or of ?access_token= since browsers cannot set headers on streams """
+    authenticator = CachedJWTAuthentication()
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            return authenticator.get_raw_token(value)
+    tokens = parse_qs(scope['query_string'].decode('latin-1')).get('access_token')
+    return tokens[0] if tokens else None
+
+
+class EventStream:
+    """
+    ASGI application of the event stream. A GET answers Server-Sent Events and a WebSocket at the same path gets
+    the same events as text messages; both authenticate with an access token. A connection follows the projects of
+    its user as they join or leave them, and ends with an overflow event when it falls QUEUE_SIZE events behind, and
+    with an unauthorized event when its token expires, stops being valid or its user logs out.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            await self.serve_websocket(scope, receive, send)
+        else:
+            await self.serve_event_source(scope, receive, send)
+
+    async def connect(self, scope):
+        """ A subscriber listening to the channels of the token's user; raises AuthenticationFailed """
+        raw_token = get_raw_token(scope)
+        if raw_token is None:
+            raise AuthenticationFailed('Authentication credentials were not provided.', code='not_authenticated')
+        user, project_ids, expires_at = await sync_to_async(authenticate)(raw_token)
+        subscriber = Subscriber(user, asyncio.get_running_loop(), get_config()['QUEUE_SIZE'], raw_token, expires_at)
+        hub.subscribe(subscriber, user_channels(user.pk, project_ids))
+        get_broker().start()
+        return subscriber
+
+    async def events(self, subscriber, timeout=None):
+        """
+        Yield the (type, payload) events of the subscriber, and (None, None) after timeout seconds of silence.
+        Ends after OVERFLOW, or UNAUTHORIZED once the token expired or no longer authenticates its user.
+        """
+        while True:
+            remaining = subscriber.expires_at - time.time()
+            if remaining <= 0:
+                yield UNAUTHORIZED
+                return
+            wait = remaining if timeout is None else min(timeout, remaining)
+            try:
+                item = await asyncio.wait_for(subscriber.queue.get(), wait)
+            except asyncio.TimeoutError:
+                if time.time() < subscriber.expires_at:
+                    yield None, None
+                continue
+            if item is CLOSED:
+                return
+            if item[0] == USER_CHANGED:
+                if await sync_to_async(is_still_valid)(subscriber.raw_token):
+                    continue
+                item = UNAUTHORIZED
+            elif item[0] == LOGGED_OUT:
+                item = UNAUTHORIZED
+            yield item
+            if item in (OVERFLOW, UNAUTHORIZED):
+                return
+            if item[0] in MEMBERSHIP_EVENTS:
+                project_ids = await sync_to_async(load_project_ids)(subscriber.user)
+                hub.subscribe(subscriber, user_channels(subscriber.user.pk, project_ids))
+
+    async def wait_disconnect(self, receive, subscriber):
+        while (await receive())['type'] not in ('http.disconnect', 'websocket.disconnect'):
+            pass
+        subscriber.close()
+
+    async def serve_event_source(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            await self.send_json(send, 405, {'detail': f'Method "{scope["method"]}" not allowed.'},
+                                 [(b'allow', b'GET')])
+            return
+        try:
+            subscriber = await self.connect(scope)
+        except AuthenticationFailed as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            await self.send_json(send, 401, data, [(b'www-authenticate', b'Bearer realm="api"')])
+            return
+
+        config = get_config()
+        listener = asyncio.ensure_future(self.wait_disconnect(receive, subscriber))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Proxies such as nginx would otherwise hold the events in their buffers
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b'retry: %d\n\n' % config['RETRY'], 'more_body': True})
+            async for event_type, payload in self.events(subscriber, config['HEARTBEAT']):
+                if event_type is None:
+                    frame = b': heartbeat\n\n'
+                else:
+                    frame = b'event: %s\ndata: %s\n\n' % (event_type.encode(), payload)
+                await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            listener.cancel()
+            hub.unsubscribe(subscriber)
+
+    async def serve_websocket(self, scope, receive, send):
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        try:
+            subscriber = await self.connect(scope)
+        except AuthenticationFailed:
+            # Closing before accepting answers the handshake with 403
+            await send({'type': 'websocket.close', 'code': 4401})
+            return
+
+        listener = asyncio.ensure_future(self.wait_disconnect(receive, subscriber))
+        try:
+            await send({'type': 'websocket.accept'})
+            # The server answers the pings of the clients, so an idle WebSocket needs no heartbeat
+            async for event_type, payload in self.events(subscriber):
+                if event_type == OVERFLOW[0]:
+                    await send({'type': 'websocket.send', 'text': json.dumps({'type': 'overflow'})})
+                    await send({'type': 'websocket.close', 'code': 1013})
+                elif event_type == UNAUTHORIZED[0]:
+                    await send({'type': 'websocket.send', 'text': json.dumps({'type': 'unauthorized'})})
+                    await send({'type': 'websocket.close', 'code': 4401})
+                else:
+                    await send({'type': 'websocket.send', 'text': payload.decode()})
+        finally:
+            listener.cancel()
+            hub.unsubscribe(subscriber)
+
+    async def send_json(self, send, status, data, headers):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), *headers]})
+        await send({'type': 'http.response.body', 'body': JSONRenderer().render(data)})
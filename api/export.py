@@ -0,0 +1,75 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .models import Issue, Comment
+
+
+CHUNK_SIZE = 500
+
+CSV_COLUMNS = ['type', 'issue_id', 'comment_id', 'title', 'description', 'tag', 'priority', 'status', 'author',
+               'assignee', 'created_time']
+
+
+def iter_issues(project, chunk_size=CHUNK_SIZE):
+    """
+    Yield every issue of the project with its comments. Issues (with their users) are fetched chunk_size rows
+    at a time from one cursor, and each chunk costs one more query for its comments.
+    """
+    comments = Comment.objects.select_related('author').only(
+        'id', 'description', 'issue_id', 'created_time', 'author__username').order_by('created_time', 'id')
+    issues = (Issue.objects.filter(project=project)
+              .select_related('author', 'assignee')
+              .only('id', 'title', 'description', 'tag', 'priority', 'status', 'created_time', 'project_id',
+                    'author__username', 'assignee__username')
+              .prefetch_related(Prefetch('comments', queryset=comments))
+              .order_by('created_time', 'id'))
+    return issues.iterator(chunk_size=chunk_size)
+
+
+def issue_to_dict(issue):
+    return {
+        'id': issue.id,
+        'title': issue.title,
+        'description': issue.description,
+        'tag': issue.tag,
+        'priority': issue.priority,
+        'status': issue.status,
+        'author': issue.author.username,
+        'assignee': issue.assignee.username if issue.assignee else None,
+        'created_time': issue.created_time,
+        'comments': [{
+            'id': comment.id,
+            'description': comment.description,
+            'author': comment.author.username,
+            'created_time': comment.created_time,
+        } for comment in issue.comments.all()],
+    }
+
+
+def stream_ndjson(project, chunk_size=CHUNK_SIZE):
+    """ One JSON document per line and per issue """
+    encoder = DjangoJSONEncoder()
+    for issue in iter_issues(project, chunk_size):
+        yield encoder.encode(issue_to_dict(issue)) + '\n'
+
+
+class Echo:
+    """ File-like object handing back what csv.writer writes, so each row can be yielded as it is built """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(project, chunk_size=CHUNK_SIZE):
+    """ One row per issue followed by one row per comment of that issue """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for issue in iter_issues(project, chunk_size):
+        yield writer.writerow(['issue', issue.id, '', issue.title, issue.description, issue.tag, issue.priority,
+                               issue.status, issue.author.username,
+                               issue.assignee.username if issue.assignee else '', issue.created_time.isoformat()])
+        for comment in issue.comments.all():
+            yield writer.writerow(['comment', issue.id, comment.id, '', comment.description, '', '', '',
+                                   comment.author.username, '', comment.created_time.isoformat()])
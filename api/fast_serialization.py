@@ -0,0 +1,132 @@
+"""
+Read-only serialization of list pages straight from values_list() rows.
+
+A serializer is compiled once per set of fields into the columns it reads and one small function per field, so a
+page is built without model instances or per-field serializer calls. The rows are equal to what the serializer
+would return: fields the compiler does not know make it give up, and the view falls back to the serializer.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+
+from .instrumentation import timed
+from .renderers import FastJSONRenderer
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+# Representations returning the database value unchanged (subclasses such as EmailField keep them)
+IDENTITY_REPRESENTATIONS = {serializers.CharField.to_representation, serializers.ChoiceField.to_representation,
+                            serializers.IntegerField.to_representation, serializers.BooleanField.to_representation}
+
+_compiled = {}
+
+
+def value_getter(index, convert=None):
+    if convert is None:
+        return lambda row: row[index]
+
+    def get(row):
+        value = row[index]
+        return None if value is None else convert(value)
+    return get
+
+
+def nested_getter(index, getters):
+    """ A nested serializer is None when its foreign key is """
+    def get(row):
+        if row[index] is None:
+            return None
+        return {name: getter(row) for name, getter in getters}
+    return get
+
+
+def compile_fields(serializer, columns, prefix=''):
+    """ Append the columns read by the serializer to columns and return its (field name, getter) pairs """
+    model = serializer.Meta.model
+    getters = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if len(field.source_attrs) != 1:
+            raise UnsupportedField(name)
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise UnsupportedField(name)
+        if not model_field.concrete:
+            raise UnsupportedField(name)
+
+        index = len(columns)
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and model_field.many_to_one:
+            # PrimaryKeyRelatedField only reads the key (use_pk_only_optimization)
+            columns.append(prefix + model_field.attname)
+            getters.append((name, value_getter(index)))
+        elif isinstance(field, serializers.ModelSerializer) and model_field.many_to_one:
+            columns.append(prefix + model_field.attname)
+            getters.append((name, nested_getter(index, compile_fields(field, columns, f'{prefix}{field.source}__'))))
+        elif isinstance(field, serializers.UUIDField) and field.uuid_format == 'hex_verbose':
+            columns.append(prefix + model_field.attname)
+            getters.append((name, value_getter(index, str)))
+        elif type(field).to_representation in IDENTITY_REPRESENTATIONS and not model_field.is_relation:
+            columns.append(prefix + model_field.attname)
+            getters.append((name, value_getter(index)))
+        elif isinstance(field, (serializers.DateTimeField, serializers.DateField)) and not model_field.is_relation:
+            columns.append(prefix + model_field.attname)
+            getters.append((name, value_getter(index, field.to_representation)))
+        else:
+            raise UnsupportedField(name)
+    return getters
+
+
+class CompiledSerializer:
+
+    def __init__(self, serializer):
+        self.columns = []
+        self.getters = compile_fields(serializer, self.columns)
+
+    def to_representation(self, rows):
+        getters = self.getters
+        return [{name: getter(row) for name, getter in getters} for row in rows]
+
+
+def compile_serializer(serializer):
+    """ Return the CompiledSerializer of a serializer instance, or None when one of its fields is not supported """
+    key = (type(serializer), tuple(serializer.fields))
+    if key not in _compiled:
+        try:
+            _compiled[key] = CompiledSerializer(serializer)
+        except UnsupportedField:
+            _compiled[key] = None
+    return _compiled[key]
+
+
+class FastListMixin:
+    """
+    Serve the list action from values_list() rows through a compiled serializer and render it with orjson.
+    The response bytes are the same as with the serializer; unsupported serializers use the normal path.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer())
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # Named rows carrying the ordering of the cursor (?ordering= included), so it can read the position of a row
+        get_cursor_columns = getattr(self.paginator, 'get_cursor_columns', None)
+        cursor_columns = get_cursor_columns(request, queryset, self) if get_cursor_columns else []
+        columns = compiled.columns + [column for column in dict.fromkeys(cursor_columns)
+                                      if column not in compiled.columns]
+        rows = queryset.prefetch_related(None).values_list(*columns, named=True)
+
+        page = self.paginate_queryset(rows)
+        with timed('serialize'):
+            data = compiled.to_representation(page if page is not None else rows)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
@@ -0,0 +1,240 @@
+"""
+Per-request performance instrumentation.
+
+RequestMetricsMiddleware times every request and, through a wrapper installed on each database connection, every
+query it runs. The viewsets add the time spent in permission checks and serializers with timed(). Each response
+gets a Server-Timing header, requests over SLOW_REQUEST_THRESHOLD are logged with their slowest queries, and
+per-endpoint latency histograms are served in the Prometheus text format by metrics_view.
+Histograms are kept per process; the scraper adds up the workers.
+"""
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Seconds after which a request is logged with its slowest queries
+    'SLOW_REQUEST_THRESHOLD': 1.0,
+    'SLOWEST_QUERIES': 3,
+    # Bearer token the scraper must send to the metrics endpoint; without it only staff users logged in through
+    # the admin can read the metrics
+    'SCRAPE_TOKEN': None,
+    # Serve the metrics to anyone, for deployments where only the scraper can reach /api/metrics/
+    'PUBLIC': False,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+}
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class RequestMetrics:
+    """ What one request spent, filled while it runs """
+
+    def __init__(self, slowest_queries):
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.timings = {}
+        self.slowest = []
+        self.slowest_size = slowest_queries
+        self._open = set()
+
+    def record_query(self, sql, duration):
+        self.query_count += 1
+        self.sql_time += duration
+        if len(self.slowest) < self.slowest_size:
+            heapq.heappush(self.slowest, (duration, sql))
+        elif self.slowest and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, sql))
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """ Installed on every connection; only measures while a request is being instrumented """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - start)
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    """ connection_created receiver; a reconnecting wrapper keeps its execute_wrappers, so check first """
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request under name. Nested blocks of the same name
+    (a serializer inside another one) are only counted once.
+    """
+    metrics = _current.get()
+    if metrics is None or name in metrics._open:
+        yield
+        return
+    metrics._open.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._open.discard(name)
+        metrics.timings[name] = metrics.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+class TimedPermissionsMixin:
+    """ Report the time a DRF view spends in permission checks as 'perm' """
+
+    def check_permissions(self, request):
+        with timed('perm'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with timed('perm'):
+            super().check_object_permissions(request, obj)
+
+
+class LatencyHistograms:
+    """ Cumulative latency histograms and query counters per (endpoint, method) """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, key, duration, query_count, sql_time, buckets):
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0,
+                                              'queries': 0, 'sql': 0.0}
+            for index, bound in enumerate(buckets):
+                if duration <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += duration
+            series['count'] += 1
+            series['queries'] += query_count
+            series['sql'] += sql_time
+
+    def render(self, buckets):
+        with self._lock:
+            items = sorted((key, {**series, 'buckets': list(series['buckets'])})
+                           for key, series in self._series.items())
+        lines = [
+            '# HELP softdesk_request_duration_seconds Time to build the response.',
+            '# TYPE softdesk_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), series in items:
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            for bound, count in zip(buckets, series['buckets']):
+                lines.append(f'softdesk_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'softdesk_request_duration_seconds_bucket{{{labels},le="+Inf"}} {series["count"]}')
+            lines.append(f'softdesk_request_duration_seconds_sum{{{labels}}} {series["sum"]:.6f}')
+            lines.append(f'softdesk_request_duration_seconds_count{{{labels}}} {series["count"]}')
+        lines += [
+            '# HELP softdesk_request_queries_total SQL queries run by the requests.',
+            '# TYPE softdesk_request_queries_total counter',
+        ]
+        lines += [f'softdesk_request_queries_total{{endpoint="{endpoint}",method="{method}"}} {series["queries"]}'
+                  for (endpoint, method), series in items]
+        lines += [
+            '# HELP softdesk_request_sql_seconds_total Time spent in SQL queries by the requests.',
+            '# TYPE softdesk_request_sql_seconds_total counter',
+        ]
+        lines += [f'softdesk_request_sql_seconds_total{{endpoint="{endpoint}",method="{method}"}} {series["sql"]:.6f}'
+                  for (endpoint, method), series in items]
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+
+histograms = LatencyHistograms()
+
+
+class RequestMetricsMiddleware:
+    """ Keep it first in settings.MIDDLEWARE, so the whole request is timed """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = get_config()
+        if not config['ENABLED']:
+            return self.get_response(request)
+        metrics, token, start = self.start(config)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, start, config)
+
+    async def __acall__(self, request):
+        config = get_config()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+        metrics, token, start = self.start(config)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, start, config)
+
+    def start(self, config):
+        metrics = RequestMetrics(config['SLOWEST_QUERIES'])
+        return metrics, _current.set(metrics), time.perf_counter()
+
+    def finish(self, request, response, metrics, start, config):
+        duration = time.perf_counter() - start
+        timings = [f'db;dur={metrics.sql_time * 1000:.1f};desc="{metrics.query_count} queries"']
+        timings += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in metrics.timings.items()]
+        timings.append(f'app;dur={duration * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+
+        # The route name, not the path, so IDs do not create a series each
+        match = request.resolver_match
+        endpoint = match.view_name if match is not None else 'unmatched'
+        histograms.observe((endpoint, request.method), duration, metrics.query_count, metrics.sql_time,
+                           config['BUCKETS'])
+
+        if duration >= config['SLOW_REQUEST_THRESHOLD']:
+            slowest = '\n'.join(f'  {seconds * 1000:.1f} ms: {sql}'
+                                for seconds, sql in sorted(metrics.slowest, reverse=True))
+            logger.warning('Slow request %s %s: %.1f ms, %d queries in %.1f ms\n%s', request.method,
+                           request.get_full_path(), duration * 1000, metrics.query_count, metrics.sql_time * 1000,
+                           slowest)
+        return response
+
+
+def metrics_view(request):
+    """ Latency histograms and query counters of this process, in the Prometheus text format """
+    config = get_config()
+    token = config['SCRAPE_TOKEN']
+    allowed = (config['PUBLIC'] or request.user.is_staff
+               or bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'))
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(histograms.render(config['BUCKETS']), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,84 @@
+import asyncio
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from api.models import Contributor, Issue, Comment
+
+
+class Command(BaseCommand):
+    help = ('Compare the sync and async read endpoints: send the same requests through the ASGI handler at a '
+            'given concurrency and report throughput and latency percentiles')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User whose projects are read')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and path')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at the same time')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} not found")
+        contributor = Contributor.objects.filter(user=user).first()
+        if contributor is None:
+            raise CommandError('The user has no project')
+        project_id = contributor.project_id
+        issue = Issue.objects.filter(project_id=project_id).first()
+        comment = Comment.objects.filter(issue__project_id=project_id).first()
+        if issue is None or comment is None:
+            raise CommandError('The project needs at least one issue with a comment')
+
+        routes = [
+            ('projects/', 'projects/'),
+            (f'projects/{project_id}/', f'projects/{project_id}/'),
+            (f'issues/?project={project_id}', f'issues/?project={project_id}'),
+            (f'issues/{issue.id}/', f'issues/{issue.id}/'),
+            ('comments/', 'comments/'),
+            (f'comments/{comment.id}/', f'comments/{comment.id}/'),
+        ]
+        paths = [(f'/api/{sync_route}', f'/api/async/{async_route}') for sync_route, async_route in routes]
+        paths.append(('/api/auth/me/', '/api/auth/async/me/'))
+
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        self.stdout.write(f"{'endpoint':<60} {'path':<6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for sync_path, async_path in paths:
+            for label, path in (('sync', sync_path), ('async', async_path)):
+                # AsyncClient always sends the testserver host
+                with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                    result = asyncio.run(self.run(path, headers, options['requests'], options['concurrency']))
+                self.stdout.write(f"{sync_path:<60} {label:<6} {result['throughput']:>9.1f} {result['p50']:>8.2f} "
+                                  f"{result['p95']:>8.2f} {result['p99']:>8.2f}")
+
+    async def run(self, path, headers, requests, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f'{path} answered {response.status_code}')
+
+        # Warm the membership and user caches so both paths are measured in their steady state
+        await one()
+        latencies.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+        quantiles = statistics.quantiles(latencies, n=100)
+        return {
+            'throughput': requests / elapsed,
+            'p50': quantiles[49] * 1000,
+            'p95': quantiles[94] * 1000,
+            'p99': quantiles[98] * 1000,
+        }
@@ -0,0 +1,254 @@
+import json
+import platform
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from authentication.models import User
+from api.models import Project, Contributor, Issue, Comment, DeletionJob
+
+
+URLCONFS = ('api.urls', 'authentication.urls')
+PASSWORD = 'SoftDesk-benchmark-1'
+# Statements of the savepoint each write runs in, not of the view
+SAVEPOINT_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def route_names(urlconfs=URLCONFS):
+    """ Names of every route of the URL configurations, in declaration order """
+    names = []
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif pattern.name and pattern.name not in names:
+                names.append(pattern.name)
+
+    for urlconf in urlconfs:
+        walk(get_resolver(urlconf).url_patterns)
+    return names
+
+
+def percentile(quantiles, value):
+    return round(quantiles[value - 1] * 1000, 3)
+
+
+class Command(BaseCommand):
+    help = ('Call every route of api/urls.py and authentication/urls.py in-process and report the p50, p95 and '
+            'p99 latencies and the query count of each. Everything runs in a transaction that is rolled back, '
+            'writes in a savepoint each, so every call sees the same data. Run seed_data first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User making the calls, by default the author of the project '
+                                               'with the most issues')
+        parser.add_argument('--requests', type=int, default=50, help='Timed calls per case, after one warm-up')
+        parser.add_argument('--max-seconds', type=float, default=10,
+                            help='Stop timing a case after this long, once it has two calls')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+        parser.add_argument('--filter', help='Only run the cases whose name contains this text')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('--requests must be at least 2')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)['results']
+
+        # The slow request log would report most writes on the big project; the metrics endpoint is measured
+        # without its scrape token
+        metrics = {**getattr(settings, 'REQUEST_METRICS', {}), 'SLOW_REQUEST_THRESHOLD': float('inf'), 'PUBLIC': True}
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                                     REQUEST_METRICS=metrics):
+            context = self.build_context(options['username'])
+            cases = self.build_cases(context)
+            missing = [name for name in route_names() if name not in {case[1] for case in cases}]
+            if missing:
+                self.stderr.write(self.style.WARNING(f"Routes without a case: {', '.join(missing)}"))
+            if options['filter']:
+                cases = [case for case in cases if options['filter'] in case[0]]
+
+            client = Client(headers={'Authorization': f"Bearer {AccessToken.for_user(context['user'])}"})
+            self.stdout.write(f"{'case':<58} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                              f"{'queries':>7}{'  vs baseline' if baseline else ''}")
+            results = {}
+            for label, name, method, path, data in cases:
+                result = self.measure(client, method, path, data, options['requests'], options['max_seconds'])
+                result['route'] = name
+                results[label] = result
+                line = (f"{label:<58} {result['status']:>6} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                        f"{result['p99_ms']:>8.2f} {result['queries']:>7}")
+                if baseline and label in baseline:
+                    before = baseline[label]
+                    line += (f"  p50 {result['p50_ms'] - before['p50_ms']:+.2f} ms, "
+                             f"queries {result['queries'] - before['queries']:+d}")
+                self.stdout.write(line)
+            transaction.set_rollback(True)
+
+        if options['output']:
+            report = {
+                'meta': {
+                    'created': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'python': platform.python_version(),
+                    'requests': options['requests'],
+                    'username': context['user'].username,
+                    'project_issues': context['project_issues'],
+                    'missing_routes': missing,
+                },
+                'results': results,
+            }
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def build_context(self, username):
+        """ The biggest project of the user, its longest thread and the users needed by the contributor routes """
+        if username:
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                raise CommandError(f'User {username} not found')
+            project = (Project.objects.filter(author=user).annotate(issue_total=Count('issues'))
+                       .order_by('-issue_total').first())
+        else:
+            project = Project.objects.annotate(issue_total=Count('issues')).order_by('-issue_total').first()
+            user = project.author if project else None
+        if project is None:
+            raise CommandError('The user has no project, run seed_data first')
+        issue = (Issue.objects.filter(project=project, author=user).annotate(comment_total=Count('comments'))
+                 .order_by('-comment_total').first())
+        comment = Comment.objects.filter(issue__project=project, author=user).first()
+        if issue is None or comment is None:
+            raise CommandError('The user needs an issue and a comment in the project, run seed_data first')
+
+        # Rolled back with the rest: a known password for the login route, and users for the contributor routes
+        user.set_password(PASSWORD)
+        user.save(update_fields=['password'])
+        outsider = User.objects.create_user(username='benchmark-outsider', age=30)
+        member = User.objects.create_user(username='benchmark-member', age=30)
+        Contributor.objects.create(user=member, project=project)
+        job = DeletionJob.objects.create(kind='PROJECT', target_id=str(project.pk), status='DONE')
+        return {'user': user, 'project': project, 'issue': issue, 'comment': comment, 'outsider': outsider,
+                'member': member, 'job': job, 'project_issues': project.issue_total}
+
+    def build_cases(self, context):
+        """ (label, route name, method, path, body) for every route; bodies may be callables """
+        user, project, issue, comment = context['user'], context['project'], context['issue'], context['comment']
+        project_kwargs, issue_kwargs = {'pk': project.pk}, {'pk': issue.pk}
+        specs = [
+            ('api-root', 'get', {}, '', None),
+            ('metrics', 'get', {}, '', None),
+            ('projects-list', 'get', {}, '', None),
+            ('projects-list', 'post', {}, '', {'title': 'Benchmark project', 'description': 'Description',
+                                                'type': 'BACKEND'}),
+            ('projects-detail', 'get', project_kwargs, '', None),
+            ('projects-detail', 'patch', project_kwargs, '', {'description': 'Updated'}),
+            ('projects-detail', 'delete', project_kwargs, '', None),
+            # Only records the job: the transaction is rolled back before it can start
+            ('projects-detail', 'delete', project_kwargs, '?background=true', None),
+            ('projects-add-contributor', 'post', project_kwargs, '', {'user_id': context['outsider'].pk}),
+            ('projects-add-contributors', 'post', project_kwargs, '', {'user_ids': [context['outsider'].pk]}),
+            ('projects-remove-contributor', 'delete', project_kwargs, '', {'user_id': context['member'].pk}),
+            ('projects-remove-contributors', 'post', project_kwargs, '', {'user_ids': [context['member'].pk]}),
+            ('projects-stats', 'get', project_kwargs, '', None),
+            ('projects-export', 'get', project_kwargs, '?export_format=csv', None),
+            ('projects-sync', 'get', project_kwargs, '', None),
+            ('projects-sync', 'get', project_kwargs, '?' + urlencode({'since': timezone.now().isoformat()}), None),
+            ('issues-list', 'get', {}, '', None),
+            ('issues-list', 'get', {}, f'?project={project.pk}', None),
+            ('issues-list', 'get', {}, f'?project={project.pk}&pagination=cursor', None),
+            ('issues-list', 'post', {}, '', {'title': 'Benchmark issue', 'description': 'Description',
+                                             'priority': 'LOW', 'tag': 'BUG', 'project': str(project.pk)}),
+            ('issues-batch', 'post', {}, '', {'project': str(project.pk), 'create': [
+                {'title': f'Benchmark issue {index}', 'description': 'Description', 'priority': 'LOW',
+                 'tag': 'BUG'} for index in range(20)]}),
+            ('issues-search', 'get', {}, '?q=crash', None),
+            ('issues-detail', 'get', issue_kwargs, '', None),
+            ('issues-detail', 'patch', issue_kwargs, '', {'status': 'IN_PROGRESS'}),
+            ('issues-detail', 'delete', issue_kwargs, '', None),
+            ('comments-list', 'get', {}, '', None),
+            ('comments-list', 'get', {}, f'?issue={issue.pk}', None),
+            ('comments-list', 'post', {}, '', {'description': 'Benchmark comment', 'issue': str(issue.pk)}),
+            ('comments-detail', 'get', {'pk': comment.pk}, '', None),
+            ('comments-detail', 'patch', {'pk': comment.pk}, '', {'description': 'Updated'}),
+            ('comments-detail', 'delete', {'pk': comment.pk}, '', None),
+            ('async-projects-list', 'get', {}, '', None),
+            ('async-projects-detail', 'get', project_kwargs, '', None),
+            ('async-issues-list', 'get', {}, f'?project={project.pk}', None),
+            ('async-issues-detail', 'get', issue_kwargs, '', None),
+            ('async-comments-list', 'get', {}, f'?issue={issue.pk}', None),
+            ('async-comments-detail', 'get', {'pk': comment.pk}, '', None),
+            ('token_obtain_pair', 'post', {}, '', {'username': user.username, 'password': PASSWORD}),
+            # Refreshing or logging out revokes the token, so each call gets a new one
+            ('token_refresh', 'post', {}, '', lambda: {'refresh': str(RefreshToken.for_user(user))}),
+            ('register', 'post', {}, '', {'username': 'benchmark-registered', 'password': PASSWORD,
+                                          'password2': PASSWORD, 'email': 'benchmark@example.com', 'age': 30}),
+            ('logout', 'post', {}, '', lambda: {'refresh': str(RefreshToken.for_user(user))}),
+            ('user_detail', 'get', {}, '', None),
+            ('user_detail', 'delete', {}, '', None),
+            ('deletion-job', 'get', {'pk': context['job'].pk}, '', None),
+            ('async_user_detail', 'get', {}, '', None),
+        ]
+        return [(f'{method.upper()} {reverse(name, kwargs=kwargs)}{query}', name, method,
+                 reverse(name, kwargs=kwargs) + query, data)
+                for name, method, kwargs, query, data in specs]
+
+    def measure(self, client, method, path, data, requests, max_seconds):
+        latencies, query_counts, status = [], [], None
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            if not sql.startswith(SAVEPOINT_PREFIXES):
+                queries.append(sql)
+            return execute(sql, params, many, context)
+
+        # The first call warms the caches and is not timed
+        deadline = time.perf_counter() + max_seconds
+        for run in range(requests + 1):
+            if run > 2 and time.perf_counter() > deadline:
+                break
+            body = data() if callable(data) else data
+            queries.clear()
+            # Counted with a wrapper: the connection's query log stops at 9000 entries
+            with connection.execute_wrapper(count):
+                start = time.perf_counter()
+                if method == 'get':
+                    response = client.get(path)
+                else:
+                    # A savepoint per write, so the next call finds the same rows
+                    with transaction.atomic():
+                        response = getattr(client, method)(path, body, content_type='application/json')
+                        transaction.set_rollback(True)
+                # Streamed bodies (the export) are built while they are read
+                if hasattr(response, 'streaming_content'):
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - start
+            if run:
+                latencies.append(elapsed)
+                query_counts.append(len(queries))
+            status = response.status_code
+
+        quantiles = statistics.quantiles(latencies, n=100)
+        if status >= 400:
+            self.stderr.write(self.style.WARNING(f'{method.upper()} {path} answered {status}'))
+        return {
+            'status': status,
+            'runs': len(latencies),
+            'p50_ms': percentile(quantiles, 50),
+            'p95_ms': percentile(quantiles, 95),
+            'p99_ms': percentile(quantiles, 99),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+            'queries': int(statistics.median(query_counts)),
+            'max_queries': max(query_counts),
+        }
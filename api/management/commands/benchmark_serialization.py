@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from authentication.models import User
+from api.fast_serialization import compile_serializer
+from api.models import Project, Issue, Comment
+from api.renderers import FastJSONRenderer
+from api.serializers import ProjectSerializer, IssueSerializer, CommentSerializer
+
+
+class Command(BaseCommand):
+    help = ('Compare the serializers with the compiled values_list() path used by the list endpoints, '
+            'on pages of 10, 100 and 1000 rows built in a transaction that is rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Rows per page')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measure, the best one is kept')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        with transaction.atomic():
+            project = self.seed(max(sizes))
+            self.stdout.write(f"{'serializer':<20} {'rows':>6} {'serializer ms':>14} {'fast ms':>9} {'speedup':>8}")
+            for serializer_class, queryset in (
+                (ProjectSerializer, Project.objects.all()),
+                (IssueSerializer, Issue.objects.filter(project=project).order_by('-created_time')),
+                (CommentSerializer, Comment.objects.filter(issue__project=project).order_by('-created_time')),
+            ):
+                queryset = serializer_class.setup_eager_loading(queryset)
+                for size in sizes:
+                    slow, slow_body = self.measure(options['repeat'], lambda: self.serialize(
+                        serializer_class, queryset[:size]))
+                    fast, fast_body = self.measure(options['repeat'], lambda: self.fast_serialize(
+                        serializer_class, queryset[:size]))
+                    if slow_body != fast_body:
+                        raise CommandError(f'{serializer_class.__name__}: the two paths differ')
+                    self.stdout.write(f'{serializer_class.__name__:<20} {size:>6} {slow * 1000:>14.2f} '
+                                      f'{fast * 1000:>9.2f} {slow / fast:>7.1f}x')
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        user = User.objects.create_user(username='benchmark-serialization', age=30)
+        project = Project.objects.create(title='Benchmark', description='Description', type='BACKEND', author=user)
+        Project.objects.bulk_create([Project(title=f'Benchmark {index}', description='Description ' * 20,
+                                             type='BACKEND', author=user) for index in range(count)])
+        issues = Issue.objects.bulk_create([
+            Issue(title=f'Issue {index}', description='Description ' * 20, priority='LOW', tag='BUG',
+                  project=project, author=user, assignee=user if index % 2 else None)
+            for index in range(count)
+        ])
+        Comment.objects.bulk_create([Comment(description=f'Comment {index}', issue=issue, author=user)
+                                     for index, issue in enumerate(issues)])
+        return project
+
+    def measure(self, repeat, run):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body = run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, body
+
+    def serialize(self, serializer_class, queryset):
+        return JSONRenderer().render(serializer_class(queryset, many=True).data)
+
+    def fast_serialize(self, serializer_class, queryset):
+        compiled = compile_serializer(serializer_class())
+        rows = queryset.prefetch_related(None).values_list(*compiled.columns, named=True)
+        return FastJSONRenderer().render(compiled.to_representation(rows))
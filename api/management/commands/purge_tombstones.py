@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = ("Delete the tombstones older than SYNC['TOMBSTONE_RETENTION_DAYS']; meant to run periodically "
+            "(cron, scheduler)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        deleted = purge_tombstones(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} tombstones'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.stats import rebuild_project_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the issue statistics of every project (or of the given projects) from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', help='Only rebuild these projects')
+
+    def handle(self, *args, **options):
+        rows = rebuild_project_stats(options['project_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} statistic rows'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Issue
+from api.search import create_search_index, update_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents of every issue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        create_search_index()
+        batch, total = [], 0
+        for issue_id in Issue.objects.values_list('id', flat=True).iterator(chunk_size=options['batch_size']):
+            batch.append(issue_id)
+            if len(batch) == options['batch_size']:
+                update_search_documents(batch)
+                total += len(batch)
+                batch = []
+        update_search_documents(batch)
+        total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} issues'))
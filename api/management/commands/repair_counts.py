@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import repair_counts
+
+
+class Command(BaseCommand):
+    help = ('Recompute the issue, open issue and contributor counts of every project (or of the given projects) '
+            'and the comment counts of their issues')
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', help='Only repair these projects')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        projects, issues = repair_counts(options['project_ids'] or None, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Repaired the counts of {projects} projects and {issues} issues'))
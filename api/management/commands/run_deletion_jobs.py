@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from api.deletion import run_deletion_job
+from api.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = ('Run the deletion jobs that are pending, failed, or stuck running because their worker stopped; '
+            'a job run again finishes what the first run left')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', type=int, default=300,
+                            help='Seconds without progress after which a running job is run again')
+
+    def handle(self, *args, **options):
+        stale = timezone.now() - timedelta(seconds=options['stale'])
+        jobs = (DeletionJob.objects.filter(Q(status__in=['PENDING', 'FAILED'])
+                                           | Q(status='RUNNING', updated_time__lt=stale))
+                .order_by('created_time').values_list('pk', flat=True))
+        for job_id in list(jobs):
+            job = run_deletion_job(job_id)
+            self.stdout.write(f'{job.kind} {job.target_id}: {job.status}')
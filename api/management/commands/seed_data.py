@@ -0,0 +1,133 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from authentication.models import User
+from api.counters import repair_counts
+from api.models import Project, Contributor, Issue, Comment
+from api.search import create_search_index, update_search_documents
+from api.stats import rebuild_project_stats
+
+
+WORDS = ('login', 'page', 'crash', 'button', 'timeout', 'release', 'mobile', 'cache', 'error', 'user', 'report',
+         'sync', 'api', 'slow', 'screen', 'payment', 'search', 'export', 'token', 'layout', 'database', 'retry',
+         'notification', 'android', 'ios', 'backend', 'frontend', 'refactor', 'deploy', 'test', 'upload', 'menu')
+
+
+def zipf_weights(count, skew):
+    """ Rank r gets 1 / r**skew: a few items take most of the rows and the rest get a long tail """
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def sentence(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high))).capitalize()
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with users, projects, contributors, issues and comments for benchmarks. '
+            'Issues and comments follow a Zipf distribution: a few huge projects and long comment threads.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--projects', type=int, default=50)
+        parser.add_argument('--issues', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--skew', type=float, default=1.2, help='Zipf exponent, 0 spreads the rows evenly')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the usernames and project titles')
+        parser.add_argument('--password', default='SoftDesk-seed-1', help='Password of every seeded user')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['projects'] < 1:
+            raise CommandError('At least one user and one project are needed')
+        if options['issues'] < 1 and options['comments'] > 0:
+            raise CommandError('Comments need issues')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users prefixed with {prefix}- already exist, use another --prefix')
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        with transaction.atomic():
+            users = self.create_users(options['users'], prefix, options['password'], batch_size)
+            projects, members = self.create_projects(rng, users, options['projects'], options['issues'],
+                                                     options['skew'], prefix, batch_size)
+            issues = self.create_issues(rng, projects, members, batch_size)
+            self.create_comments(rng, issues, members, options['comments'], options['skew'], batch_size)
+
+            # bulk_create sends no signals: build the statistics, counts and search documents the signals would
+            # have kept
+            rebuild_project_stats([project.pk for project in projects])
+            repair_counts([project.pk for project in projects], batch_size)
+            create_search_index()
+            for index in range(0, len(issues), batch_size):
+                update_search_documents([issue.pk for issue in issues[index:index + batch_size]])
+
+        largest = max(projects, key=lambda project: project.issue_total)
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(projects)} projects, {sum(map(len, members.values()))} contributors, "
+            f"{len(issues)} issues and {options['comments']} comments in {time.perf_counter() - start:.1f} s. "
+            f"Largest project: {largest.title} ({largest.issue_total} issues, author {largest.author.username})"
+        ))
+
+    def create_users(self, count, prefix, password, batch_size):
+        # One hash for every user: hashing is the slowest part of create_user
+        password = make_password(password)
+        return User.objects.bulk_create([
+            User(username=f'{prefix}-user-{index}', email=f'{prefix}-user-{index}@example.com', password=password,
+                 age=18 + index % 50, can_be_contacted=index % 2 == 0, can_data_be_shared=index % 3 == 0)
+            for index in range(count)
+        ], batch_size=batch_size)
+
+    def create_projects(self, rng, users, count, issue_count, skew, prefix, batch_size):
+        # Issues per project first, so the big projects also get the most contributors
+        totals = [0] * count
+        for index in rng.choices(range(count), weights=zipf_weights(count, skew), k=issue_count):
+            totals[index] += 1
+
+        projects, members, contributors = [], {}, []
+        for index, total in enumerate(totals):
+            author = rng.choice(users)
+            project = Project(title=f'{prefix} project {index}', description=sentence(rng, 10, 80),
+                              type=rng.choice(Project.TYPE_CHOICES)[0], author=author)
+            project.issue_total = total
+            size = min(len(users), 2 + int(len(users) * total / max(issue_count, 1) * 2))
+            team = [author] + [user for user in rng.sample(users, size) if user != author][:size - 1]
+            members[project.pk] = team
+            contributors += [Contributor(user=user, project=project) for user in team]
+            projects.append(project)
+
+        Project.objects.bulk_create(projects, batch_size=batch_size)
+        Contributor.objects.bulk_create(contributors, batch_size=batch_size)
+        return projects, members
+
+    def create_issues(self, rng, projects, members, batch_size):
+        issues = []
+        for project in projects:
+            team = members[project.pk]
+            for number in range(project.issue_total):
+                issues.append(Issue(
+                    title=f'{sentence(rng, 2, 6)} #{number}', description=sentence(rng, 5, 120),
+                    priority=rng.choice(Issue.PRIORITY_CHOICES)[0], tag=rng.choice(Issue.TAG_CHOICES)[0],
+                    status=rng.choice(Issue.STATUS_CHOICES)[0], project=project, author=rng.choice(team),
+                    assignee=rng.choice(team) if rng.random() < 0.7 else None,
+                ))
+        return Issue.objects.bulk_create(issues, batch_size=batch_size)
+
+    def create_comments(self, rng, issues, members, count, skew, batch_size):
+        # Shuffled, so the long threads are not all in the first project
+        ranked = rng.sample(issues, len(issues))
+        comments = []
+        for number, issue in enumerate(rng.choices(ranked, weights=zipf_weights(len(ranked), skew), k=count)):
+            # The number keeps (author, issue, description) unique
+            comments.append(Comment(description=f'{sentence(rng, 3, 60)} #{number}', issue=issue,
+                                    author=rng.choice(members[issue.project_id])))
+            if len(comments) == batch_size:
+                Comment.objects.bulk_create(comments)
+                comments = []
+        Comment.objects.bulk_create(comments)
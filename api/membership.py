@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+from .models import Contributor
+
+
+CACHE_KEY = 'api:project_ids:{user_id}'
+
+# Attribute used to keep the set on the request, so a request never asks the cache twice
+REQUEST_ATTRIBUTE = '_project_ids'
+
+# Longest a set is kept by a cache local to the process, which the other workers' invalidations never reach
+LOCAL_CACHE_TIMEOUT = 5
+
+
+def get_cache_timeout():
+    timeout = getattr(settings, 'PROJECT_MEMBERSHIP_CACHE_TIMEOUT', 300)
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+        return min(timeout, LOCAL_CACHE_TIMEOUT)
+    return timeout
+
+
+def get_user_project_ids(user):
+    """ Return the set of IDs of the projects the user contributes to, from the cache when possible """
+    key = CACHE_KEY.format(user_id=user.pk)
+    project_ids = cache.get(key)
+    if project_ids is None:
+        # From the primary: a set read from a lagging replica would be cached after the invalidation that follows a
+        # membership change, and outlive the replica's lag
+        project_ids = frozenset(Contributor.objects.using(DEFAULT_DB_ALIAS).filter(user=user)
+                                .values_list('project_id', flat=True))
+        cache.set(key, project_ids, get_cache_timeout())
+    return project_ids
+
+
+def get_request_project_ids(request):
+    """ Same as get_user_project_ids, but memoized on the request for the rest of its lifetime """
+    project_ids = getattr(request, REQUEST_ATTRIBUTE, None)
+    if project_ids is None:
+        project_ids = get_user_project_ids(request.user)
+        setattr(request, REQUEST_ATTRIBUTE, project_ids)
+    return project_ids
+
+
+def membership_filter(user, project_field):
+    """
+    Keep the rows whose project, reached through project_field, the user contributes to, with a semi-join on
+    Contributor: project_id IN (SELECT project_id FROM contributor WHERE user_id = ...). Unlike a JOIN it never
+    duplicates rows, so pagination counts stay plain, and the statement is the same whatever the number of projects.
+    A correlated EXISTS is planned as the same semi-join by PostgreSQL, but SQLite runs it once per row of the outer
+    table, while this form is driven by the (user, project) index of Contributor on both.
+    """
+    return Q(**{f'{project_field}__in': Contributor.objects.filter(user_id=user.pk).values('project_id')})
+
+
+class MembershipScopedMixin:
+    """ Restrict a viewset to the rows of the projects the caller contributes to, for every action """
+    # Path from a row to its project
+    membership_project_field = 'project'
+
+    def scope_to_membership(self, queryset):
+        return queryset.filter(membership_filter(self.request.user, self.membership_project_field))
+
+
+def invalidate_user_project_ids(user_id):
+    cache.delete(CACHE_KEY.format(user_id=user_id))
+
+
+def invalidate_many_project_ids(user_ids):
+    """ Invalidate several users at once, for the bulk paths that do not send model signals """
+    cache.delete_many([CACHE_KEY.format(user_id=user_id) for user_id in user_ids])
@@ -1,10 +1,28 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 import uuid
 
 
-class Project(models.Model):
+class CounterFieldsMixin:
+    """
+    Counters written with F() expressions only, by api.counters and api.versioning. Saving an instance read earlier
+    leaves them out of the UPDATE, so its copy of a counter never overwrites the increments made since.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.attname for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.attname not in deferred
+                                       and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
+
+class Project(CounterFieldsMixin, models.Model):
     TYPE_CHOICES = [
         ('BACKEND', 'Back-end'),
         ('FRONTEND', 'Front-end'),
@@ -19,6 +37,17 @@ class Project(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
                                related_name='authored_projects')
     created_time = models.DateTimeField(auto_now_add=True)
+    # Set by every save, so clients can ask for what changed since their last sync (see api.sync)
+    updated_time = models.DateTimeField(auto_now=True, db_index=True)
+    # Bumped whenever the project, its issues, comments or contributors change (see api.signals)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Maintained by api.counters; open issues are those not FINISHED
+    issue_count = models.IntegerField(default=0, editable=False)
+    open_issue_count = models.IntegerField(default=0, editable=False)
+    contributor_count = models.IntegerField(default=0, editable=False)
+
+    # The version too: a stale copy saved back would roll it back, and the next bump would reuse an old ETag
+    counter_fields = ('version', 'issue_count', 'open_issue_count', 'contributor_count')
 
     class Meta:
         constraints = [
@@ -36,14 +65,18 @@ class Contributor(models.Model):
 
     class Meta:
         constraints = [
+            # Also serves lookups by (user, project), such as the projects of a user
             models.UniqueConstraint(fields=['user', 'project'], name='unique_contributor')
         ]
+        indexes = [
+            models.Index(fields=['project', 'user'], name='contributor_project_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.project.title}"
 
 
-class Issue(models.Model):
+class Issue(CounterFieldsMixin, models.Model):
     PRIORITY_CHOICES = [
         ('LOW', 'Low'),
         ('MEDIUM', 'Medium'),
@@ -73,11 +106,30 @@ class Issue(models.Model):
     assignee = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='assigned_issues',
                                  null=True, blank=True)
     created_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(auto_now=True)
+    # Maintained by api.counters
+    comment_count = models.IntegerField(default=0, editable=False)
+
+    counter_fields = ('comment_count',)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['title', 'project'], name='unique_issue_title_per_project'),
         ]
+        # Serve the (created_time, id) keyset of cursor pagination: its range filter and its ORDER BY
+        indexes = [
+            models.Index(fields=['project', '-created_time', '-id'], name='issue_project_created_idx'),
+            models.Index(fields=['assignee', '-created_time', '-id'], name='issue_assignee_created_idx'),
+            # Changes of a project since a sync watermark
+            models.Index(fields=['project', 'updated_time'], name='issue_project_updated_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded values, so api.stats can tell which counters a save changes
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     def clean(self):
         """Enforce that the assignee must be a contributor to the same project."""
@@ -101,12 +153,117 @@ class Comment(models.Model):
     issue = models.ForeignKey(Issue, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='authored_comments')
     created_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['author_id', 'issue_id', 'description'],
                                     name='unique_comment_per_user_per_issue')
         ]
+        # Serve the (created_time, id) keyset of cursor pagination: its range filter and its ORDER BY
+        indexes = [
+            models.Index(fields=['issue', '-created_time', '-id'], name='comment_issue_created_idx'),
+            models.Index(fields=['issue', 'updated_time'], name='comment_issue_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Comment on {self.issue.title}"
+
+
+class ProjectIssueStat(models.Model):
+    """
+    Number of issues of a project for one value of a dimension (status, priority, tag or assignee),
+    maintained by api.stats so the statistics of a project are a single indexed read.
+    """
+    DIMENSION_CHOICES = [
+        ('status', 'Status'),
+        ('priority', 'Priority'),
+        ('tag', 'Tag'),
+        ('assignee', 'Assignee'),
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='issue_stats')
+    dimension = models.CharField(max_length=8, choices=DIMENSION_CHOICES)
+    # Choice value, or the assignee's ID ('' when unassigned)
+    value = models.CharField(max_length=20, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'dimension', 'value'], name='unique_project_issue_stat')
+        ]
+
+    def __str__(self):
+        return f"{self.project_id} {self.dimension}={self.value}: {self.count}"
+
+
+class IssueSearchDocument(models.Model):
+    """
+    Text of an issue and of its comments, kept up to date by api.search for full-text search.
+    On PostgreSQL the weighted vector is stored here and GIN indexed, on SQLite an FTS5 table mirrors the rows.
+    No database constraint on issue: comment receivers may rewrite the document while its issue is being deleted,
+    and the issue's post_delete receiver removes it afterwards.
+    """
+    issue = models.OneToOneField(Issue, on_delete=models.DO_NOTHING, primary_key=True, db_constraint=False,
+                                 related_name='search_document')
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+')
+    title = models.CharField(max_length=128)
+    description = models.TextField()
+    comments = models.TextField(blank=True)
+    vector = SearchVectorField(null=True)
+
+    def __str__(self):
+        return self.title
+
+
+class Tombstone(models.Model):
+    """
+    Deleted issue or comment, kept for api.sync so clients learn about deletions since their last sync.
+    Plain columns rather than foreign keys: the rows they point to are gone.
+    """
+    KIND_CHOICES = [
+        ('ISSUE', 'Issue'),
+        ('COMMENT', 'Comment'),
+    ]
+
+    project_id = models.UUIDField()
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    object_id = models.UUIDField()
+    deleted_time = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project_id', 'deleted_time'], name='tombstone_project_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+class DeletionJob(models.Model):
+    """ Deletion of a project or a user and of everything under it, run in the background by api.deletion """
+    KIND_CHOICES = [
+        ('PROJECT', 'Project'),
+        ('USER', 'User'),
+    ]
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    # Primary key of the project or the user, as text; no foreign key since the row goes away
+    target_id = models.CharField(max_length=36)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='PENDING')
+    # Rows deleted so far, by model label
+    deleted = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.target_id}: {self.status}"
@@ -0,0 +1,108 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
+from rest_framework.settings import api_settings
+
+
+class CreatedTimeCursorPagination(CursorPagination):
+    """
+    Keyset pagination on (created_time, id), newest first. The cursor holds the created_time and id of the row a
+    page starts after, and the page is read with created_time <= c AND (created_time < c OR id < i): a range on the
+    (..., -created_time, -id) indexes, with no COUNT and no OFFSET, so a page costs the same however deep it is and
+    rows sharing a created_time are neither skipped nor repeated. The order is fixed: ?ordering= is refused.
+    """
+    ordering = ('-created_time', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        if api_settings.ORDERING_PARAM in request.query_params:
+            raise ValidationError({api_settings.ORDERING_PARAM: [
+                'Cursor pagination is ordered by creation time, newest first.']})
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        if self.cursor is not None and self.cursor.position is not None:
+            created_time, pk = self.parse_position(self.cursor.position, queryset.model)
+            # Rows after the position, or before it when walking back to a previous page
+            after = 'gt' if reverse else 'lt'
+            queryset = queryset.filter(**{f'created_time__{after}e': created_time}).filter(
+                Q(**{f'created_time__{after}': created_time}) | Q(**{f'id__{after}': pk}))
+        queryset = queryset.order_by(*(('created_time', 'id') if reverse else self.ordering))
+
+        # One row more than the page tells whether there is another page
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def parse_position(self, position, model):
+        created_time, _, pk = position.partition('|')
+        try:
+            created_time = parse_datetime(created_time)
+            pk = model._meta.pk.to_python(pk)
+        except (ValueError, DjangoValidationError):
+            created_time = None
+        if created_time is None or pk is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_time, pk
+
+    def get_position(self, row):
+        return f'{row.created_time.isoformat()}|{row.id}'
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.get_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.get_position(self.page[0])))
+
+
+class CursorOrPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination by default, cursor pagination when the client asks for it with ?pagination=cursor
+    (the parameter is kept in the next/previous links) or follows a cursor link.
+    """
+    mode_query_param = 'pagination'
+    cursor_pagination_class = CreatedTimeCursorPagination
+
+    def uses_cursor(self, request):
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.cursor_pagination_class.cursor_query_param in request.query_params)
+
+    def get_cursor_columns(self, request, queryset, view=None):
+        """ Fields the cursor position is read from, which the rows of a page must carry """
+        if not self.uses_cursor(request):
+            return []
+        ordering = self.cursor_pagination_class().get_ordering(request, queryset, view)
+        return [field.lstrip('-') for field in ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.uses_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,5 +1,6 @@
 from rest_framework import permissions
 
+from .membership import get_request_project_ids
 from .models import Comment
 
 
@@ -12,7 +13,8 @@ class IsAuthor(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.author == request.user
+        # Compare the foreign key value so the author row is never loaded
+        return obj.author_id == request.user.id
 
 
 class IsProjectContributor(permissions.BasePermission):
@@ -21,14 +23,16 @@ class IsProjectContributor(permissions.BasePermission):
     """
 
     def has_object_permission(self, request, view, obj):
-        # If obj is Comment, we get his related project from Issue
+        # If obj is Comment, we get his related project from Issue (CommentViewSet annotates it as project_id)
         if isinstance(obj, Comment):
-            project = obj.issue.project
+            project_id = getattr(obj, 'project_id', None) or obj.issue.project_id
         # If obj has project attribute then it's an Issue, so we get his related project
-        elif hasattr(obj, 'project'):
-            project = obj.project
+        elif hasattr(obj, 'project_id'):
+            project_id = obj.project_id
         # Else it means that obj is Project, so we just get it
         else:
-            project = obj
+            project_id = obj.pk
+
+        # The membership set is cached, so this check does not hit the database
+        return project_id in get_request_project_ids(request)
 
-        return project.contributors.filter(user=request.user).exists()
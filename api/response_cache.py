@@ -0,0 +1,78 @@
+import pickle
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60,
+    # Responses bigger than this many bytes (pickled) are not stored
+    'MAX_ENTRY_SIZE': 256 * 1024,
+}
+
+KEY_PREFIX = 'api:response'
+HITS_KEY = 'api:response_cache:hits'
+MISSES_KEY = 'api:response_cache:misses'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'API_RESPONSE_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE_ALIAS']]
+
+
+def increment(key):
+    cache = get_cache()
+    # add() is a no-op when the counter exists, so incr() never sees a missing key
+    cache.add(key, 0, None)
+    cache.incr(key)
+
+
+def get_stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+
+class ResponseCacheMixin:
+    """
+    Opt-in cache of list responses (settings.API_RESPONSE_CACHE). Entries are keyed by the user and the ETag
+    computed by ConditionalGetMixin, which covers the query params (filters, ordering, page or cursor) and
+    the version of every project read. Saving or deleting any api model bumps those versions, so stale
+    entries are never read again and simply expire after TIMEOUT.
+    Must come after ConditionalGetMixin in the bases.
+    """
+
+    def list(self, request, *args, **kwargs):
+        config = get_config()
+        etag = getattr(self, 'etag', None)
+        if not config['ENABLED'] or etag is None:
+            return super().list(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = ':'.join([KEY_PREFIX, str(request.user.pk), etag.strip('"')])
+        payload = cache.get(key)
+        if payload is not None:
+            increment(HITS_KEY)
+            return Response(pickle.loads(payload), headers={'X-Cache': 'HIT'})
+
+        increment(MISSES_KEY)
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            # Pickled here once, so the size check and the cache share the same bytes
+            payload = pickle.dumps(response.data, pickle.HIGHEST_PROTOCOL)
+            if len(payload) <= config['MAX_ENTRY_SIZE']:
+                cache.set(key, payload, config['TIMEOUT'])
+            response['X-Cache'] = 'MISS'
+        return response
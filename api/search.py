@@ -0,0 +1,147 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F
+
+from .models import Issue, Comment, IssueSearchDocument
+
+
+SEARCH_CONFIG = 'english'
+
+FTS_TABLE = 'api_issue_fts'
+
+# Weights of a match in the title, the description and the comments
+WEIGHTS = ('A', 'B', 'C')
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+
+def create_search_index(using_connection=connection):
+    """ Create the engine specific part of the index; called after migrate """
+    with using_connection.cursor() as cursor:
+        if using_connection.vendor == 'postgresql':
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS issue_search_vector_gin '
+                           f'ON {IssueSearchDocument._meta.db_table} USING gin (vector)')
+        elif using_connection.vendor == 'sqlite':
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                           f'USING fts5(issue_id UNINDEXED, project_id UNINDEXED, title, description, comments)')
+
+
+def refresh_engine_index(documents):
+    """ Bring the engine index in line with the given documents """
+    if not documents:
+        return
+    if connection.vendor == 'postgresql':
+        IssueSearchDocument.objects.filter(pk__in=[document.pk for document in documents]).update(vector=(
+            SearchVector('title', weight=WEIGHTS[0], config=SEARCH_CONFIG)
+            + SearchVector('description', weight=WEIGHTS[1], config=SEARCH_CONFIG)
+            + SearchVector('comments', weight=WEIGHTS[2], config=SEARCH_CONFIG)
+        ))
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(documents))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE issue_id IN ({placeholders})',
+                           [document.pk.hex for document in documents])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (issue_id, project_id, title, description, comments) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                [(document.pk.hex, document.project_id.hex, document.title, document.description,
+                  document.comments) for document in documents])
+
+
+def update_issue_search_document(issue, created):
+    """ Follow a saved issue; its comments are unchanged, so they are not read again """
+    if created:
+        document = IssueSearchDocument.objects.create(issue_id=issue.pk, project_id=issue.project_id,
+                                                      title=issue.title, description=issue.description)
+    else:
+        document = IssueSearchDocument.objects.filter(pk=issue.pk).first()
+        if document is None:
+            update_search_documents([issue.pk])
+            return
+        if (document.title, document.description) == (issue.title, issue.description):
+            return
+        document.title, document.description = issue.title, issue.description
+        document.save(update_fields=['title', 'description'])
+    refresh_engine_index([document])
+
+
+def index_new_issues(issues):
+    """ Documents of issues created in bulk: they have no comments yet, so nothing needs to be read back """
+    documents = IssueSearchDocument.objects.bulk_create([
+        IssueSearchDocument(issue_id=issue.pk, project_id=issue.project_id, title=issue.title,
+                            description=issue.description)
+        for issue in issues
+    ])
+    refresh_engine_index(documents)
+
+
+def update_search_documents(issue_ids):
+    """
+    Rebuild the search documents of the given issues (UUIDs) with one query for the issues and one for their
+    comments, then refresh the engine index for those rows only.
+    """
+    issue_ids = list(issue_ids)
+    if not issue_ids:
+        return
+    comments = {}
+    for issue_id, description in (Comment.objects.filter(issue_id__in=issue_ids).order_by('created_time')
+                                  .values_list('issue_id', 'description')):
+        comments.setdefault(issue_id, []).append(description)
+    documents = [
+        IssueSearchDocument(issue_id=row['id'], project_id=row['project_id'], title=row['title'],
+                            description=row['description'], comments='\n'.join(comments.get(row['id'], [])))
+        for row in Issue.objects.filter(pk__in=issue_ids).values('id', 'project_id', 'title', 'description')
+    ]
+
+    IssueSearchDocument.objects.filter(pk__in=issue_ids).delete()
+    IssueSearchDocument.objects.bulk_create(documents)
+    refresh_engine_index(documents)
+
+
+def add_comment_to_search_document(comment):
+    """ Append a new comment to the document of its issue instead of reading the whole thread again """
+    document = IssueSearchDocument.objects.filter(pk=comment.issue_id).first()
+    if document is None:
+        update_search_documents([comment.issue_id])
+        return
+    document.comments = '\n'.join(filter(None, [document.comments, comment.description]))
+    document.save(update_fields=['comments'])
+    refresh_engine_index([document])
+
+
+def delete_search_documents(issue_ids):
+    issue_ids = list(issue_ids)
+    IssueSearchDocument.objects.filter(pk__in=issue_ids).delete()
+    if connection.vendor == 'sqlite' and issue_ids:
+        with connection.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(issue_ids))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE issue_id IN ({placeholders})',
+                           [issue_id.hex for issue_id in issue_ids])
+
+
+def fts_query(text):
+    """ Quote every term so user input is never read as FTS5 syntax; terms are ANDed """
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in text.split())
+
+
+def search_issue_ids(text, project_ids, limit):
+    """ Return the IDs of the best matching issues of the given projects, best first """
+    project_ids = list(project_ids)
+    if not text.split() or not project_ids:
+        return []
+
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        return list(IssueSearchDocument.objects
+                    .filter(project_id__in=project_ids, vector=query)
+                    .annotate(rank=SearchRank(F('vector'), query))
+                    .order_by('-rank')
+                    .values_list('issue_id', flat=True)[:limit])
+
+    placeholders = ', '.join(['%s'] * len(project_ids))
+    with connection.cursor() as cursor:
+        # bm25() is lower for better matches
+        cursor.execute(
+            f'SELECT issue_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND project_id IN ({placeholders}) '
+            f'ORDER BY bm25({FTS_TABLE}, 0, 0, {", ".join(map(str, FTS_WEIGHTS))}) LIMIT %s',
+            [fts_query(text), *[project_id.hex for project_id in project_ids], limit])
+        return [row[0] for row in cursor.fetchall()]
@@ -1,15 +1,92 @@
-from rest_framework import serializers
-from .models import Project, Contributor, Issue, Comment
+from django.db import models
+from django.db.models import Prefetch
+from rest_framework import permissions, serializers
+from .instrumentation import timed
+from .models import Project, Contributor, Issue, Comment, DeletionJob
 from authentication.models import User
 
 
+def get_sparse_field_names(query_params, field_names):
+    """
+    Return the serializer fields kept by ?fields= (comma separated names to keep) and ?omit= (names to drop).
+    Unknown names are ignored.
+    """
+    kept = set(field_names)
+    if query_params.get('fields'):
+        kept &= {name.strip() for name in query_params['fields'].split(',')}
+    if query_params.get('omit'):
+        kept -= {name.strip() for name in query_params['omit'].split(',')}
+    return kept
+
+
+class EagerLoadingMixin:
+    """
+    Let a serializer declare the related rows it reads, so the viewset can load them up front
+    instead of issuing one query per object.
+    Serializers bound to a request drop the fields left out by ?fields= / ?omit=, and setup_eager_loading skips
+    the joins, prefetches and large columns of those fields when given the request.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only the serializer built by the view gets the request; nested serializers keep all their fields.
+        # Writes keep every field, so ?fields= never hides an input.
+        request = self._context.get('request')
+        if request is not None and request.method in permissions.SAFE_METHODS:
+            kept = get_sparse_field_names(request.query_params, self.fields)
+            for name in list(self.fields):
+                if name not in kept:
+                    self.fields.pop(name)
+
+    def to_representation(self, instance):
+        # Reported in the Server-Timing header; nested serializers are counted with their parent
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+    @classmethod
+    def get_deferred_columns(cls, dropped):
+        """
+        Text columns only read by dropped fields. Smaller columns are always loaded: skipping them saves little,
+        and reading one later on would cost a query per object.
+        """
+        fields = cls().fields
+        sources = {field.source for name, field in fields.items() if name not in dropped}
+        model = cls.Meta.model
+        return [field.name for field in model._meta.concrete_fields
+                if isinstance(field, models.TextField) and field.name not in sources]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        dropped = set()
+        if request is not None and request.method in permissions.SAFE_METHODS:
+            field_names = list(cls().fields)
+            dropped = set(field_names) - get_sparse_field_names(request.query_params, field_names)
+
+        select_related_fields = [name for name in cls.select_related_fields if name not in dropped]
+        prefetch_related_fields = [lookup for lookup in cls.prefetch_related_fields
+                                   if getattr(lookup, 'prefetch_to', lookup) not in dropped]
+        if select_related_fields:
+            queryset = queryset.select_related(*select_related_fields)
+        if prefetch_related_fields:
+            queryset = queryset.prefetch_related(*prefetch_related_fields)
+        if dropped:
+            deferred = cls.get_deferred_columns(dropped)
+            if deferred:
+                queryset = queryset.defer(*deferred)
+        return queryset
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
 
-class ContributorSerializer(serializers.ModelSerializer):
+class ContributorSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('user',)
+
     user = UserSerializer(read_only=True)
     user_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), write_only=True, source='user')
 
@@ -19,16 +96,27 @@ class ContributorSerializer(serializers.ModelSerializer):
         read_only_fields = ['project', 'created_time']
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class ContributorBulkSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+
+
+class CommentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('author',)
+
     author = UserSerializer(read_only=True)
 
     class Meta:
         model = Comment
-        fields = ['id', 'description', 'issue', 'author', 'created_time']
-        read_only_fields = ['author', 'created_time']
+        fields = ['id', 'description', 'issue', 'author', 'created_time', 'updated_time']
+        read_only_fields = ['author', 'created_time', 'updated_time']
 
 
-class DetailedIssueSerializer(serializers.ModelSerializer):
+class DetailedIssueSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('author', 'assignee')
+    prefetch_related_fields = (
+        Prefetch('comments', queryset=CommentSerializer.setup_eager_loading(Comment.objects.all())),
+    )
+
     author = UserSerializer(read_only=True)
     assignee = UserSerializer(read_only=True)
     assignee_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), write_only=True, source='assignee',
@@ -38,18 +126,19 @@ class DetailedIssueSerializer(serializers.ModelSerializer):
     class Meta:
         model = Issue
         fields = ['id', 'title', 'description', 'tag', 'priority', 'status', 'project', 'author', 'assignee',
-                  'assignee_id', 'comments', 'created_time']
-        read_only_fields = ['author', 'project', 'created_time']
+                  'assignee_id', 'comments', 'comment_count', 'created_time', 'updated_time']
+        read_only_fields = ['author', 'project', 'comment_count', 'created_time', 'updated_time']
 
 
-class IssueSerializer(serializers.ModelSerializer):
+class IssueSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     assignee_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), write_only=True, source='assignee',
                                                      required=False, allow_null=True)
 
     class Meta:
         model = Issue
-        fields = ['id', 'title', 'description', 'tag', 'priority', 'status', 'project', 'assignee_id', 'created_time']
-        read_only_fields = ['project', 'created_time']
+        fields = ['id', 'title', 'description', 'tag', 'priority', 'status', 'project', 'assignee_id', 'comment_count',
+                  'created_time', 'updated_time']
+        read_only_fields = ['project', 'comment_count', 'created_time', 'updated_time']
 
     def validate_assignee_id(self, value):
         """ Ensure that the assignee is a contributor of the project """
@@ -62,7 +151,41 @@ class IssueSerializer(serializers.ModelSerializer):
         return value
 
 
-class DetailedProjectSerializer(serializers.ModelSerializer):
+class IssueBatchCreateSerializer(serializers.ModelSerializer):
+    """ One issue to create in a batch; the assignee is checked against the project by the batch action """
+    assignee_id = serializers.IntegerField(required=False, allow_null=True)
+
+    class Meta:
+        model = Issue
+        fields = ['title', 'description', 'tag', 'priority', 'status', 'assignee_id']
+
+
+class IssueBatchUpdateSerializer(serializers.Serializer):
+    """ Partial update of one issue in a batch """
+    id = serializers.UUIDField()
+    status = serializers.ChoiceField(choices=Issue.STATUS_CHOICES, required=False)
+    priority = serializers.ChoiceField(choices=Issue.PRIORITY_CHOICES, required=False)
+    assignee_id = serializers.IntegerField(required=False, allow_null=True)
+
+
+class IssueBatchSerializer(serializers.Serializer):
+    project = serializers.UUIDField()
+    create = serializers.ListField(child=serializers.DictField(), required=False, max_length=1000)
+    update = serializers.ListField(child=serializers.DictField(), required=False, max_length=1000)
+
+    def validate(self, attrs):
+        if not attrs.get('create') and not attrs.get('update'):
+            raise serializers.ValidationError('Nothing to create or update')
+        return attrs
+
+
+class DetailedProjectSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('author',)
+    prefetch_related_fields = (
+        Prefetch('issues', queryset=IssueSerializer.setup_eager_loading(Issue.objects.all())),
+        Prefetch('contributors', queryset=ContributorSerializer.setup_eager_loading(Contributor.objects.all())),
+    )
+
     author = UserSerializer(read_only=True)
     issues = IssueSerializer(many=True, read_only=True)
 
@@ -70,16 +193,26 @@ class DetailedProjectSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Project
-        fields = ['id', 'title', 'description', 'type', 'author', 'issues', 'contributors', 'created_time']
-        read_only_fields = ['author', 'created_time']
+        fields = ['id', 'title', 'description', 'type', 'author', 'issues', 'contributors', 'issue_count',
+                  'open_issue_count', 'contributor_count', 'created_time', 'updated_time']
+        read_only_fields = ['author', 'issue_count', 'open_issue_count', 'contributor_count', 'created_time',
+                            'updated_time']
 
     def get_contributors(self, obj):
-        contributors = Contributor.objects.filter(project=obj)
+        # Uses the rows prefetched by setup_eager_loading instead of querying per project
+        contributors = obj.contributors.all()
         return ContributorSerializer(contributors, many=True).data
 
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Project
-        fields = ['id', 'title', 'description', 'type', 'created_time']
-        read_only_fields = ['created_time']
+        fields = ['id', 'title', 'description', 'type', 'issue_count', 'open_issue_count', 'contributor_count',
+                  'created_time', 'updated_time']
+        read_only_fields = ['issue_count', 'open_issue_count', 'contributor_count', 'created_time', 'updated_time']
+
+
+class DeletionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeletionJob
+        fields = ['id', 'kind', 'status', 'deleted', 'created_time', 'updated_time']
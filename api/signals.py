@@ -0,0 +1,128 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .counters import add_counts
+from .events import publish_comments, publish_issues, publish_membership
+from .membership import invalidate_user_project_ids
+from .models import Project, Contributor, Issue, Comment
+from .stats import record_issues
+from .sync import record_tombstones
+from .search import (add_comment_to_search_document, delete_search_documents, update_issue_search_document,
+                     update_search_documents)
+from .versioning import bump_project_version, bump_project_version_of_issue
+
+
+@receiver(post_save, sender=Contributor)
+def contributor_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate_user_project_ids(instance.user_id)
+        publish_membership(instance.project_id, [instance.user_id])
+    bump_project_version(instance.project_id, contributor_count=1 if created else 0)
+
+
+@receiver(post_delete, sender=Contributor)
+def contributor_deleted(sender, instance, **kwargs):
+    invalidate_user_project_ids(instance.user_id)
+    publish_membership(instance.project_id, [instance.user_id])
+    bump_project_version(instance.project_id, contributor_count=-1)
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, **kwargs):
+    if not created:
+        bump_project_version(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    bump_project_version_of_issue(instance.issue_id)
+
+
+@receiver(post_save, sender=Issue)
+def count_issue(sender, instance, created, **kwargs):
+    # Also bumps the project version, with the issue counts in the same UPDATE
+    record_issues([instance], created=created)
+
+
+@receiver(post_delete, sender=Issue)
+def uncount_issue(sender, instance, **kwargs):
+    record_issues([instance], deleted=True)
+
+
+@receiver(post_save, sender=Issue)
+def index_issue(sender, instance, created, **kwargs):
+    update_issue_search_document(instance, created)
+
+
+@receiver(post_delete, sender=Issue)
+def unindex_issue(sender, instance, **kwargs):
+    delete_search_documents([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        add_counts(Issue, [instance.issue_id], comment_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    add_counts(Issue, [instance.issue_id], comment_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, created, **kwargs):
+    if created:
+        add_comment_to_search_document(instance)
+    else:
+        update_search_documents([instance.issue_id])
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    update_search_documents([instance.issue_id])
+
+
+@receiver(post_delete, sender=Issue)
+def bury_issue(sender, instance, **kwargs):
+    record_tombstones('ISSUE', [(instance.project_id, instance.pk)])
+
+
+def get_comment_project_id(comment):
+    # CommentViewSet annotates the project ID; comments deleted with their issue still have it to read
+    project_id = getattr(comment, 'project_id', None)
+    if project_id is None and Comment.issue.is_cached(comment):
+        project_id = comment.issue.project_id
+    if project_id is None:
+        project_id = Issue.objects.filter(pk=comment.issue_id).values_list('project_id', flat=True).first()
+    return project_id
+
+
+@receiver(post_delete, sender=Comment)
+def bury_comment(sender, instance, **kwargs):
+    project_id = get_comment_project_id(instance)
+    if project_id is not None:
+        record_tombstones('COMMENT', [(project_id, instance.pk)])
+
+
+@receiver(post_save, sender=Issue)
+def publish_issue(sender, instance, created, **kwargs):
+    publish_issues('created' if created else 'updated', [instance])
+
+
+@receiver(post_delete, sender=Issue)
+def publish_issue_deletion(sender, instance, **kwargs):
+    publish_issues('deleted', [instance])
+
+
+@receiver(post_save, sender=Comment)
+def publish_comment(sender, instance, created, **kwargs):
+    publish_comments('created' if created else 'updated', [(get_comment_project_id(instance), instance)])
+
+
+@receiver(post_delete, sender=Comment)
+def publish_comment_deletion(sender, instance, **kwargs):
+    project_id = get_comment_project_id(instance)
+    if project_id is not None:
+        publish_comments('deleted', [(project_id, instance)])
@@ -0,0 +1,157 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from .counters import issue_counts
+from .models import Issue, ProjectIssueStat
+from .versioning import bump_project_version
+
+
+DIMENSIONS = {
+    'status': 'status',
+    'priority': 'priority',
+    'tag': 'tag',
+    'assignee': 'assignee_id',
+}
+
+
+def stat_keys(values):
+    """ The (dimension, value) pairs an issue counts for, from a mapping of attribute names to values """
+    return [(dimension, '' if values[attname] is None else str(values[attname]))
+            for dimension, attname in DIMENSIONS.items()]
+
+
+def current_values(issue):
+    return {attname: getattr(issue, attname) for attname in DIMENSIONS.values()}
+
+
+def apply_deltas(project_id, deltas):
+    """
+    Add the deltas to their counters in one UPDATE of F() + CASE, so concurrent writers never lose an increment.
+    Counters about to be incremented are first created at 0 if missing.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    ProjectIssueStat.objects.bulk_create([
+        ProjectIssueStat(project_id=project_id, dimension=dimension, value=value, count=0)
+        for (dimension, value), delta in deltas.items() if delta > 0
+    ], ignore_conflicts=True)
+
+    keys = Q()
+    whens = []
+    for (dimension, value), delta in deltas.items():
+        keys |= Q(dimension=dimension, value=value)
+        whens.append(When(dimension=dimension, value=value, then=Value(delta)))
+    ProjectIssueStat.objects.filter(keys, project_id=project_id).update(
+        count=F('count') + Case(*whens, default=Value(0), output_field=IntegerField()))
+
+
+def issue_deltas(issue, created=False, deleted=False):
+    """ Counter changes caused by saving or deleting an issue """
+    deltas = Counter()
+    loaded = getattr(issue, '_loaded_values', None)
+    if deleted:
+        # The row being deleted, when it was read
+        has_loaded = loaded is not None and set(DIMENSIONS.values()) <= set(loaded)
+        deltas.subtract(stat_keys(loaded if has_loaded else current_values(issue)))
+        return deltas
+    deltas.update(stat_keys(current_values(issue)))
+    if not created:
+        if loaded is None or not set(DIMENSIONS.values()) <= set(loaded):
+            # Without the loaded values the change cannot be computed; the rebuild command fixes it
+            return Counter()
+        deltas.subtract(stat_keys(loaded))
+    return deltas
+
+
+def remember_values(issue):
+    """ After a save, the current values become the base of the next change """
+    loaded = getattr(issue, '_loaded_values', None) or {}
+    issue._loaded_values = {**loaded, **current_values(issue)}
+
+
+def lock_loaded_values(issues):
+    """
+    Lock the rows of the issues until the transaction ends and reload the values their counters were counted with,
+    so that of two concurrent writes of an issue the second counts its change from the row the first wrote.
+    Returns the issues whose rows still exist.
+    """
+    rows = {row['pk']: row for row in Issue.objects.select_for_update().filter(pk__in=[issue.pk for issue in issues])
+            .values('pk', *DIMENSIONS.values())}
+    locked = []
+    for issue in issues:
+        row = rows.get(issue.pk)
+        if row is not None:
+            loaded = getattr(issue, '_loaded_values', None) or {}
+            issue._loaded_values = {**loaded, **{attname: row[attname] for attname in DIMENSIONS.values()}}
+            locked.append(issue)
+    return locked
+
+
+def count_issues(issues, created=False, deleted=False, by_project=None):
+    """
+    The counter changes of several issues by project, added to by_project when given; the current values of the
+    issues become the base of their next change
+    """
+    by_project = {} if by_project is None else by_project
+    for issue in issues:
+        by_project.setdefault(issue.project_id, Counter()).update(issue_deltas(issue, created, deleted))
+        if not deleted:
+            remember_values(issue)
+    return by_project
+
+
+def record_counts(by_project):
+    """
+    Apply counter changes by project to the statistics, and to the issue counts of the projects in the UPDATE that
+    bumps their versions
+    """
+    for project_id, deltas in by_project.items():
+        apply_deltas(project_id, deltas)
+        bump_project_version(project_id, **issue_counts(deltas))
+
+
+def record_issues(issues, created=False, deleted=False):
+    """
+    Apply the counter changes of several issues at once, as the bulk paths need, and bump the versions of their
+    projects
+    """
+    record_counts(count_issues(issues, created, deleted))
+
+
+def rebuild_project_stats(project_ids=None):
+    """ Recompute the counters from the issues with a single GROUP BY query """
+    issues = Issue.objects.all()
+    stats = ProjectIssueStat.objects.all()
+    if project_ids is not None:
+        issues = issues.filter(project_id__in=project_ids)
+        stats = stats.filter(project_id__in=project_ids)
+
+    counts = Counter()
+    for row in issues.values('project_id', *DIMENSIONS.values()).annotate(total=Count('id')).order_by():
+        for key in stat_keys(row):
+            counts[(row['project_id'], *key)] += row['total']
+
+    with transaction.atomic():
+        stats.delete()
+        ProjectIssueStat.objects.bulk_create([
+            ProjectIssueStat(project_id=project_id, dimension=dimension, value=value, count=count)
+            for (project_id, dimension, value), count in counts.items()
+        ])
+    return len(counts)
+
+
+def get_project_stats(project_id):
+    """ Statistics of a project read from its counters """
+    stats = {'total': 0, 'status': {}, 'priority': {}, 'tag': {}, 'assignee': []}
+    for dimension, value, count in (ProjectIssueStat.objects.filter(project_id=project_id, count__gt=0)
+                                    .values_list('dimension', 'value', 'count')):
+        if dimension == 'assignee':
+            stats['assignee'].append({'assignee': int(value) if value else None, 'count': count})
+        else:
+            stats[dimension][value] = count
+            if dimension == 'status':
+                stats['total'] += count
+    return stats
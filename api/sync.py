@@ -0,0 +1,174 @@
+"""
+Delta sync of a project.
+
+Issues and comments carry an indexed updated_time and deletions leave a Tombstone, so a client holding a watermark
+from its last sync only downloads the rows created, changed or deleted after it. The next watermark is the time the
+sync started minus OVERLAP seconds: a transaction that commits after a sync with an earlier updated_time is still
+returned by the next one, at the cost of sending the rows of the last OVERLAP seconds twice (clients upsert by ID).
+Tombstones are kept TOMBSTONE_RETENTION_DAYS days; an older watermark cannot be served and the client starts over.
+
+A sync answers at most PAGE_SIZE issues, comments and deletions per page. Each list is read in (time, id) order
+from where the previous page stopped, with a range filter rather than an OFFSET; the cursor of the next page holds
+those positions and the watermark of the first page, which the client keeps once it has read the last page.
+"""
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Issue, Comment, Tombstone
+
+
+DEFAULTS = {
+    # Seconds of changes sent again by the next sync, for transactions still open when a sync reads
+    'OVERLAP': 5,
+    'TOMBSTONE_RETENTION_DAYS': 30,
+    # Rows deleted per query by purge_tombstones
+    'PURGE_BATCH_SIZE': 1000,
+    # Issues, comments and deletions sent at most by one page of a sync
+    'PAGE_SIZE': 500,
+}
+
+# Lists of a sync, with the time column they are read in order of
+STREAMS = {'issues': 'updated_time', 'comments': 'updated_time', 'deleted': 'deleted_time'}
+
+
+class WatermarkExpired(Exception):
+    pass
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SYNC', {})}
+
+
+def parse_watermark(value):
+    """ The datetime of a watermark, or None when it is not one """
+    try:
+        watermark = parse_datetime(value)
+    except ValueError:
+        return None
+    if watermark is not None and timezone.is_naive(watermark):
+        return None
+    return watermark
+
+
+def record_tombstones(kind, rows):
+    """ Tombstones of (project ID, object ID) pairs, for the deletions that bypass the post_delete receivers """
+    Tombstone.objects.bulk_create([Tombstone(project_id=project_id, kind=kind, object_id=object_id)
+                                   for project_id, object_id in rows])
+
+
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+
+def decode_cursor(value):
+    """ The state of the next page: since, watermark and the position reached in each list (None when done) """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(value.encode()))
+        since = parse_watermark(state['since']) if state['since'] is not None else None
+        watermark = parse_watermark(state['watermark'])
+        positions = {}
+        for stream in STREAMS:
+            position = state['positions'][stream]
+            positions[stream] = None if position is None else (parse_watermark(position[0]), str(position[1]))
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+        raise InvalidCursor()
+    if watermark is None or (state['since'] is not None and since is None) or any(
+            position is not None and position[0] is None for position in positions.values()):
+        raise InvalidCursor()
+    return since, watermark, positions
+
+
+def read_page(queryset, time_field, position, page_size):
+    """ Up to page_size rows after position in (time_field, id) order, and the position of the next page or None """
+    if position is not None:
+        time, pk = position
+        try:
+            pk = queryset.model._meta.pk.to_python(pk)
+        except ValidationError:
+            raise InvalidCursor()
+        queryset = queryset.filter(**{f'{time_field}__gte': time}).filter(
+            Q(**{f'{time_field}__gt': time}) | Q(pk__gt=pk))
+    rows = list(queryset.order_by(time_field, 'pk')[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (getattr(rows[-1], time_field).isoformat(), str(rows[-1].pk))
+
+
+def get_changes(project, since, issue_serializer, comment_serializer, request, cursor=None):
+    """
+    One page of the issues and comments of the project changed after since, and of the IDs of those deleted after
+    it. since=None returns every issue and comment and no deletions. cursor is the 'cursor' of the previous page,
+    whose since and watermark it keeps. Raises WatermarkExpired when the tombstones of that period were purged,
+    InvalidCursor when the cursor cannot be read.
+    """
+    config = get_config()
+    started = timezone.now()
+    if cursor is None:
+        watermark = started - timedelta(seconds=config['OVERLAP'])
+        positions = dict.fromkeys(STREAMS)
+    else:
+        since, watermark, positions = decode_cursor(cursor)
+    if since is not None and since < started - timedelta(days=config['TOMBSTONE_RETENTION_DAYS']):
+        raise WatermarkExpired()
+
+    querysets = {
+        'issues': issue_serializer.setup_eager_loading(Issue.objects.filter(project=project), request),
+        'comments': comment_serializer.setup_eager_loading(Comment.objects.filter(issue__project=project), request),
+        'deleted': Tombstone.objects.filter(project_id=project.pk).only('kind', 'object_id', 'deleted_time'),
+    }
+    pages, next_positions = {}, {}
+    for stream, time_field in STREAMS.items():
+        queryset = querysets[stream]
+        if since is not None:
+            queryset = queryset.filter(**{f'{time_field}__gt': since})
+        elif stream == 'deleted':
+            queryset = queryset.none()
+        if cursor is not None and positions[stream] is None:
+            # Finished on an earlier page
+            pages[stream], next_positions[stream] = [], None
+            continue
+        pages[stream], next_positions[stream] = read_page(queryset, time_field, positions[stream],
+                                                          config['PAGE_SIZE'])
+
+    has_more = any(position is not None for position in next_positions.values())
+    context = {'request': request}
+    deleted = {'issues': [], 'comments': []}
+    for tombstone in pages['deleted']:
+        deleted['issues' if tombstone.kind == 'ISSUE' else 'comments'].append(tombstone.object_id)
+    return {
+        'watermark': watermark,
+        'issues': issue_serializer(pages['issues'], many=True, context=context).data,
+        'comments': comment_serializer(pages['comments'], many=True, context=context).data,
+        'deleted': deleted,
+        'has_more': has_more,
+        'cursor': encode_cursor({
+            'since': since.isoformat() if since is not None else None,
+            'watermark': watermark.isoformat(),
+            'positions': next_positions,
+        }) if has_more else None,
+    }
+
+
+def purge_tombstones(batch_size=None):
+    """ Delete the tombstones older than the retention a batch at a time; return the count """
+    config = get_config()
+    batch_size = batch_size or config['PURGE_BATCH_SIZE']
+    limit = timezone.now() - timedelta(days=config['TOMBSTONE_RETENTION_DAYS'])
+    deleted = 0
+    while True:
+        ids = list(Tombstone.objects.filter(deleted_time__lte=limit).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Tombstone.objects.filter(pk__in=ids).delete()[0]
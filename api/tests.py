@@ -1,3 +1,1759 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import re
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from authentication.models import User
+from .deletion import Deleter, delete_rows
+from .events import EventStream, hub, project_channel
+from .export import stream_ndjson
+from .management.commands.benchmark_endpoints import route_names
+from .fast_serialization import compile_serializer
+from .instrumentation import histograms
+from .membership import LOCAL_CACHE_TIMEOUT, get_cache_timeout, get_user_project_ids
+from .renderers import FastJSONRenderer
+from .response_cache import get_stats, reset_stats
+from .search import delete_search_documents
+from .serializers import DetailedProjectSerializer, IssueSerializer
+from .sync import encode_cursor
+from .stats import get_project_stats, lock_loaded_values, rebuild_project_stats
+from .counters import repair_counts
+from .models import (Project, Contributor, Issue, Comment, IssueSearchDocument, ProjectIssueStat,
+                     DeletionJob, Tombstone)
+
+
+class SoftDeskTestCase(TestCase):
+    """Shared helpers to build projects, issues and comments for the API tests."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', age=30)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self._counter = 0
+
+    def _next(self):
+        self._counter += 1
+        return self._counter
+
+    def make_user(self):
+        return User.objects.create_user(username=f'user{self._next()}', age=30)
+
+    def make_project(self, author=None):
+        author = author or self.user
+        project = Project.objects.create(title=f'Project {self._next()}', description='Description',
+                                         type='BACKEND', author=author)
+        Contributor.objects.create(user=author, project=project)
+        return project
+
+    def add_contributor(self, project, user=None):
+        user = user or self.make_user()
+        Contributor.objects.create(user=user, project=project)
+        return user
+
+    def make_issue(self, project, author=None, assignee=None):
+        return Issue.objects.create(title=f'Issue {self._next()}', description='Description', priority='LOW',
+                                    tag='BUG', project=project, author=author or self.user, assignee=assignee)
+
+    def make_comment(self, issue, author=None):
+        return Comment.objects.create(description=f'Comment {self._next()}', issue=issue,
+                                      author=author or self.user)
+
+
+class QueryBudgetTests(SoftDeskTestCase):
+    """
+    Each endpoint gets a fixed query budget that must hold whatever the amount of related data,
+    so a serializer reading a relation per row makes these tests fail.
+    Budgets include the membership lookup, which runs whenever the user's cached project IDs are cold,
+    and the project version read for the ETag.
+    """
+
+    def assertQueryBudget(self, budget, url, grow):
+        for _ in range(3):
+            grow()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(queries), budget,
+                                 '\n'.join(query['sql'] for query in queries.captured_queries))
+
+    def test_project_retrieve(self):
+        project = self.make_project()
+
+        def grow():
+            for _ in range(5):
+                member = self.add_contributor(project)
+                self.make_issue(project, assignee=member)
+
+        self.assertQueryBudget(5, f'/api/projects/{project.id}/', grow)
+
+    def test_project_list(self):
+        self.assertQueryBudget(4, '/api/projects/', lambda: [self.make_project() for _ in range(5)])
+
+    def test_issue_retrieve(self):
+        project = self.make_project()
+        issue = self.make_issue(project)
+
+        def grow():
+            for _ in range(5):
+                self.make_comment(issue, author=self.add_contributor(project))
+
+        self.assertQueryBudget(5, f'/api/issues/{issue.id}/', grow)
+
+    def test_issue_list(self):
+        project = self.make_project()
+        self.assertQueryBudget(2, '/api/issues/', lambda: [self.make_issue(project) for _ in range(5)])
+
+    def test_issue_delete(self):
+        project = self.make_project()
+
+        def delete_issue(comments):
+            issue = self.make_issue(project)
+            for _ in range(comments):
+                self.make_comment(issue)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(f'/api/issues/{issue.id}/')
+            self.assertEqual(response.status_code, 204)
+            self.assertFalse(Comment.objects.filter(issue_id=issue.id).exists())
+            return len(queries)
+
+        # The comments are deleted with one query, whatever their number (the first call warms the membership cache)
+        delete_issue(0)
+        self.assertEqual(delete_issue(20), delete_issue(2))
+
+    def test_issue_writes_update_the_project_once(self):
+        project = self.make_project()
+        version = Project.objects.get(pk=project.pk).version
+
+        def project_updates(write, expected_status):
+            with CaptureQueriesContext(connection) as queries:
+                response = write()
+            self.assertEqual(response.status_code, expected_status)
+            return [query['sql'] for query in queries.captured_queries
+                    if query['sql'].startswith('UPDATE "api_project"')]
+
+        # The version bump carries the issue counts
+        updates = project_updates(lambda: self.client.post('/api/issues/', {
+            'title': 'New', 'description': 'Description', 'priority': 'LOW', 'tag': 'BUG', 'project': project.id,
+        }), 201)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"open_issue_count"', updates[0])
+        issue = Issue.objects.get(project=project)
+        self.assertEqual(len(project_updates(
+            lambda: self.client.patch(f'/api/issues/{issue.id}/', {'status': 'FINISHED'}, format='json'), 200)), 1)
+        self.assertEqual(len(project_updates(lambda: self.client.delete(f'/api/issues/{issue.id}/'), 204)), 1)
+        project.refresh_from_db()
+        self.assertEqual((project.issue_count, project.open_issue_count, project.version), (0, 0, version + 3))
+
+    def test_comment_list(self):
+        project = self.make_project()
+        issue = self.make_issue(project)
+
+        def grow():
+            for _ in range(5):
+                self.make_comment(issue, author=self.add_contributor(project))
+
+        self.assertQueryBudget(4, '/api/comments/', grow)
+
+
+class MembershipCacheTests(SoftDeskTestCase):
+
+    def test_project_ids_are_cached_across_requests(self):
+        project = self.make_project()
+        self.assertEqual(get_user_project_ids(self.user), {project.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_project_ids(self.user), {project.id})
+
+    @override_settings(PROJECT_MEMBERSHIP_CACHE_TIMEOUT=300)
+    def test_process_local_cache_keeps_sets_briefly(self):
+        self.assertEqual(get_cache_timeout(), LOCAL_CACHE_TIMEOUT)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                              'LOCATION': tempfile.gettempdir()}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(get_cache_timeout(), 300)
+
+    def test_comment_permission_check_does_not_query(self):
+        project = self.make_project()
+        comment = self.make_comment(self.make_issue(project))
+        get_user_project_ids(self.user)
+        # The project version for the ETag, then the comment and its author, none for the permission check
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/comments/{comment.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_add_and_remove_contributor_invalidate(self):
+        project = self.make_project()
+        member = self.make_user()
+        self.assertEqual(get_user_project_ids(member), set())
+
+        response = self.client.post(f'/api/projects/{project.id}/add_contributor/', {'user_id': member.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_user_project_ids(member), {project.id})
+
+        response = self.client.delete(f'/api/projects/{project.id}/remove_contributor/', {'user_id': member.id})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(get_user_project_ids(member), set())
+
+    def test_project_delete_invalidates(self):
+        project = self.make_project()
+        self.assertEqual(get_user_project_ids(self.user), {project.id})
+        project.delete()
+        self.assertEqual(get_user_project_ids(self.user), set())
+
+    def test_non_contributor_is_denied(self):
+        project = self.make_project(author=self.make_user())
+        issue = self.make_issue(project, author=project.author)
+        self.assertEqual(self.client.get(f'/api/issues/{issue.id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/projects/{project.id}/').status_code, 404)
+
+
+class CursorPaginationTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issues = [self.make_issue(self.project) for _ in range(25)]
+
+    def test_cursor_walks_every_issue_once_without_count(self):
+        seen = []
+        url = '/api/issues/?pagination=cursor&page_size=7'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+
+        expected = sorted(self.issues, key=lambda issue: (issue.created_time, str(issue.id)), reverse=True)
+        self.assertEqual(seen, [str(issue.id) for issue in expected])
+
+    def walk(self, url, link):
+        """ The pages from url on, following the next or previous links, in the order they are read """
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item['id'] for item in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def test_ties_are_walked_both_ways_without_offset(self):
+        # Rows sharing their created_time, which a filter on created_time alone would skip or repeat
+        Issue.objects.filter(pk__in=[issue.pk for issue in self.issues[5:15]]).update(
+            created_time=self.issues[5].created_time)
+        expected = [str(pk) for pk in Issue.objects.order_by('-created_time', '-id').values_list('pk', flat=True)]
+        pages = self.walk('/api/issues/?pagination=cursor&page_size=4', 'next')
+        self.assertEqual(sum(pages, []), expected)
+
+        # Back from the last page to the first one
+        last_page = expected[-len(pages[-1]):]
+        response = self.client.get('/api/issues/?pagination=cursor&page_size=4')
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], last_page)
+        backward = self.walk(response.data['previous'], 'previous')
+        self.assertEqual(sum(reversed(backward), []) + last_page, expected)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.client.get('/api/issues/?pagination=cursor&page_size=4').data['next'])
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+    def test_ordering_and_bad_cursors_are_refused(self):
+        self.assertEqual(self.client.get('/api/issues/?pagination=cursor&ordering=priority').status_code, 400)
+        self.assertEqual(self.client.get('/api/issues/?cursor=cD1ub3RhZGF0ZQ%3D%3D').status_code, 404)
+        # Page number pagination keeps ?ordering=
+        self.assertEqual(self.client.get('/api/issues/?ordering=priority').status_code, 200)
+
+    def test_page_size_is_capped(self):
+        for _ in range(80):
+            self.make_issue(self.project)
+        response = self.client.get('/api/issues/?pagination=cursor&page_size=1000')
+        self.assertEqual(len(response.data['results']), 100)
+
+    def test_page_number_pagination_is_still_the_default(self):
+        response = self.client.get('/api/comments/')
+        self.assertEqual(response.data['count'], 0)
+        response = self.client.get('/api/issues/?page=3')
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 5)
+
+
+def explain(sql):
+    """ Return the plan of an already interpolated SQL query as a list of lines """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Seeded tables are tiny, so make the planner show whether an index *can* serve the query
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan):
+    """ Return the plan lines showing a full table scan or a sort step """
+    if connection.vendor == 'postgresql':
+        return [line for line in plan if 'Seq Scan' in line or re.search(r'(^|->)\s*(Incremental )?Sort\b', line)]
+    return [line for line in plan if line.startswith('SCAN') or 'TEMP B-TREE' in line]
+
+
+class QueryPlanTests(SoftDeskTestCase):
+    """
+    Run each endpoint on seeded data and check that its main queries are served by an index,
+    without a sequential scan or a sort step.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.member = self.add_contributor(self.project)
+        for _ in range(3):
+            other = self.make_project(author=self.make_user())
+            self.add_contributor(other, self.member)
+            for _ in range(10):
+                self.make_issue(other, author=other.author)
+        self.issue = self.make_issue(self.project, assignee=self.member)
+        for _ in range(10):
+            self.make_comment(self.make_issue(self.project, assignee=self.member))
+            self.make_comment(self.issue, author=self.add_contributor(self.project))
+
+    def assertIndexedPlans(self, url, table):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        statements = [query['sql'] for query in queries.captured_queries
+                      if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']]
+        self.assertTrue(statements, f'No query on {table} for {url}')
+        for sql in statements:
+            plan = explain(sql)
+            self.assertEqual(plan_problems(plan), [], f'{sql}\n' + '\n'.join(plan))
+
+    def test_issues_by_project(self):
+        self.assertIndexedPlans(f'/api/issues/?project={self.project.id}', 'api_issue')
+
+    def test_issues_by_assignee(self):
+        self.assertIndexedPlans(f'/api/issues/?assignee={self.member.id}', 'api_issue')
+
+    def test_issues_by_project_with_cursor(self):
+        self.assertIndexedPlans(f'/api/issues/?project={self.project.id}&pagination=cursor', 'api_issue')
+
+    def test_comments_by_issue(self):
+        self.assertIndexedPlans(f'/api/comments/?issue={self.issue.id}', 'api_comment')
+
+    def test_contributors_by_user(self):
+        self.assertIndexedPlans('/api/projects/', 'api_contributor')
+
+    def test_contributors_by_project(self):
+        self.assertIndexedPlans(f'/api/projects/{self.project.id}/', 'api_contributor')
+
+    def test_comments_by_issue_with_cursor(self):
+        self.assertIndexedPlans(f'/api/comments/?issue={self.issue.id}&pagination=cursor', 'api_comment')
+
+    def test_deep_cursor_pages(self):
+        for url, table in ((f'/api/issues/?project={self.project.id}&pagination=cursor&page_size=3', 'api_issue'),
+                           (f'/api/comments/?issue={self.issue.id}&pagination=cursor&page_size=3', 'api_comment')):
+            self.assertIndexedPlans(self.client.get(url).data['next'], table)
+
+
+class BulkContributorTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+
+    def test_add_contributors(self):
+        users = [self.make_user() for _ in range(20)]
+        already = self.add_contributor(self.project)
+        user_ids = [user.id for user in users] + [already.id, 999999]
+        get_user_project_ids(self.user)
+
+        # Project, users, existing contributors, the insert and the version bump, plus the savepoint pair
+        with self.assertNumQueries(7):
+            response = self.client.post(f'/api/projects/{self.project.id}/add_contributors/',
+                                        {'user_ids': user_ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        statuses = {result['user_id']: result['status'] for result in response.data['results']}
+        self.assertEqual(statuses[already.id], 'already_contributor')
+        self.assertEqual(statuses[999999], 'not_found')
+        self.assertEqual([statuses[user.id] for user in users], ['added'] * 20)
+        self.assertEqual(self.project.contributors.count(), 22)
+        self.assertEqual(get_user_project_ids(users[0]), {self.project.id})
+
+    def test_remove_contributors(self):
+        members = [self.add_contributor(self.project) for _ in range(5)]
+        get_user_project_ids(members[0])
+        outsider = self.make_user()
+        user_ids = [member.id for member in members] + [self.user.id, outsider.id]
+
+        get_user_project_ids(self.user)
+
+        # Project, existing contributors, one delete and the version bump, plus the savepoint pair
+        with self.assertNumQueries(6):
+            response = self.client.post(f'/api/projects/{self.project.id}/remove_contributors/',
+                                        {'user_ids': user_ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        statuses = {result['user_id']: result['status'] for result in response.data['results']}
+        self.assertEqual(statuses[self.user.id], 'is_author')
+        self.assertEqual(statuses[outsider.id], 'not_contributor')
+        self.assertEqual([statuses[member.id] for member in members], ['removed'] * 5)
+        self.assertEqual(list(self.project.contributors.values_list('user_id', flat=True)), [self.user.id])
+        self.assertEqual(get_user_project_ids(members[0]), set())
+        self.assertEqual(Project.objects.get(pk=self.project.pk).contributor_count, 1)
+
+    def test_add_contributors_counts_the_inserted_rows(self):
+        late, other = self.make_user(), self.make_user()
+        bulk_create = Contributor.objects.bulk_create
+
+        def add_concurrently(objs, **kwargs):
+            # Another request adds one of the users between the read of the contributors and the insert
+            Contributor.objects.create(user=late, project=self.project)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Contributor.objects, 'bulk_create', side_effect=add_concurrently):
+            response = self.client.post(f'/api/projects/{self.project.id}/add_contributors/',
+                                        {'user_ids': [late.id, other.id]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Project.objects.get(pk=self.project.pk).contributor_count, 3)
+        self.assertEqual(repair_counts([self.project.pk]), (0, 0))
+
+    def test_only_the_author_can_manage_contributors(self):
+        member = self.add_contributor(self.project)
+        self.client.force_authenticate(member)
+        response = self.client.post(f'/api/projects/{self.project.id}/add_contributors/',
+                                    {'user_ids': [self.make_user().id]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_payload(self):
+        response = self.client.post(f'/api/projects/{self.project.id}/add_contributors/',
+                                    {'user_ids': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_duplicate_contributor_is_rejected(self):
+        member = self.add_contributor(self.project)
+        response = self.client.post(f'/api/projects/{self.project.id}/add_contributor/', {'user_id': member.id})
+        self.assertEqual(response.status_code, 400)
+
+
+class IssueBatchTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.member = self.add_contributor(self.project)
+        self.outsider = self.make_user()
+        get_user_project_ids(self.user)
+
+    def post_batch(self, payload):
+        return self.client.post('/api/issues/batch/', {'project': str(self.project.id), **payload}, format='json')
+
+    def test_create_many_with_a_constant_number_of_queries(self):
+        items = [{'title': f'Imported {i}', 'description': 'Imported', 'tag': 'TASK', 'priority': 'LOW',
+                  'assignee_id': self.member.id} for i in range(50)]
+        # Project, assignees, titles, then the insert, the search documents (insert, then the SQLite FTS mirror's
+        # delete and insert), the statistics (insert, update) and the project's version and counts inside a
+        # savepoint pair
+        with self.assertNumQueries(12):
+            response = self.post_batch({'create': items})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all('issue' in result for result in response.data['created']))
+        self.assertEqual(self.project.issues.filter(assignee=self.member).count(), 50)
+
+    def test_errors_are_reported_per_item(self):
+        existing = self.make_issue(self.project)
+        response = self.post_batch({'create': [
+            {'title': 'Valid', 'description': 'Valid', 'tag': 'BUG', 'priority': 'HIGH'},
+            {'title': 'Outsider', 'description': 'x', 'tag': 'BUG', 'priority': 'HIGH',
+             'assignee_id': self.outsider.id},
+            {'title': existing.title, 'description': 'x', 'tag': 'BUG', 'priority': 'HIGH'},
+            {'title': 'Valid', 'description': 'Duplicate in batch', 'tag': 'BUG', 'priority': 'HIGH'},
+            {'title': 'Bad tag', 'description': 'x', 'tag': 'NOPE', 'priority': 'HIGH'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.data['created']
+        self.assertIn('issue', results[0])
+        self.assertIn('assignee_id', results[1]['errors'])
+        self.assertIn('title', results[2]['errors'])
+        self.assertIn('title', results[3]['errors'])
+        self.assertIn('tag', results[4]['errors'])
+        self.assertEqual(self.project.issues.count(), 2)
+
+    def test_update_many(self):
+        issues = [self.make_issue(self.project) for _ in range(20)]
+        foreign = self.make_issue(self.project, author=self.member)
+        updates = [{'id': str(issue.id), 'status': 'IN_PROGRESS', 'assignee_id': self.member.id} for issue in issues]
+        updates += [{'id': str(foreign.id), 'priority': 'HIGH'},
+                    {'id': str(issues[0].id), 'assignee_id': self.outsider.id}]
+
+        response = self.post_batch({'update': updates})
+        self.assertEqual(response.status_code, 200)
+        results = response.data['updated']
+        self.assertTrue(all('issue' in result for result in results[:20]))
+        self.assertIn('id', results[20]['errors'])
+        self.assertIn('assignee_id', results[21]['errors'])
+        self.assertEqual(self.project.issues.filter(status='IN_PROGRESS', assignee=self.member).count(), 20)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.priority, 'LOW')
+
+    def test_non_contributor_is_denied(self):
+        self.client.force_authenticate(self.outsider)
+        response = self.post_batch({'create': [{'title': 'x', 'description': 'x', 'tag': 'BUG', 'priority': 'LOW'}]})
+        self.assertEqual(response.status_code, 403)
+
+
+class AdminChangelistQueryTests(SoftDeskTestCase):
+    """ The admin changelists must cost the same number of queries for 5 rows or 50 """
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin', password='pass', email='admin@example.com')
+        self.client.force_login(self.admin)
+
+    def seed(self, count):
+        for _ in range(count):
+            project = self.make_project(author=self.make_user())
+            member = self.add_contributor(project)
+            issue = self.make_issue(project, author=project.author, assignee=member)
+            self.make_comment(issue, author=member)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        for model in ('project', 'contributor', 'issue', 'comment'):
+            with self.subTest(model=model):
+                url = f'/admin/api/{model}/'
+                self.seed(5)
+                small = self.count_queries(url)
+                self.seed(45)
+                self.assertEqual(self.count_queries(url), small)
+
+    def test_count_columns_are_sortable(self):
+        self.seed(3)
+        # Column indexes count the action checkbox column first
+        response = self.client.get('/admin/api/project/?o=-4.5')
+        self.assertEqual(response.context['cl'].get_ordering_field_columns(), {4: 'desc', 5: 'asc'})
+        self.assertIn('-contributor_count', response.context['cl'].queryset.query.order_by)
+        response = self.client.get('/admin/api/issue/?o=-8')
+        self.assertIn('-comment_count', response.context['cl'].queryset.query.order_by)
+
+
+class ConditionalGetTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issue = self.make_issue(self.project)
+        self.comment = self.make_comment(self.issue)
+
+    def assertNotModified(self, url, max_queries):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(max_queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def test_not_modified_skips_the_main_queries(self):
+        # Only the version read remains, the membership set is cached
+        self.assertNotModified(f'/api/projects/{self.project.id}/', 1)
+        self.assertNotModified('/api/projects/', 1)
+        self.assertNotModified(f'/api/issues/?project={self.project.id}', 1)
+        self.assertNotModified(f'/api/issues/{self.issue.id}/', 1)
+        self.assertNotModified('/api/comments/', 1)
+        self.assertNotModified(f'/api/comments/{self.comment.id}/', 1)
+
+    def test_etag_changes_with_the_project(self):
+        url = f'/api/projects/{self.project.id}/'
+        changes = [
+            lambda: self.make_issue(self.project),
+            lambda: self.make_comment(self.issue),
+            lambda: self.add_contributor(self.project),
+            lambda: self.comment.delete(),
+            lambda: self.client.post('/api/issues/batch/', {'project': str(self.project.id), 'update': [
+                {'id': str(self.issue.id), 'status': 'FINISHED'}]}, format='json'),
+        ]
+        etag = self.client.get(url)['ETag']
+        for change in changes:
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_stale_instance_save_keeps_the_version(self):
+        url = f'/api/projects/{self.project.id}/'
+        stale = Project.objects.get(pk=self.project.pk)
+        self.make_issue(self.project)
+        etag = self.client.get(url)['ETag']
+        version = Project.objects.get(pk=self.project.pk).version
+
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(Project.objects.get(pk=self.project.pk).version, version + 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+    def test_etag_changes_with_the_embedded_users(self):
+        urls = [f'/api/projects/{self.project.id}/', f'/api/issues/{self.issue.id}/', '/api/comments/']
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        response = self.client.put('/api/auth/me/', {'username': 'renamed'})
+        self.assertEqual(response.status_code, 200)
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn(b'renamed', response.content)
+
+    def test_etag_depends_on_the_query(self):
+        etag = self.client.get(f'/api/issues/?project={self.project.id}')['ETag']
+        response = self.client.get(f'/api/issues/?project={self.project.id}&ordering=priority', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_etag_for_foreign_projects(self):
+        etag = self.client.get(f'/api/projects/{self.project.id}/')['ETag']
+        self.client.force_authenticate(self.make_user())
+        response = self.client.get(f'/api/projects/{self.project.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(API_RESPONSE_CACHE={'ENABLED': True, 'TIMEOUT': 60})
+class ResponseCacheTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issue = self.make_issue(self.project)
+        self.make_comment(self.issue)
+        reset_stats()
+
+    def test_hit_serves_the_same_data_with_only_the_version_query(self):
+        for url in ('/api/projects/', f'/api/issues/?project={self.project.id}', '/api/comments/?page=1'):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertEqual(first['X-Cache'], 'MISS')
+                with self.assertNumQueries(1):
+                    second = self.client.get(url)
+                self.assertEqual(second['X-Cache'], 'HIT')
+                self.assertEqual(second.content, first.content)
+        self.assertEqual(get_stats(), {'hits': 3, 'misses': 3, 'hit_ratio': 0.5})
+
+    def test_entries_are_per_user_and_per_query(self):
+        url = f'/api/issues/?project={self.project.id}'
+        self.client.get(url)
+        self.assertEqual(self.client.get(url + '&ordering=priority')['X-Cache'], 'MISS')
+        self.client.force_authenticate(self.add_contributor(self.project))
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_model_changes_invalidate(self):
+        url = f'/api/issues/?project={self.project.id}'
+        self.client.get(url)
+        self.make_issue(self.project)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_user_changes_invalidate(self):
+        self.client.get('/api/comments/')
+        self.client.put('/api/auth/me/', {'username': 'renamed'})
+        response = self.client.get('/api/comments/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(b'renamed', response.content)
+
+    @override_settings(API_RESPONSE_CACHE={'ENABLED': True, 'MAX_ENTRY_SIZE': 10})
+    def test_large_responses_are_not_stored(self):
+        self.client.get('/api/projects/')
+        self.assertEqual(self.client.get('/api/projects/')['X-Cache'], 'MISS')
+
+    @override_settings(API_RESPONSE_CACHE={'ENABLED': False})
+    def test_disabled_by_setting(self):
+        self.client.get('/api/projects/')
+        self.assertNotIn('X-Cache', self.client.get('/api/projects/'))
+
+
+class ExportTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.member = self.add_contributor(self.project)
+        self.issues = [self.make_issue(self.project, assignee=self.member) for _ in range(7)]
+        for issue in self.issues:
+            self.make_comment(issue)
+            self.make_comment(issue, author=self.member)
+
+    def test_ndjson(self):
+        response = self.client.get(f'/api/projects/{self.project.id}/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [str(issue.id) for issue in self.issues])
+        self.assertEqual(rows[0]['assignee'], self.member.username)
+        self.assertEqual([comment['author'] for comment in rows[0]['comments']],
+                         [self.user.username, self.member.username])
+
+    def test_csv(self):
+        response = self.client.get(f'/api/projects/{self.project.id}/export/?export_format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len([row for row in rows if row['type'] == 'issue']), 7)
+        self.assertEqual(len([row for row in rows if row['type'] == 'comment']), 14)
+
+    def test_rows_are_read_in_chunks(self):
+        rows = stream_ndjson(self.project, chunk_size=3)
+        # The first row is sent once the issue cursor is open and the comments of the first chunk are read
+        with self.assertNumQueries(2):
+            next(rows)
+        # The 2 remaining chunks of the 7 issues only add their comment query
+        with self.assertNumQueries(2):
+            self.assertEqual(len(list(rows)), 6)
+
+    def test_unknown_format(self):
+        response = self.client.get(f'/api/projects/{self.project.id}/export/?export_format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_contributor_cannot_export(self):
+        self.client.force_authenticate(self.make_user())
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/export/').status_code, 404)
+
+
+class SearchTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.in_title = Issue.objects.create(title='Login crash', description='Happens on start', priority='LOW',
+                                             tag='BUG', project=self.project, author=self.user)
+        self.in_description = Issue.objects.create(title='Startup', description='The login page crash is back',
+                                                   priority='LOW', tag='BUG', project=self.project, author=self.user)
+        self.in_comment = Issue.objects.create(title='Misc', description='Nothing here', priority='LOW', tag='BUG',
+                                               project=self.project, author=self.user)
+        self.comment = Comment.objects.create(description='Also a login crash for me', issue=self.in_comment,
+                                              author=self.user)
+
+    def search(self, text):
+        response = self.client.get('/api/issues/search/', {'q': text})
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.data['results']]
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search('login crash'),
+                         [str(self.in_title.id), str(self.in_description.id), str(self.in_comment.id)])
+
+    def test_index_follows_changes(self):
+        self.in_title.title = 'Sign-in failure'
+        self.in_title.save()
+        self.comment.delete()
+        self.assertEqual(self.search('login crash'), [str(self.in_description.id)])
+        self.assertEqual(self.search('sign-in'), [str(self.in_title.id)])
+
+        self.in_description.delete()
+        self.assertEqual(self.search('login crash'), [])
+
+    def test_only_the_callers_projects_are_searched(self):
+        other = self.make_project(author=self.make_user())
+        Issue.objects.create(title='Login crash elsewhere', description='x', priority='LOW', tag='BUG',
+                             project=other, author=other.author)
+        self.assertEqual(len(self.search('login')), 3)
+
+    def test_rebuild_command(self):
+        delete_search_documents(Issue.objects.values_list('id', flat=True))
+        self.assertEqual(self.search('login'), [])
+        call_command('rebuild_search_index', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(IssueSearchDocument.objects.count(), 3)
+        self.assertEqual(len(self.search('login')), 3)
+
+    def test_search_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('login" OR "x'), [])
+        self.assertEqual(self.client.get('/api/issues/search/').status_code, 400)
+
+
+class ProjectStatsTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.member = self.add_contributor(self.project)
+        self.issues = [self.make_issue(self.project) for _ in range(3)]
+        self.issues.append(self.make_issue(self.project, assignee=self.member))
+
+    def test_counters_follow_issue_changes(self):
+        issue = self.issues[0]
+        issue.status = 'FINISHED'
+        issue.priority = 'HIGH'
+        issue.assignee = self.member
+        issue.save()
+        issue.status = 'IN_PROGRESS'
+        issue.save()
+        self.issues[1].delete()
+
+        stats = get_project_stats(self.project.id)
+        self.assertEqual(stats['total'], 3)
+        self.assertEqual(stats['status'], {'TODO': 2, 'IN_PROGRESS': 1})
+        self.assertEqual(stats['priority'], {'LOW': 2, 'HIGH': 1})
+        self.assertEqual(stats['tag'], {'BUG': 3})
+        self.assertCountEqual(stats['assignee'], [{'assignee': None, 'count': 1},
+                                                  {'assignee': self.member.id, 'count': 2}])
+
+    def test_batch_updates_counters(self):
+        self.client.post('/api/issues/batch/', {'project': str(self.project.id), 'create': [
+            {'title': 'New', 'description': 'x', 'tag': 'TASK', 'priority': 'HIGH'},
+        ], 'update': [{'id': str(self.issues[0].id), 'status': 'FINISHED'}]}, format='json')
+        stats = get_project_stats(self.project.id)
+        self.assertEqual(stats['status'], {'TODO': 4, 'FINISHED': 1})
+        self.assertEqual(stats['tag'], {'BUG': 4, 'TASK': 1})
+
+    def test_stale_reads_do_not_count_twice(self):
+        first, second = Issue.objects.get(pk=self.issues[0].pk), Issue.objects.get(pk=self.issues[0].pk)
+        for issue in (first, second):
+            with transaction.atomic():
+                lock_loaded_values([issue])
+                issue.status = 'FINISHED'
+                issue.save()
+        self.assertEqual(get_project_stats(self.project.id)['status'], {'TODO': 3, 'FINISHED': 1})
+        self.assertEqual(Project.objects.get(pk=self.project.pk).open_issue_count, 3)
+
+    def test_update_counts_from_the_locked_row(self):
+        issue = self.issues[0]
+
+        def concurrent_update(attrs):
+            # Another request finishes the issue after this one has read it
+            stale = Issue.objects.get(pk=issue.pk)
+            stale.status = 'FINISHED'
+            stale.save()
+            return attrs
+
+        with mock.patch.object(IssueSerializer, 'validate', side_effect=concurrent_update):
+            response = self.client.patch(f'/api/issues/{issue.id}/', {'status': 'FINISHED'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_project_stats(self.project.id)['status'], {'TODO': 3, 'FINISHED': 1})
+
+    def test_rebuild_matches_incremental_counters(self):
+        incremental = get_project_stats(self.project.id)
+        ProjectIssueStat.objects.update(count=0)
+        with self.assertNumQueries(1 + 4):  # the GROUP BY, then delete and insert inside a savepoint pair
+            rebuild_project_stats()
+        self.assertEqual(get_project_stats(self.project.id), incremental)
+
+    def test_endpoint_is_one_read(self):
+        get_user_project_ids(self.user)
+        with self.assertNumQueries(2):  # the project (permission check), then its summary rows
+            response = self.client.get(f'/api/projects/{self.project.id}/stats/')
+        self.assertEqual(response.data['total'], 4)
+        self.assertEqual(response.data['status'], {'TODO': 4})
+
+
+class AsyncReadTests(SoftDeskTestCase):
+    """ The async read endpoints answer with the same bodies as the viewsets """
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issues = [self.make_issue(self.project) for _ in range(12)]
+        self.comments = [self.make_comment(self.issues[0]) for _ in range(3)]
+        self.token = str(AccessToken.for_user(self.user))
+
+    def aget(self, url):
+        return self.async_client.get(url, headers={'Authorization': f'Bearer {self.token}'})
+
+    def assertSameBody(self, sync_url, async_response):
+        sync_response = self.client.get(sync_url, HTTP_ACCEPT='application/json')
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    async def test_retrieve_bodies_match(self):
+        for route, obj in (('projects', self.project), ('issues', self.issues[0]), ('comments', self.comments[0])):
+            response = await self.aget(f'/api/async/{route}/{obj.pk}/')
+            self.assertEqual(response.status_code, 200)
+            await sync_to_async(self.assertSameBody)(f'/api/{route}/{obj.pk}/', response)
+
+    async def test_list_bodies_match(self):
+        for route, query in (('projects', ''), ('issues', '?page=2&ordering=-priority,tag'),
+                             ('issues', f'?project={self.project.pk}'), ('comments', f'?issue={self.issues[0].pk}')):
+            response = await self.aget(f'/api/async/{route}/{query}')
+            sync_response = await sync_to_async(self.client.get)(f'/api/{route}/{query}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content)['results'], json.loads(sync_response.content)['results'])
+            self.assertEqual(json.loads(response.content)['count'], sync_response.data['count'])
+
+    async def test_page_links(self):
+        second = json.loads((await self.aget('/api/async/issues/?page=2')).content)
+        self.assertIsNone(second['next'])
+        self.assertEqual(second['previous'], 'http://testserver/api/async/issues/')
+        self.assertEqual((await self.aget('/api/async/issues/?page=3')).status_code, 404)
+
+    async def test_non_contributors_are_refused(self):
+        other = await sync_to_async(self.make_project)(author=await sync_to_async(self.make_user)())
+        issue = await sync_to_async(self.make_issue)(other, author=other.author)
+        self.assertEqual((await self.aget(f'/api/async/projects/{other.pk}/')).status_code, 404)
+        self.assertEqual((await self.aget(f'/api/async/issues/{issue.pk}/')).status_code, 404)
+
+    async def test_authentication_is_required(self):
+        response = await self.async_client.get('/api/async/projects/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        self.assertEqual(json.loads(response.content), {'detail': 'Authentication credentials were not provided.'})
+
+    async def test_invalid_filter(self):
+        self.assertEqual((await self.aget('/api/async/issues/?assignee=x')).status_code, 400)
+
+
+class SparseFieldsetTests(SoftDeskTestCase):
+    """ ?fields= / ?omit= drop fields from the output and their columns and joins from the queries """
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issue = self.make_issue(self.project)
+        self.make_comment(self.issue)
+        get_user_project_ids(self.user)
+
+    def get_with_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, ' '.join(query['sql'] for query in queries.captured_queries)
+
+    def test_fields_keeps_only_the_listed_fields(self):
+        response, sql = self.get_with_queries('/api/issues/?fields=id,title,status,priority')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'status', 'priority'})
+        self.assertNotIn('"api_issue"."description"', sql)
+
+    def test_omit_drops_the_listed_fields(self):
+        response, sql = self.get_with_queries('/api/projects/?omit=description')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'type', 'issue_count', 'open_issue_count',
+                                                            'contributor_count', 'created_time', 'updated_time'})
+        self.assertNotIn('"api_project"."description"', sql)
+
+    def test_dropped_relations_are_not_loaded(self):
+        full = len(self.get_with_queries(f'/api/projects/{self.project.id}/')[1].split('SELECT')) - 1
+        response, sql = self.get_with_queries(f'/api/projects/{self.project.id}/?omit=issues,contributors')
+        self.assertNotIn('issues', response.data)
+        self.assertEqual(len(sql.split('SELECT')) - 1, full - 2)
+
+        response, sql = self.get_with_queries('/api/comments/?fields=id,description')
+        self.assertEqual(response.data['results'][0]['description'], 'Comment 3')
+        self.assertNotIn('authentication_user', sql)
+
+    def test_nested_serializers_keep_their_fields(self):
+        response = self.client.get(f'/api/issues/{self.issue.id}/?fields=id,comments')
+        self.assertEqual(set(response.data), {'id', 'comments'})
+        self.assertIn('description', response.data['comments'][0])
+
+    def test_writes_keep_every_field(self):
+        response = self.client.post('/api/issues/?fields=id', {
+            'title': 'New', 'description': 'x', 'tag': 'BUG', 'priority': 'LOW', 'project': str(self.project.id),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['description'], 'x')
+
+
+class FastListTests(SoftDeskTestCase):
+    """ List pages built from values_list() rows are byte for byte the serializers' output """
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        member = self.add_contributor(self.project)
+        for index in range(12):
+            issue = self.make_issue(self.project, assignee=member if index % 2 else None)
+            issue.description = 'Accents é, emoji \U0001F600, separators \u2028\u2029, "quotes" and \\ \n'
+            issue.save()
+            self.make_comment(issue)
+
+    def assertSameAsSerializers(self, url):
+        fast = self.client.get(url)
+        with mock.patch('api.fast_serialization.compile_serializer', return_value=None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_lists_match(self):
+        for url in ('/api/projects/', '/api/issues/', '/api/issues/?page=2&ordering=status',
+                    '/api/issues/?pagination=cursor&page_size=5', '/api/comments/?fields=id,author',
+                    f'/api/issues/?project={self.project.id}&omit=description'):
+            self.assertSameAsSerializers(url)
+
+    def test_cursor_pages_with_fields(self):
+        for fields in ('id,title', 'id', 'title'):
+            url = f'/api/issues/?pagination=cursor&page_size=5&fields={fields}'
+            self.assertSameAsSerializers(url)
+            next_url = self.client.get(url).json()['next']
+            self.assertSameAsSerializers(next_url)
+            self.assertSameAsSerializers(self.client.get(next_url).json()['previous'])
+
+    def test_no_instances_are_built(self):
+        with mock.patch.object(Issue, 'from_db') as from_db:
+            self.client.get('/api/issues/')
+        from_db.assert_not_called()
+
+    def test_unsupported_fields_fall_back(self):
+        serializer = DetailedProjectSerializer()
+        self.assertIsNone(compile_serializer(serializer))
+
+    def test_renderer_matches_json_renderer(self):
+        data = {'when': timezone.now(), 'id': uuid.uuid4(), 'amount': Decimal('1.50'), 'text': 'é\u2028',
+                'nested': [None, True, 12]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+@skipUnless('replica' in settings.DATABASES, 'needs the replica database of softdesk_api.test_settings')
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 10})
+class ReplicaRoutingTests(SoftDeskTestCase):
+    """ Run with softdesk_api.test_settings, where 'replica' is a second SQLite database """
+    # Declared only when it exists, so other settings still run the rest of the suite
+    databases = {'default', 'replica'} & set(settings.DATABASES)
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+
+    def get_queries(self, method, url, **kwargs):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        response, primary, replica = self.get_queries('get', '/api/projects/')
+        # The replica has no rows: it was not written to
+        self.assertEqual(response.data['count'], 0)
+        # Only the user's set of project IDs, which is cached from the primary
+        self.assertEqual(primary, 1)
+        self.assertGreater(replica, 0)
+
+    def test_writes_go_to_the_primary_and_pin_the_user(self):
+        response, primary, replica = self.get_queries('patch', f'/api/projects/{self.project.id}/',
+                                                      data={'title': 'Renamed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, 0)
+
+        response, primary, replica = self.get_queries('get', f'/api/projects/{self.project.id}/')
+        self.assertEqual(response.data['title'], 'Renamed')
+        self.assertEqual(replica, 0)
+
+        # Other users still read from the replica
+        self.client.force_authenticate(self.make_user())
+        self.assertGreater(self.get_queries('get', '/api/projects/')[2], 0)
+
+    @override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 0})
+    def test_pin_expires(self):
+        self.client.patch(f'/api/projects/{self.project.id}/', {'title': 'Renamed'})
+        self.assertGreater(self.get_queries('get', '/api/projects/')[2], 0)
+
+    def test_reads_outside_the_views_use_the_primary(self):
+        self.assertEqual(Project.objects.all().db, 'default')
+
+    def test_membership_set_is_read_from_the_primary(self):
+        cache.clear()
+        self.client.get(f'/api/projects/{self.project.id}/')
+        # Cached during a request served by the replica, which has no rows
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_project_ids(self.user), {self.project.id})
+
+
+class RequestMetricsTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        histograms.clear()
+        self.project = self.make_project()
+        self.make_issue(self.project)
+
+    def get_timings(self, response):
+        return dict(re.match(r'(\w+);dur=([\d.]+)', part).groups() for part in response['Server-Timing'].split(', '))
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/projects/{self.project.id}/')
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        timings = self.get_timings(response)
+        self.assertEqual(set(timings), {'db', 'perm', 'serialize', 'app'})
+        # Nested serializers are not counted twice
+        self.assertLessEqual(float(timings['serialize']), float(timings['app']))
+
+    def test_fast_list_reports_serialization(self):
+        self.assertIn('serialize', self.get_timings(self.client.get('/api/issues/')))
+
+    def test_metrics_endpoint(self):
+        self.client.get(f'/api/issues/{self.make_issue(self.project).id}/')
+        self.client.get('/api/issues/')
+        staff = self.make_user()
+        staff.is_staff = True
+        staff.save()
+        self.client.force_login(staff)
+        body = self.client.get('/api/metrics/').content.decode()
+        self.assertIn('softdesk_request_duration_seconds_count{endpoint="issues-detail",method="GET"} 1', body)
+        self.assertIn('softdesk_request_duration_seconds_bucket{endpoint="issues-list",method="GET",le="+Inf"} 1',
+                      body)
+        self.assertIn('softdesk_request_queries_total{endpoint="issues-list",method="GET"}', body)
+
+    @override_settings(REQUEST_METRICS={'SCRAPE_TOKEN': 'secret'})
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        response = self.client.get('/api/metrics/', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_are_closed_by_default(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/api/metrics/', headers={'Authorization': 'Bearer '}).status_code, 403)
+        with override_settings(REQUEST_METRICS={'PUBLIC': True}):
+            self.client.logout()
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+    @override_settings(REQUEST_METRICS={'SLOW_REQUEST_THRESHOLD': 0, 'SLOWEST_QUERIES': 2})
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('api.instrumentation', 'WARNING') as logs:
+            self.client.get('/api/projects/')
+        message = logs.records[0].getMessage()
+        self.assertIn('Slow request GET /api/projects/', message)
+        self.assertEqual(message.count(' ms: SELECT'), 2)
+
+    @override_settings(REQUEST_METRICS={'ENABLED': False})
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/projects/'))
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        call_command('seed_data', users=6, projects=3, issues=40, comments=80, stdout=io.StringIO())
+
+    def test_seed_data(self):
+        self.assertEqual((User.objects.count(), Project.objects.count(), Issue.objects.count(),
+                          Comment.objects.count()), (6, 3, 40, 80))
+        # Authors, assignees and commenters are contributors of the project
+        for project in Project.objects.all():
+            members = set(project.contributors.values_list('user_id', flat=True))
+            self.assertIn(project.author_id, members)
+            self.assertLessEqual(set(project.issues.values_list('author_id', flat=True)), members)
+            self.assertLessEqual(set(project.issues.exclude(assignee=None).values_list('assignee_id', flat=True)),
+                                 members)
+            self.assertLessEqual(set(Comment.objects.filter(issue__project=project)
+                                     .values_list('author_id', flat=True)), members)
+        self.assertEqual(IssueSearchDocument.objects.count(), 40)
+        self.assertEqual(ProjectIssueStat.objects.filter(dimension='status').aggregate(total=Sum('count'))['total'],
+                         40)
+
+    def test_benchmark_covers_every_route(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            stderr = io.StringIO()
+            call_command('benchmark_endpoints', requests=2, output=output.name, stdout=io.StringIO(), stderr=stderr)
+            report = json.load(open(output.name))
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertEqual(report['meta']['missing_routes'], [])
+        self.assertEqual({result['route'] for result in report['results'].values()}, set(route_names()))
+        for label, result in report['results'].items():
+            self.assertLess(result['status'], 400, label)
+        # The benchmark leaves the data as it found it
+        self.assertEqual((Project.objects.count(), Issue.objects.count(), Comment.objects.count()), (3, 40, 80))
+
+
+class DeletionTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.member = self.add_contributor(self.project)
+        self.grow(self.project, 3)
+
+    def grow(self, project, count):
+        for _ in range(count):
+            issue = self.make_issue(project, assignee=self.member)
+            for _ in range(3):
+                self.make_comment(issue)
+
+    def assertProjectGone(self, project_id):
+        self.assertFalse(Project.objects.filter(pk=project_id).exists())
+        for model in (Contributor, Issue, ProjectIssueStat, IssueSearchDocument):
+            self.assertFalse(model.objects.filter(project_id=project_id).exists(), model)
+        self.assertFalse(Comment.objects.filter(issue__project_id=project_id).exists())
+
+    def test_delete_project(self):
+        self.client.force_authenticate(self.member)
+        self.assertEqual(len(self.client.get('/api/projects/').data['results']), 1)
+        self.client.force_authenticate(self.user)
+
+        self.assertEqual(self.client.delete(f'/api/projects/{self.project.id}/').status_code, 204)
+        self.assertProjectGone(self.project.id)
+        # The members' cached project IDs are dropped
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.client.get('/api/projects/').data['results'], [])
+
+    def test_delete_rows(self):
+        issue = self.project.issues.first()
+        comment = issue.comments.first()
+        stat = ProjectIssueStat.objects.filter(project=self.project).first()
+        # UUID and integer keys, one statement each, an unknown key is not counted
+        with self.assertNumQueries(2):
+            self.assertEqual(delete_rows(Comment, [comment.pk, uuid.uuid4()]), 1)
+            self.assertEqual(delete_rows(ProjectIssueStat, [stat.pk, 0]), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(delete_rows(Comment, []), 0)
+        self.assertFalse(Comment.objects.filter(pk=comment.pk).exists())
+        self.assertFalse(ProjectIssueStat.objects.filter(pk=stat.pk).exists())
+        # No signals were sent
+        self.assertEqual(Issue.objects.get(pk=issue.pk).comment_count, 3)
+
+    def test_queries_do_not_grow_with_the_rows(self):
+        def count_queries(project):
+            with CaptureQueriesContext(connection) as queries:
+                Deleter().delete_project(project.pk)
+            return len(queries)
+
+        small = count_queries(self.project)
+        big = self.make_project()
+        self.add_contributor(big, self.member)
+        self.grow(big, 30)
+        self.assertEqual(count_queries(big), small)
+
+    def test_interrupted_deletion_resumes(self):
+        def stop(deleter):
+            raise RuntimeError('Worker stopped')
+
+        with self.assertRaises(RuntimeError):
+            Deleter(chunk_size=2, progress=stop).delete_project(self.project.pk)
+        self.assertTrue(Project.objects.filter(pk=self.project.pk).exists())
+        Deleter(chunk_size=2).delete_project(self.project.pk)
+        self.assertProjectGone(self.project.id)
+
+    def test_failed_request_deletion_is_finished_by_its_job(self):
+        with mock.patch('api.deletion.Deleter.delete_issues', side_effect=RuntimeError('Worker stopped')), \
+                self.assertLogs('api.deletion', 'ERROR'):
+            response = self.client.delete(f'/api/projects/{self.project.id}/')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data['status'], 'FAILED')
+        # The members are gone, so nobody could ask for the deletion again
+        self.assertTrue(Project.objects.filter(pk=self.project.pk).exists())
+        self.assertEqual(self.client.delete(f'/api/projects/{self.project.id}/').status_code, 404)
+
+        call_command('run_deletion_jobs', stdout=io.StringIO())
+        self.assertProjectGone(self.project.id)
+        self.assertEqual(APIClient().get(response['Location']).data['status'], 'DONE')
+
+    def test_request_deletion_leaves_no_job(self):
+        self.client.delete(f'/api/projects/{self.project.id}/')
+        self.assertFalse(DeletionJob.objects.exists())
+
+    @override_settings(DELETION={'RUN_IN_THREAD': False})
+    def test_background_deletion(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/projects/{self.project.id}/?background=true')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'PENDING')
+        self.assertProjectGone(self.project.id)
+
+        # The job's URL works without credentials
+        status = APIClient().get(response['Location']).data
+        self.assertEqual(status['status'], 'DONE')
+        self.assertEqual(status['deleted']['api.Issue'], 3)
+        self.assertEqual(status['deleted']['api.Comment'], 9)
+
+    def test_failed_job(self):
+        job = DeletionJob.objects.create(kind='PROJECT', target_id=str(self.project.id))
+        with mock.patch('api.deletion.Deleter.delete_project', side_effect=RuntimeError('Database gone')), \
+                self.assertLogs('api.deletion', 'ERROR'):
+            call_command('run_deletion_jobs', stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('FAILED', 'Database gone'))
+
+        call_command('run_deletion_jobs', stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE')
+        self.assertProjectGone(self.project.id)
+
+
+@override_settings(SYNC={'OVERLAP': 0})
+class SyncTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issues = [self.make_issue(self.project) for _ in range(3)]
+        self.comments = [self.make_comment(issue) for issue in self.issues]
+        self.url = f'/api/projects/{self.project.id}/sync/'
+
+    def sync(self, since=None):
+        response = self.client.get(self.url, {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_first_sync_returns_everything(self):
+        data = self.sync()
+        self.assertEqual(data['project']['id'], str(self.project.id))
+        self.assertEqual(len(data['issues']), 3)
+        self.assertEqual(len(data['comments']), 3)
+        self.assertEqual(data['deleted'], {'issues': [], 'comments': []})
+
+    def test_delta(self):
+        watermark = self.sync()['watermark']
+        data = self.sync(watermark)
+        del data['watermark']
+        self.assertEqual(data, {'project': None, 'issues': [], 'comments': [],
+                                'deleted': {'issues': [], 'comments': []}, 'has_more': False, 'next': None})
+
+        self.client.patch(f'/api/issues/{self.issues[0].id}/', {'status': 'FINISHED'})
+        self.client.delete(f'/api/comments/{self.comments[1].id}/')
+        self.client.delete(f'/api/issues/{self.issues[2].id}/')
+        new_comment = self.make_comment(self.issues[0])
+
+        data = self.sync(watermark)
+        # The counts of the project and of the issues that lost or gained a comment changed too
+        self.assertEqual((data['project']['issue_count'], data['project']['open_issue_count']), (2, 1))
+        issues = {issue['id']: issue for issue in data['issues']}
+        self.assertEqual(set(issues), {str(self.issues[0].id), str(self.issues[1].id)})
+        self.assertEqual(issues[str(self.issues[0].id)]['status'], 'FINISHED')
+        self.assertEqual(issues[str(self.issues[1].id)]['comment_count'], 0)
+        self.assertEqual([comment['id'] for comment in data['comments']], [str(new_comment.id)])
+        self.assertEqual(data['deleted']['issues'], [str(self.issues[2].id)])
+        # The issue's comment is deleted with it and gets its own tombstone through the receivers
+        self.assertEqual(set(data['deleted']['comments']), {str(self.comments[1].id), str(self.comments[2].id)})
+
+        # The next sync starts from the new watermark
+        data = self.sync(data['watermark'])
+        self.assertEqual((data['issues'], data['comments']), ([], []))
+
+    def test_bulk_paths(self):
+        watermark = self.sync()['watermark']
+        self.client.post('/api/issues/batch/', {'project': str(self.project.id), 'update': [
+            {'id': str(self.issues[1].id), 'priority': 'HIGH'}]}, format='json')
+        self.assertEqual([issue['id'] for issue in self.sync(watermark)['issues']], [str(self.issues[1].id)])
+
+        other = self.make_user()
+        self.add_contributor(self.project, other)
+        comment = self.make_comment(self.issues[0], author=other)
+        Deleter().delete_user(other.pk)
+        data = self.sync(watermark)
+        self.assertEqual(data['deleted']['comments'], [str(comment.id)])
+        self.assertIn({'id': str(self.issues[0].id), 'comment_count': 1},
+                      [{'id': issue['id'], 'comment_count': issue['comment_count']} for issue in data['issues']])
+
+    def test_contributor_changes_return_the_project(self):
+        watermark = self.sync()['watermark']
+        self.client.post(f'/api/projects/{self.project.id}/add_contributors/',
+                         {'user_ids': [self.make_user().id]}, format='json')
+        self.assertEqual(self.sync(watermark)['project']['contributor_count'], 2)
+
+    def read_pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(json.loads(response.content))
+            self.assertEqual(pages[-1]['has_more'], pages[-1]['next'] is not None)
+            url = pages[-1]['next']
+        return pages
+
+    @override_settings(SYNC={'OVERLAP': 0, 'PAGE_SIZE': 2})
+    def test_pages(self):
+        for issue in self.issues[:2]:
+            self.make_comment(issue)
+        # Issues changed in the same instant are split between pages by their ID
+        Issue.objects.filter(project=self.project).update(updated_time=timezone.now())
+
+        pages = self.read_pages(self.url)
+        self.assertEqual([len(page['issues']) for page in pages], [2, 1, 0])
+        self.assertEqual([len(page['comments']) for page in pages], [2, 2, 1])
+        self.assertEqual({issue['id'] for page in pages for issue in page['issues']},
+                         {str(issue.id) for issue in self.issues})
+        self.assertEqual(len({comment['id'] for page in pages for comment in page['comments']}), 5)
+        # The project comes with the first page, the watermark of the first page is kept to the last one
+        self.assertEqual([page['project'] is not None for page in pages], [True, False, False])
+        self.assertEqual(len({page['watermark'] for page in pages}), 1)
+
+        watermark = pages[-1]['watermark']
+        for issue in self.issues:
+            self.client.delete(f'/api/issues/{issue.id}/')
+        pages = self.read_pages(f'{self.url}?since={watermark}')
+        self.assertEqual(sum(len(page['deleted']['issues']) for page in pages), 3)
+        self.assertEqual(sum(len(page['deleted']['comments']) for page in pages), 5)
+        self.assertTrue(all(len(page['deleted']['issues']) + len(page['deleted']['comments']) <= 2
+                            for page in pages))
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 400)
+        # Readable, but with an ID that is not one
+        now = timezone.now().isoformat()
+        cursor = encode_cursor({'since': None, 'watermark': now,
+                                'positions': {'issues': [now, 'zz'], 'comments': None, 'deleted': None}})
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 400)
+
+    @override_settings(SYNC={'OVERLAP': 60})
+    def test_overlap_sends_recent_rows_again(self):
+        watermark = self.sync()['watermark']
+        self.assertEqual(len(self.sync(watermark)['issues']), 3)
+
+    def test_bad_watermarks(self):
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, 400)
+        old = (timezone.now() - timedelta(days=31)).isoformat()
+        self.assertEqual(self.client.get(self.url, {'since': old}).status_code, 410)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+    def test_purge_tombstones(self):
+        self.issues[0].delete()
+        Tombstone.objects.update(deleted_time=timezone.now() - timedelta(days=31))
+        kept = {self.issues[1].id, self.comments[1].id}
+        self.issues[1].delete()
+        call_command('purge_tombstones', stdout=io.StringIO())
+        self.assertEqual(set(Tombstone.objects.values_list('object_id', flat=True)), kept)
+
+
+class RecordingSubscriber:
+    """ Stands for a connection and keeps the events the hub hands it """
+
+    def __init__(self):
+        self.channels = frozenset()
+        self.events = []
+
+    def deliver(self, event_type, payload):
+        self.events.append(json.loads(payload))
+
+
+class EventTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issue = self.make_issue(self.project)
+        self.token = str(AccessToken.for_user(self.user))
+        self.recorder = RecordingSubscriber()
+        hub.subscribe(self.recorder, frozenset([project_channel(self.project.id)]))
+
+    def tearDown(self):
+        hub.unsubscribe(self.recorder)
+        # Every stream of the test ended and left the hub
+        self.assertEqual(hub.count(), 0)
+        super().tearDown()
+
+    def committed(self, write, *args):
+        """ Run a write and the on_commit callbacks the end of its transaction would run """
+        with self.captureOnCommitCallbacks(execute=True):
+            return write(*args)
+
+    def test_writes_publish_once_committed(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/issues/', {'title': 'New', 'description': 'Description',
+                                                          'priority': 'LOW', 'tag': 'BUG',
+                                                          'project': self.project.id})
+        self.assertEqual(self.recorder.events, [])
+        for callback in callbacks:
+            callback()
+        created = self.recorder.events[0]
+        self.assertEqual((created['type'], created['project'], created['id']),
+                         ('issue.created', str(self.project.id), response.data['id']))
+        self.assertEqual(created['data']['title'], 'New')
+
+        comment = self.committed(self.make_comment, self.issue)
+        self.committed(self.client.patch, f'/api/issues/{self.issue.id}/', {'status': 'FINISHED'})
+        self.committed(self.client.delete, f'/api/comments/{comment.id}/')
+        self.committed(self.client.delete, f'/api/issues/{self.issue.id}/')
+        self.assertEqual([event['type'] for event in self.recorder.events[1:]],
+                         ['comment.created', 'issue.updated', 'comment.deleted', 'issue.deleted'])
+        self.assertEqual(self.recorder.events[1]['issue'], str(self.issue.id))
+        self.assertEqual(self.recorder.events[2]['data']['status'], 'FINISHED')
+
+    def test_bulk_paths_publish(self):
+        self.committed(self.client.post, '/api/issues/batch/', {'project': str(self.project.id), 'create': [
+            {'title': 'Batch', 'description': 'Description', 'tag': 'BUG', 'priority': 'LOW'}], 'update': [
+            {'id': str(self.issue.id), 'priority': 'HIGH'}]}, 'json')
+        self.assertEqual([(event['type'], event['data']['title']) for event in self.recorder.events],
+                         [('issue.created', 'Batch'), ('issue.updated', self.issue.title)])
+
+        self.recorder.events = []
+        self.committed(Deleter().delete_project, self.project.id)
+        self.assertEqual(self.recorder.events, [{'type': 'project.deleted', 'project': str(self.project.id)}])
+
+    def test_unwatched_projects_are_not_serialized(self):
+        other = self.make_project(author=self.make_user())
+        with mock.patch('api.serializers.IssueSerializer.to_representation') as to_representation:
+            self.committed(self.make_issue, other)
+        to_representation.assert_not_called()
+        self.assertEqual(self.recorder.events, [])
+
+    def open_stream(self, scope_type='http', query_string=b'', headers=None):
+        """ Start the ASGI application on a fake connection; returns its task, inbox and outbox """
+        if headers is None:
+            headers = [(b'authorization', f'Bearer {self.token}'.encode())]
+        scope = {'type': scope_type, 'path': '/api/events/', 'method': 'GET', 'query_string': query_string,
+                 'headers': headers}
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        return asyncio.ensure_future(EventStream()(scope, inbox.get, outbox.put)), inbox, outbox
+
+    async def next_message(self, outbox):
+        return await asyncio.wait_for(outbox.get(), 2)
+
+    async def close_stream(self, task, inbox, message_type='http.disconnect'):
+        await inbox.put({'type': message_type})
+        await asyncio.wait_for(task, 2)
+
+    async def test_event_source(self):
+        task, inbox, outbox = self.open_stream()
+        start = await self.next_message(outbox)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual((await self.next_message(outbox))['body'], b'retry: 3000\n\n')
+
+        # Projects of other users are not streamed
+        other = await sync_to_async(self.make_project)(author=await sync_to_async(self.make_user)())
+        await sync_to_async(self.committed)(self.make_issue, other)
+        issue = await sync_to_async(self.committed)(self.make_issue, self.project)
+        body = (await self.next_message(outbox))['body'].decode()
+        self.assertTrue(body.startswith('event: issue.created\ndata: '))
+        self.assertEqual(json.loads(body.split('data: ', 1)[1])['id'], str(issue.id))
+
+        await self.close_stream(task, inbox)
+        self.assertFalse((await self.next_message(outbox)).get('more_body', False))
+
+    async def test_joining_a_project(self):
+        other = await sync_to_async(self.make_project)(author=await sync_to_async(self.make_user)())
+        task, inbox, outbox = self.open_stream(query_string=f'access_token={self.token}'.encode(), headers=[])
+        for _ in range(2):
+            await self.next_message(outbox)
+        await sync_to_async(self.committed)(self.add_contributor, other, self.user)
+        self.assertIn(b'event: membership.changed', (await self.next_message(outbox))['body'])
+        await sync_to_async(self.committed)(self.make_issue, other)
+        self.assertIn(b'event: issue.created', (await self.next_message(outbox))['body'])
+        await self.close_stream(task, inbox)
+
+    async def test_authentication_is_required(self):
+        for headers in ([], [(b'authorization', b'Bearer invalid')]):
+            task, inbox, outbox = self.open_stream(headers=headers)
+            self.assertEqual((await self.next_message(outbox))['status'], 401)
+            self.assertIn('detail', json.loads((await self.next_message(outbox))['body']))
+            await asyncio.wait_for(task, 2)
+
+    @override_settings(API_EVENTS={'HEARTBEAT': 0.01, 'QUEUE_SIZE': 2})
+    async def test_heartbeat_and_overflow(self):
+        task, inbox, outbox = self.open_stream()
+        for _ in range(2):
+            await self.next_message(outbox)
+        self.assertEqual((await self.next_message(outbox))['body'], b': heartbeat\n\n')
+
+        # Events pile up faster than the client reads them
+        await inbox.put({'type': 'http.request'})
+        subscriber = self.stream_subscriber()
+        for _ in range(3):
+            subscriber.put(('issue.updated', b'{}'))
+        messages = [await self.next_message(outbox) for _ in range(2)]
+        self.assertEqual(messages[0]['body'], b'event: overflow\ndata: {}\n\n')
+        self.assertFalse(messages[1].get('more_body', False))
+        await self.close_stream(task, inbox)
+
+    def stream_subscriber(self):
+        return next(iter(hub._channels[project_channel(self.project.id)] - {self.recorder}))
+
+    async def read_until_unauthorized(self, outbox):
+        """ Skip the heartbeats up to the unauthorized event, and return the message that ends the stream """
+        while (await self.next_message(outbox))['body'] != b'event: unauthorized\ndata: {}\n\n':
+            pass
+        return await self.next_message(outbox)
+
+    @override_settings(API_EVENTS={'HEARTBEAT': 0.01})
+    async def test_stream_ends_when_the_token_expires(self):
+        task, inbox, outbox = self.open_stream()
+        for _ in range(2):
+            await self.next_message(outbox)
+        subscriber = self.stream_subscriber()
+        self.assertEqual(subscriber.expires_at, AccessToken(self.token)['exp'])
+
+        subscriber.expires_at = time.time()
+        self.assertFalse((await self.read_until_unauthorized(outbox)).get('more_body', False))
+        await self.close_stream(task, inbox)
+
+    @override_settings(API_EVENTS={'HEARTBEAT': 0.01})
+    async def test_stream_ends_when_the_user_is_deactivated(self):
+        task, inbox, outbox = self.open_stream()
+        for _ in range(2):
+            await self.next_message(outbox)
+
+        # A change that leaves the token valid keeps the stream open
+        self.user.first_name = 'Renamed'
+        await sync_to_async(self.committed)(self.user.save)
+        await sync_to_async(self.committed)(self.make_issue, self.project)
+        while not (await self.next_message(outbox))['body'].startswith(b'event: issue.created'):
+            pass
+
+        self.user.is_active = False
+        await sync_to_async(self.committed)(self.user.save)
+        self.assertFalse((await self.read_until_unauthorized(outbox)).get('more_body', False))
+        await self.close_stream(task, inbox)
+
+    async def test_logout_ends_the_websockets(self):
+        task, inbox, outbox = self.open_stream('websocket', f'access_token={self.token}'.encode(), [])
+        await inbox.put({'type': 'websocket.connect'})
+        await self.next_message(outbox)
+
+        refresh = str(RefreshToken.for_user(self.user))
+        response = await sync_to_async(self.committed)(self.client.post, '/api/auth/logout/', {'refresh': refresh})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(json.loads((await self.next_message(outbox))['text']), {'type': 'unauthorized'})
+        self.assertEqual(await self.next_message(outbox), {'type': 'websocket.close', 'code': 4401})
+        await self.close_stream(task, inbox, 'websocket.disconnect')
+
+    async def test_websocket(self):
+        task, inbox, outbox = self.open_stream('websocket', f'access_token={self.token}'.encode(), [])
+        await inbox.put({'type': 'websocket.connect'})
+        self.assertEqual((await self.next_message(outbox))['type'], 'websocket.accept')
+        await sync_to_async(self.committed)(self.make_comment, self.issue)
+        message = await self.next_message(outbox)
+        self.assertEqual(json.loads(message['text'])['type'], 'comment.created')
+        await self.close_stream(task, inbox, 'websocket.disconnect')
+
+        task, inbox, outbox = self.open_stream('websocket', b'access_token=invalid', [])
+        await inbox.put({'type': 'websocket.connect'})
+        self.assertEqual(await self.next_message(outbox), {'type': 'websocket.close', 'code': 4401})
+        await asyncio.wait_for(task, 2)
+
+
+class CounterTests(SoftDeskTestCase):
+    """ The denormalized counts follow every write path and equal what counting the rows returns """
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.member = self.add_contributor(self.project)
+        self.issues = [self.make_issue(self.project) for _ in range(3)]
+        self.comments = [self.make_comment(self.issues[0]) for _ in range(2)]
+
+    def assertCounts(self, issue_count, open_issue_count, contributor_count):
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertEqual((project.issue_count, project.open_issue_count, project.contributor_count),
+                         (issue_count, open_issue_count, contributor_count))
+        # Counting the rows gives the same numbers
+        self.assertEqual(repair_counts([self.project.pk]), (0, 0))
+
+    def test_single_writes(self):
+        self.assertCounts(3, 3, 2)
+        self.assertEqual(Issue.objects.get(pk=self.issues[0].pk).comment_count, 2)
+
+        self.client.patch(f'/api/issues/{self.issues[0].id}/', {'status': 'FINISHED'})
+        self.assertCounts(3, 2, 2)
+        self.client.delete(f'/api/comments/{self.comments[0].id}/')
+        self.assertEqual(Issue.objects.get(pk=self.issues[0].pk).comment_count, 1)
+        self.client.delete(f'/api/issues/{self.issues[1].id}/')
+        self.client.delete(f'/api/projects/{self.project.id}/remove_contributor/', {'user_id': self.member.id})
+        self.assertCounts(2, 1, 1)
+
+    def test_saves_keep_concurrent_increments(self):
+        issue = Issue.objects.get(pk=self.issues[1].pk)
+        project = Project.objects.get(pk=self.project.pk)
+        self.make_comment(issue)
+        self.make_issue(self.project)
+        issue.title = 'Renamed'
+        issue.save()
+        project.description = 'Changed'
+        project.save()
+        self.assertEqual(Issue.objects.get(pk=issue.pk).comment_count, 1)
+        self.assertCounts(4, 4, 2)
+
+    def test_bulk_paths(self):
+        others = [self.make_user() for _ in range(2)]
+        self.client.post(f'/api/projects/{self.project.id}/add_contributors/',
+                         {'user_ids': [user.id for user in others]}, format='json')
+        self.client.post('/api/issues/batch/', {'project': str(self.project.id), 'create': [
+            {'title': 'Batch', 'description': 'Description', 'tag': 'BUG', 'priority': 'LOW'}], 'update': [
+            {'id': str(self.issues[2].id), 'status': 'FINISHED'}]}, format='json')
+        self.assertCounts(4, 3, 4)
+
+        self.make_comment(self.issues[0], author=others[0])
+        self.make_issue(self.project, author=others[0])
+        Deleter().delete_user(others[0].pk)
+        self.assertCounts(4, 3, 3)
+        self.assertEqual(Issue.objects.get(pk=self.issues[0].pk).comment_count, 2)
+
+    def test_repair_command(self):
+        Project.objects.update(issue_count=0, contributor_count=9)
+        Issue.objects.update(comment_count=5)
+        out = io.StringIO()
+        call_command('repair_counts', stdout=out)
+        self.assertIn('1 projects and 3 issues', out.getvalue())
+        self.assertCounts(3, 3, 2)
+        self.assertEqual(list(Issue.objects.order_by('-comment_count').values_list('comment_count', flat=True)),
+                         [2, 0, 0])
+
+    def test_lists_sort_and_filter_by_counts(self):
+        busy = self.project
+        quiet = self.make_project()
+        self.make_issue(quiet)
+        response = self.client.get('/api/projects/', {'ordering': '-issue_count'})
+        self.assertEqual([row['id'] for row in response.data['results']], [str(busy.id), str(quiet.id)])
+        self.assertEqual(response.data['results'][0]['issue_count'], 3)
+        response = self.client.get('/api/projects/', {'open_issue_count__lte': 1})
+        self.assertEqual([row['id'] for row in response.data['results']], [str(quiet.id)])
+
+        response = self.client.get('/api/issues/', {'project': busy.id, 'comment_count__gte': 1})
+        self.assertEqual([(row['id'], row['comment_count']) for row in response.data['results']],
+                         [(str(self.issues[0].id), 2)])
+
+
+class MembershipScopingTests(SoftDeskTestCase):
+    """ Every viewset only reaches the projects of the caller, through a semi-join on Contributor """
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.issue = self.make_issue(self.project)
+        self.comment = self.make_comment(self.issue)
+        self.outside = self.make_project(author=self.make_user())
+        self.make_comment(self.make_issue(self.outside, author=self.outside.author), author=self.outside.author)
+
+    def list_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries.captured_queries if 'api_contributor' in query['sql']]
+
+    def test_lists_only_show_member_rows(self):
+        for url, row in (('/api/projects/', self.project), ('/api/issues/', self.issue),
+                         ('/api/comments/', self.comment)):
+            response = self.client.get(url)
+            self.assertEqual([result['id'] for result in response.data['results']], [str(row.id)])
+            self.assertEqual(response.data['count'], 1)
+
+    def test_statements_do_not_grow_with_the_projects(self):
+        before = {url: self.list_queries(url)[1] for url in ('/api/projects/', '/api/issues/', '/api/comments/')}
+        for _ in range(20):
+            self.add_contributor(self.make_project(author=self.make_user()), self.user)
+        # Same statements apart from their numbers (user ID, LIMIT)
+        for url, statements in before.items():
+            self.assertEqual([re.sub(r'\d+', '', sql) for sql in self.list_queries(url)[1]],
+                             [re.sub(r'\d+', '', sql) for sql in statements])
+
+    def test_scoping_is_served_by_indexes(self):
+        for url in ('/api/projects/', '/api/issues/', '/api/comments/'):
+            for sql in self.list_queries(url)[1]:
+                plan = explain(sql)
+                scans = [line for line in plan if line.startswith('SCAN') or 'Seq Scan' in line]
+                self.assertEqual(scans, [], f'{sql}\n' + '\n'.join(plan))
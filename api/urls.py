@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework import routers
-from .views import ProjectViewSet, IssueViewSet, CommentViewSet
+from . import async_views
+from .instrumentation import metrics_view
+from .views import ProjectViewSet, IssueViewSet, CommentViewSet, DeletionJobView
 
 
 router = routers.DefaultRouter()
@@ -11,4 +13,13 @@ router.register('comments', CommentViewSet, basename='comments')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/', metrics_view, name='metrics'),
+    path('deletion-jobs/<uuid:pk>/', DeletionJobView.as_view(), name='deletion-job'),
+    # Async read endpoints, for deployments served through softdesk_api/asgi.py
+    path('async/projects/', async_views.project_list, name='async-projects-list'),
+    path('async/projects/<str:pk>/', async_views.project_detail, name='async-projects-detail'),
+    path('async/issues/', async_views.issue_list, name='async-issues-list'),
+    path('async/issues/<str:pk>/', async_views.issue_detail, name='async-issues-detail'),
+    path('async/comments/', async_views.comment_list, name='async-comments-list'),
+    path('async/comments/<str:pk>/', async_views.comment_detail, name='async-comments-detail'),
 ]
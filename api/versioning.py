@@ -0,0 +1,103 @@
+import hashlib
+import uuid
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .membership import get_request_project_ids
+from .models import Project, Contributor, Issue, Comment
+
+
+def bump_project_version(*project_ids, **counts):
+    """
+    Mark the projects as changed, which changes the ETag of every response built from them.
+    counts are deltas of the counters (see api.counters) to add in the same UPDATE, along with updated_time, or
+    expressions that recount them.
+    """
+    counts = {field: delta if hasattr(delta, 'resolve_expression') else F(field) + delta
+              for field, delta in counts.items() if hasattr(delta, 'resolve_expression') or delta}
+    if counts:
+        counts['updated_time'] = timezone.now()
+    Project.objects.filter(pk__in=project_ids).update(version=F('version') + 1, **counts)
+
+
+def bump_user_project_versions(user_id):
+    """ Mark the projects of a user as changed, since their responses embed the user (author, assignee, member) """
+    Project.objects.filter(pk__in=Contributor.objects.filter(user_id=user_id).values('project_id')).update(
+        version=F('version') + 1)
+
+
+def bump_project_version_of_issue(issue_id):
+    Project.objects.filter(issues__id=issue_id).update(version=F('version') + 1)
+
+
+def get_project_versions(project_ids):
+    return sorted(Project.objects.filter(pk__in=project_ids).values_list('id', 'version'))
+
+
+def build_etag(request, versions):
+    """ The ETag depends on the requested URL (filters, ordering, page) and on the versions of the projects read """
+    raw = f'{request.get_full_path()}|' + ','.join(f'{project_id}:{version}' for project_id, version in versions)
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def parse_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+class ConditionalGetMixin:
+    """
+    Answer list and retrieve requests with an ETag derived from the version of the projects they read,
+    and with a 304 before any serializer or main query runs when the client's If-None-Match still matches.
+    Viewsets return the (project ID, version) pairs of those projects from get_etag_versions, or None when
+    they cannot tell.
+    """
+
+    def get_etag_versions(self):
+        return None
+
+    def get_etag(self):
+        versions = self.get_etag_versions()
+        if versions is None:
+            return None
+        # Only projects the user contributes to can make a response, anything else goes through the normal path
+        if not {project_id for project_id, _ in versions} <= get_request_project_ids(self.request):
+            return None
+        return build_etag(self.request, versions)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        # Kept on the view so the response cache can key on it
+        self.etag = etag = self.get_etag()
+        if etag and etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = handler(request, *args, **kwargs)
+        if etag and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+
+def get_issue_project_versions(issue_id):
+    """ Version of the project of an issue, read in the same query as the issue's project ID """
+    issue_id = parse_uuid(issue_id)
+    if issue_id is None:
+        return None
+    return list(Issue.objects.filter(pk=issue_id).values_list('project_id', 'project__version'))
+
+
+def get_comment_project_versions(comment_id):
+    comment_id = parse_uuid(comment_id)
+    if comment_id is None:
+        return None
+    return list(Comment.objects.filter(pk=comment_id).values_list('issue__project_id', 'issue__project__version'))
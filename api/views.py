@@ -1,22 +1,76 @@
+from django.db import transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, permissions, status, filters
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import generics, viewsets, permissions, status, filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 from authentication.models import User
-from .models import Project, Contributor, Issue, Comment
+from softdesk_api.db_router import ReplicaReadMixin
+from .counters import contributor_count
+from .deletion import Deleter, delete_now, delete_rows, is_background_request, start_deletion_job
+from .events import publish_issues, publish_membership
+from .export import stream_csv, stream_ndjson
+from .fast_serialization import FastListMixin
+from .instrumentation import TimedPermissionsMixin
+from .membership import MembershipScopedMixin, get_request_project_ids, invalidate_many_project_ids
+from .models import Project, Contributor, Issue, Comment, DeletionJob
+from .pagination import CursorOrPageNumberPagination
 from .permission import IsAuthor, IsProjectContributor
+from .response_cache import ResponseCacheMixin
+from .search import index_new_issues, search_issue_ids
+from .stats import count_issues, get_project_stats, lock_loaded_values, record_counts
+from .sync import InvalidCursor, WatermarkExpired, get_changes, parse_watermark
 from .serializers import (ProjectSerializer, DetailedProjectSerializer, ContributorSerializer,
-                          DetailedIssueSerializer, IssueSerializer, CommentSerializer)
+                          ContributorBulkSerializer, DetailedIssueSerializer, IssueSerializer, CommentSerializer,
+                          IssueBatchSerializer, IssueBatchCreateSerializer, IssueBatchUpdateSerializer,
+                          DeletionJobSerializer)
+from .versioning import (ConditionalGetMixin, bump_project_version, get_project_versions, get_issue_project_versions,
+                         get_comment_project_versions, parse_uuid)
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+def deletion_job_response(request, job, status_code=status.HTTP_202_ACCEPTED):
+    url = request.build_absolute_uri(reverse('deletion-job', args=[job.pk]))
+    return Response(DeletionJobSerializer(job).data, status=status_code, headers={'Location': url})
+
+
+class DeletionJobView(generics.RetrieveAPIView):
+    """
+    Progress of a background deletion. Open to anyone with the job's random ID: the user who deleted their
+    account has no valid token left to ask with.
+    """
+    queryset = DeletionJob.objects.all()
+    serializer_class = DeletionJobSerializer
+    authentication_classes = []
+    permission_classes = []
+
+
+class ProjectViewSet(MembershipScopedMixin, ReplicaReadMixin, TimedPermissionsMixin, ConditionalGetMixin,
+                     ResponseCacheMixin, FastListMixin, viewsets.ModelViewSet):
     serializer_class = ProjectSerializer
+    membership_project_field = 'pk'
     permission_classes = [permissions.IsAuthenticated, IsProjectContributor, IsAuthor]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    # Activity counters are columns (see api.counters), so sorting and filtering by them needs no aggregation
+    filterset_fields = {name: ['exact', 'gte', 'lte'] for name in ('issue_count', 'open_issue_count',
+                                                                   'contributor_count')}
+    ordering_fields = ['issue_count', 'open_issue_count', 'contributor_count', 'created_time', 'updated_time']
+
+    def get_etag_versions(self):
+        if self.action in ('retrieve', 'sync'):
+            project_id = parse_uuid(self.kwargs['pk'])
+            return get_project_versions([project_id]) if project_id else None
+        return get_project_versions(get_request_project_ids(self.request))
 
     def get_queryset(self):
-        return Project.objects.filter(contributors__user=self.request.user)
+        queryset = self.scope_to_membership(Project.objects.all())
+        return self.get_serializer_class().setup_eager_loading(queryset, self.request)
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -28,6 +82,20 @@ class ProjectViewSet(viewsets.ModelViewSet):
         project = serializer.save(author=self.request.user)
         Contributor.objects.create(user=self.request.user, project=project)
 
+    def destroy(self, request, *args, **kwargs):
+        """
+        Delete the project by chunks (see api.deletion), or answer 202 with a deletion job with ?background=true.
+        A deletion that fails halfway answers 500 with its job, which run_deletion_jobs finishes.
+        """
+        project = self.get_object()
+        if is_background_request(request):
+            return deletion_job_response(request, start_deletion_job('PROJECT', project.pk))
+        job = delete_now('PROJECT', project.pk)
+        if job.status == 'FAILED':
+            # Finished later by run_deletion_jobs
+            return deletion_job_response(request, job, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=True, methods=['post'])
     def add_contributor(self, request, pk=None):
         project = self.get_object()
@@ -40,6 +108,9 @@ class ProjectViewSet(viewsets.ModelViewSet):
         if not user:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
+        if Contributor.objects.filter(user=user, project=project).exists():
+            return Response({'error': 'User is already a contributor'}, status=status.HTTP_400_BAD_REQUEST)
+
         contributor = Contributor.objects.create(user=user, project=project)
         serializer = ContributorSerializer(contributor)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -67,21 +138,176 @@ class ProjectViewSet(viewsets.ModelViewSet):
         contributor.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=True, methods=['post'])
+    def add_contributors(self, request, pk=None):
+        """ Add a list of users in one transaction and report the outcome for each of them """
+        project = self.get_object()
+        serializer = ContributorBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data['user_ids']
+
+        with transaction.atomic():
+            found = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+            existing = set(Contributor.objects.filter(project=project, user_id__in=found)
+                           .values_list('user_id', flat=True))
+            added = found - existing
+            # ignore_conflicts covers a concurrent request adding the same user
+            Contributor.objects.bulk_create([Contributor(user_id=user_id, project=project) for user_id in added],
+                                            ignore_conflicts=True)
+
+        # bulk_create does not send post_save, so the membership cache, the counter and the project version are
+        # updated here. The counter is recounted: rows skipped by ignore_conflicts are not reported
+        invalidate_many_project_ids(added)
+        publish_membership(project.id, added)
+        if added:
+            bump_project_version(project.id, contributor_count=contributor_count())
+
+        results = []
+        for user_id in user_ids:
+            if user_id not in found:
+                result = 'not_found'
+            elif user_id in existing:
+                result = 'already_contributor'
+            else:
+                result = 'added'
+            results.append({'user_id': user_id, 'status': result})
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'])
+    def remove_contributors(self, request, pk=None):
+        """ Remove a list of users in one transaction and report the outcome for each of them """
+        project = self.get_object()
+        serializer = ContributorBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data['user_ids']
+
+        with transaction.atomic():
+            # Don't allow removing the project author
+            rows = dict(Contributor.objects.filter(project=project, user_id__in=user_ids)
+                        .exclude(user_id=project.author_id).values_list('user_id', 'pk'))
+            existing = set(rows)
+            # One DELETE without the per-row post_delete receivers, whose work is done once for the batch below
+            removed = delete_rows(Contributor, list(rows.values()))
+
+        invalidate_many_project_ids(existing)
+        publish_membership(project.id, existing)
+        if removed:
+            bump_project_version(project.id, contributor_count=-removed)
+
+        results = []
+        for user_id in user_ids:
+            if user_id == project.author_id:
+                result = 'is_author'
+            elif user_id in existing:
+                result = 'removed'
+            else:
+                result = 'not_contributor'
+            results.append({'user_id': user_id, 'status': result})
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """ Issue counts of the project by status, priority, tag and assignee, read from the summary rows """
+        project = self.get_object()
+        return Response(get_project_stats(project.id))
 
-class IssueViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def sync(self, request, pk=None):
+        """
+        Changes of the project since the watermark of the previous sync (?since=), see api.sync, by pages to read
+        through the next links until has_more is false. Without since, the whole project; the ETag answers 304 when
+        nothing changed at all.
+        """
+        return self.conditional_response(self.sync_response, request)
+
+    def sync_response(self, request):
+        project = self.get_object()
+        since = None
+        if 'since' in request.query_params:
+            since = parse_watermark(request.query_params['since'])
+            if since is None:
+                return Response({'error': 'since must be the watermark of a previous sync'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        cursor = request.query_params.get('cursor')
+        try:
+            changes = get_changes(project, since, IssueSerializer, CommentSerializer, request, cursor)
+        except WatermarkExpired:
+            return Response({'error': 'The watermark is too old, sync the whole project again'},
+                            status=status.HTTP_410_GONE)
+        except InvalidCursor:
+            return Response({'error': 'cursor must be the cursor of the previous page'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # The project is sent with the first page only
+        changed = cursor is None and (since is None or project.updated_time > since)
+        next_cursor = changes.pop('cursor')
+        changes['next'] = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) \
+            if next_cursor else None
+        return Response({'project': ProjectSerializer(project, context={'request': request}).data if changed else None,
+                         **changes})
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Stream every issue of the project with its comments, as NDJSON (default) or CSV (?export_format=csv).
+        Rows are read in chunks and sent as they are produced, so memory does not grow with the project.
+        """
+        project = self.get_object()
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format == 'csv':
+            response = StreamingHttpResponse(stream_csv(project), content_type='text/csv')
+        elif export_format == 'ndjson':
+            response = StreamingHttpResponse(stream_ndjson(project), content_type='application/x-ndjson')
+        else:
+            return Response({'error': 'Export format must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+        response['Content-Disposition'] = f'attachment; filename="project-{project.id}.{export_format}"'
+        return response
+
+
+class IssueViewSet(MembershipScopedMixin, ReplicaReadMixin, TimedPermissionsMixin, ConditionalGetMixin,
+                   ResponseCacheMixin, FastListMixin, viewsets.ModelViewSet):
     serializer_class = IssueSerializer
     permission_classes = [permissions.IsAuthenticated, IsProjectContributor, IsAuthor]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['project', 'assignee', 'author']
-    ordering_fields = ['priority', 'status', 'tag']
+    filterset_fields = {'project': ['exact'], 'assignee': ['exact'], 'author': ['exact'],
+                        'comment_count': ['exact', 'gte', 'lte']}
+    pagination_class = CursorOrPageNumberPagination
+    ordering_fields = ['priority', 'status', 'tag', 'comment_count']
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return DetailedIssueSerializer
         return super().get_serializer_class()
 
+    def get_etag_versions(self):
+        if self.action == 'retrieve':
+            return get_issue_project_versions(self.kwargs['pk'])
+        # The list only gets an ETag when it is restricted to one project
+        project_id = parse_uuid(self.request.query_params.get('project', ''))
+        return get_project_versions([project_id]) if project_id else None
+
     def get_queryset(self):
-        return Issue.objects.all().order_by('-created_time')
+        queryset = self.scope_to_membership(Issue.objects.all()).order_by('-created_time')
+        return self.get_serializer_class().setup_eager_loading(queryset, self.request)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Issues of the caller's projects matching ?q= in their title, description or comments, best match first.
+        ?limit= sets the number of results (20 by default, 100 at most).
+        """
+        text = request.query_params.get('q', '')
+        if not text.strip():
+            return Response({'error': 'Search text is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'Limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+        issue_ids = [parse_uuid(issue_id) for issue_id in
+                     search_issue_ids(text, get_request_project_ids(request), limit)]
+        issues = Issue.objects.in_bulk(issue_ids)
+        results = [issues[issue_id] for issue_id in issue_ids if issue_id in issues]
+        return Response({'results': IssueSerializer(results, many=True).data})
 
     def get_serializer_context(self):
         """ Add project to serializer context,so it can be used in validation """
@@ -100,17 +326,127 @@ class IssueViewSet(viewsets.ModelViewSet):
         project = get_object_or_404(Project, id=project_id)
         serializer.save(author=self.request.user, project=project)
 
+    def perform_update(self, serializer):
+        # The row stays locked until the save commits, so the statistics count the change from the values it
+        # replaces even when another request changed the issue since it was read (see api.stats)
+        with transaction.atomic():
+            lock_loaded_values([serializer.instance])
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        # By chunks (see api.deletion): the collector would run the comment receivers once for every comment
+        Deleter().delete_issues(Issue.objects.filter(pk=instance.pk))
 
-class CommentViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Create issues and apply partial updates (status, priority, assignee) to issues of one project.
+        Membership, titles and the issues to update are each checked with one query, rows are written with
+        bulk_create/bulk_update, and the response reports the outcome of every item.
+        """
+        batch = IssueBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        project = get_object_or_404(Project, id=batch.validated_data['project'])
+        if project.id not in get_request_project_ids(request):
+            raise PermissionDenied('You are not a contributor of this project')
+
+        creates = [IssueBatchCreateSerializer(data=item) for item in batch.validated_data.get('create', [])]
+        updates = [IssueBatchUpdateSerializer(data=item) for item in batch.validated_data.get('update', [])]
+        create_errors = [None if item.is_valid() else item.errors for item in creates]
+        update_errors = [None if item.is_valid() else item.errors for item in updates]
+
+        valid_creates = [item.validated_data for item, errors in zip(creates, create_errors) if errors is None]
+        valid_updates = [item.validated_data for item, errors in zip(updates, update_errors) if errors is None]
+
+        assignee_ids = {data['assignee_id'] for data in valid_creates + valid_updates if data.get('assignee_id')}
+        members = set(Contributor.objects.filter(project=project, user_id__in=assignee_ids)
+                      .values_list('user_id', flat=True))
+        titles = [data['title'] for data in valid_creates]
+        taken_titles = set(Issue.objects.filter(project=project, title__in=titles).values_list('title', flat=True))
+        issues = Issue.objects.filter(project=project).in_bulk([data['id'] for data in valid_updates])
+
+        new_issues = []
+        for index, item in enumerate(creates):
+            if create_errors[index] is not None:
+                continue
+            data = item.validated_data
+            if data.get('assignee_id') and data['assignee_id'] not in members:
+                create_errors[index] = {'assignee_id': ['User is not a contributor of this project']}
+            elif data['title'] in taken_titles:
+                create_errors[index] = {'title': ['An issue with this title already exists in this project']}
+            else:
+                taken_titles.add(data['title'])
+                new_issues.append((index, Issue(project=project, author=request.user, **data)))
+
+        changed_issues = []
+        changed_fields = set()
+        for index, item in enumerate(updates):
+            if update_errors[index] is not None:
+                continue
+            data = dict(item.validated_data)
+            issue = issues.get(data.pop('id'))
+            if issue is None:
+                update_errors[index] = {'id': ['Issue not found in this project']}
+            elif issue.author_id != request.user.id:
+                update_errors[index] = {'id': ['You do not have permission to edit this issue']}
+            elif data.get('assignee_id') and data['assignee_id'] not in members:
+                update_errors[index] = {'assignee_id': ['User is not a contributor of this project']}
+            else:
+                for field, value in data.items():
+                    setattr(issue, field, value)
+                # bulk_update does not run auto_now
+                issue.updated_time = timezone.now()
+                changed_fields.update(data, ['updated_time'])
+                changed_issues.append((index, issue))
+
+        with transaction.atomic():
+            lock_loaded_values([issue for _, issue in changed_issues])
+            Issue.objects.bulk_create([issue for _, issue in new_issues])
+            if changed_fields:
+                Issue.objects.bulk_update([issue for _, issue in changed_issues], list(changed_fields))
+            # Bulk writes send no signals, so the project version, the search index, the statistics and the
+            # events are handled here
+            index_new_issues([issue for _, issue in new_issues])
+            if new_issues or changed_issues:
+                # One UPDATE of the project for its version and its issue counts
+                by_project = count_issues([issue for _, issue in new_issues], created=True)
+                record_counts(count_issues([issue for _, issue in changed_issues], by_project=by_project))
+            publish_issues('created', [issue for _, issue in new_issues])
+            publish_issues('updated', [issue for _, issue in changed_issues])
+
+        created = dict(new_issues)
+        updated = dict(changed_issues)
+        return Response({
+            'created': [{'index': index, 'errors': errors} if errors is not None else
+                        {'index': index, 'issue': IssueSerializer(created[index]).data}
+                        for index, errors in enumerate(create_errors)],
+            'updated': [{'index': index, 'errors': errors} if errors is not None else
+                        {'index': index, 'issue': IssueSerializer(updated[index]).data}
+                        for index, errors in enumerate(update_errors)],
+        }, status=status.HTTP_200_OK)
+
+
+class CommentViewSet(MembershipScopedMixin, ReplicaReadMixin, TimedPermissionsMixin, ConditionalGetMixin,
+                     ResponseCacheMixin, FastListMixin, viewsets.ModelViewSet):
     serializer_class = CommentSerializer
+    membership_project_field = 'issue__project'
     permission_classes = [permissions.IsAuthenticated, IsProjectContributor, IsAuthor]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['issue']
+    pagination_class = CursorOrPageNumberPagination
     ordering_fields = ['created_time', 'issue']
 
+    def get_etag_versions(self):
+        if self.action == 'retrieve':
+            return get_comment_project_versions(self.kwargs['pk'])
+        return get_project_versions(get_request_project_ids(self.request))
+
     def get_queryset(self):
         # Only allow comments for issues in projects the user is a contributor of the project
-        return Comment.objects.filter(issue__project__contributors__user=self.request.user).order_by('-created_time')
+        queryset = self.scope_to_membership(Comment.objects.all())
+        # Expose the project on each comment so IsProjectContributor does not load the issue
+        queryset = queryset.annotate(project_id=F('issue__project_id')).order_by('-created_time')
+        return self.get_serializer_class().setup_eager_loading(queryset, self.request)
 
     def perform_create(self, serializer):
         issue_id = self.request.data.get('issue')
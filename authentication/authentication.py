@@ -0,0 +1,90 @@
+import functools
+
+from django.http import HttpResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import User
+from .user_cache import user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the user from authentication.user_cache, so most requests skip the User lookup.
+    Users are only cached once the parent class has accepted them (found and active).
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(user_id) if user_id is not None else None
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user)
+        elif api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+    async def aauthenticate(self, request):
+        """
+        Async version of authenticate() for the async views, which DRF does not run: the token checks are pure
+        computation and the user comes from the cache or from the async ORM.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            raise AuthenticationFailed(_('Token contained no recognizable user identification'))
+        user = user_cache.get(user_id)
+        if user is None:
+            try:
+                user = await User.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+                raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+            user_cache.set(user)
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user, validated_token
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    """ Render data exactly as a DRF Response negotiated to JSON would, for the async views """
+    return HttpResponse(JSONRenderer().render(data), status=status, headers=headers,
+                        content_type='application/json')
+
+
+def async_jwt_required(view):
+    """
+    Decorator for the async views: authenticate the request with CachedJWTAuthentication and answer 401 with the
+    same body and WWW-Authenticate header as DRF when it fails.
+    """
+    authenticator = CachedJWTAuthentication()
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            result = await authenticator.aauthenticate(request)
+            if result is None:
+                raise NotAuthenticated()
+        except (AuthenticationFailed, NotAuthenticated) as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return json_response(data, status=status.HTTP_401_UNAUTHORIZED,
+                                 headers={'WWW-Authenticate': authenticator.authenticate_header(request)})
+        request.user, request.auth = result
+        return await view(request, *args, **kwargs)
+
+    return wrapper
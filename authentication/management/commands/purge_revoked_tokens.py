@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from authentication.revocation import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Delete the revoked refresh tokens that have expired; meant to run periodically (cron, scheduler)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_tokens(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired tokens'))
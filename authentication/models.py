@@ -11,3 +11,16 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+class RevokedToken(models.Model):
+    """
+    Refresh token that may no longer be used, kept until it expires anyway.
+    Only the JTI is stored; see authentication.revocation.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.jti
@@ -0,0 +1,106 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .models import RevokedToken
+
+
+DEFAULTS = {
+    # Seconds a sync is trusted. 0 reads the new revocations at every check; more saves that query for most checks
+    # but lets another worker accept a token revoked elsewhere for up to that long
+    'SYNC_INTERVAL': 0,
+    # Seconds of revocations read again at every sync, so rows committed late by another worker are not missed
+    'SYNC_OVERLAP': 60,
+    # Seconds between two removals of the expired JTIs from the in-process set
+    'PRUNE_INTERVAL': 300,
+    # Rows deleted per query by purge_expired_tokens
+    'PURGE_BATCH_SIZE': 1000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JWT_REVOCATION', {})}
+
+
+class RevocationFilter:
+    """
+    In-process set of the revoked JTIs that have not expired, backed by the RevokedToken table.
+    The first check loads the table once; every later check only reads the rows revoked since the previous one
+    (an index range scan on revoked_at), so its cost does not grow with the number of revoked tokens and
+    revocations made by other workers are seen at once.
+    """
+
+    def __init__(self):
+        self._expiries = {}
+        self._synced_at = None
+        self._pruned_at = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        config = get_config()
+        now = timezone.now()
+        if self._synced_at is not None and now - self._synced_at < timedelta(seconds=config['SYNC_INTERVAL']):
+            return
+        queryset = RevokedToken.objects.filter(expires_at__gt=now)
+        if self._synced_at is not None:
+            queryset = queryset.filter(revoked_at__gte=self._synced_at - timedelta(seconds=config['SYNC_OVERLAP']))
+        rows = list(queryset.values_list('jti', 'expires_at'))
+
+        with self._lock:
+            self._expiries.update(rows)
+            self._synced_at = now
+            if self._pruned_at is None or now - self._pruned_at >= timedelta(seconds=config['PRUNE_INTERVAL']):
+                self._expiries = {jti: expires for jti, expires in self._expiries.items() if expires > now}
+                self._pruned_at = now
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._expiries[jti] = expires_at
+
+    def __contains__(self, jti):
+        self.sync()
+        expires_at = self._expiries.get(jti)
+        return expires_at is not None and expires_at > timezone.now()
+
+    def clear(self):
+        with self._lock:
+            self._expiries = {}
+            self._synced_at = None
+            self._pruned_at = None
+
+
+revoked_tokens = RevocationFilter()
+
+
+def is_revoked(token):
+    return token[api_settings.JTI_CLAIM] in revoked_tokens
+
+
+def revoke_token(token):
+    """ Revoke a refresh token; return False when it already was """
+    jti = token[api_settings.JTI_CLAIM]
+    expires_at = datetime_from_epoch(token['exp'])
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+    except IntegrityError:
+        return False
+    revoked_tokens.add(jti, expires_at)
+    return True
+
+
+def purge_expired_tokens(batch_size=None):
+    """ Delete the expired rows a batch at a time, so no single query locks the table for long; return the count """
+    batch_size = batch_size or get_config()['PURGE_BATCH_SIZE']
+    now = timezone.now()
+    deleted = 0
+    while True:
+        ids = list(RevokedToken.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += RevokedToken.objects.filter(pk__in=ids).delete()[0]
@@ -1,6 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from .models import User
+from .revocation import is_revoked, revoke_token
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -31,3 +37,34 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         validated_data.pop('password2')
         user = User.objects.create_user(**validated_data)
         return user
+
+
+class RevokingTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refuse revoked refresh tokens, and revoke the token that was just rotated when BLACKLIST_AFTER_ROTATION is
+    set, so each refresh token can be used once.
+    Replaces the parent's validate(), which records every rotated token in the token_blacklist app's
+    OutstandingToken table; that app is not installed and the table would grow without limit.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if is_revoked(refresh):
+            raise TokenError(_('Token is revoked'))
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        if user_id:
+            user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+            if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+                raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            # The unique JTI settles two concurrent refreshes of the same token: only one of them gets through
+            if api_settings.BLACKLIST_AFTER_ROTATION and not revoke_token(refresh):
+                raise TokenError(_('Token is revoked'))
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from api.events import publish_user_change
+from api.versioning import bump_user_project_versions
+from .models import User
+from .user_cache import user_cache
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Covers is_active, is_staff and is_superuser changes made from the admin or the API
+    user_cache.invalidate(instance.pk)
+    # Open event streams check their token again: a deactivated or deleted user, or a new password, ends them
+    publish_user_change(instance.pk)
+    if not kwargs.get('created'):
+        # The ETags and cached responses that embed the user change with it
+        bump_user_project_versions(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        user_cache.invalidate(instance.pk)
+    elif pk_set is None:
+        # A group or permission was cleared of all its users, which are not listed
+        user_cache.clear()
+    else:
+        # From the group or permission side, pk_set holds the users
+        for user_id in pk_set:
+            user_cache.invalidate(user_id)
@@ -1,3 +1,192 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from api.models import Project, Contributor, Issue, Comment, IssueSearchDocument
+from api.stats import get_project_stats
+from .models import User, RevokedToken
+from .revocation import is_revoked, purge_expired_tokens, revoked_tokens
+from .user_cache import user_cache
+
+
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.user = User.objects.create_user(username='alice', age=30)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_user_lookup_is_saved_after_the_first_request(self):
+        # Benchmark of the saved queries: the User row is read once for ten authenticated requests
+        with self.assertNumQueries(1):
+            for _ in range(10):
+                self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+
+    def test_cached_user_is_a_fresh_instance(self):
+        self.client.get('/api/auth/me/')
+        self.assertIsNot(user_cache.get(self.user.pk), user_cache.get(self.user.pk))
+
+    def test_update_through_the_api_invalidates(self):
+        self.client.get('/api/auth/me/')
+        self.client.put('/api/auth/me/', {'first_name': 'Alice'})
+        self.assertEqual(self.client.get('/api/auth/me/').data['first_name'], 'Alice')
+
+    def test_deactivation_invalidates(self):
+        self.client.get('/api/auth/me/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+
+    def test_delete_invalidates(self):
+        self.client.get('/api/auth/me/')
+        self.assertEqual(self.client.delete('/api/auth/me/').status_code, 204)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+
+    def test_group_change_invalidates(self):
+        self.client.get('/api/auth/me/')
+        group = Group.objects.create(name='staff')
+        group.user_set.add(self.user)
+        self.assertIsNone(user_cache.get(self.user.pk))
+
+    @override_settings(JWT_USER_CACHE={'MAX_SIZE': 2})
+    def test_least_recently_used_entries_are_evicted(self):
+        users = [User.objects.create_user(username=f'user{i}', age=30) for i in range(3)]
+        for user in users:
+            user_cache.set(user)
+        self.assertIsNone(user_cache.get(users[0].pk))
+        self.assertIsNotNone(user_cache.get(users[2].pk))
+
+    @override_settings(JWT_USER_CACHE={'TIMEOUT': 0})
+    def test_entries_expire(self):
+        user_cache.set(self.user)
+        self.assertIsNone(user_cache.get(self.user.pk))
+
+    @override_settings(JWT_USER_CACHE={'SHARED_CACHE_ALIAS': 'default'})
+    def test_shared_cache_serves_other_workers(self):
+        user_cache.set(self.user)
+        # An empty local LRU stands for another worker
+        user_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(user_cache.get(self.user.pk).username, 'alice')
+
+    def test_async_user_detail(self):
+        get = async_to_sync(self.async_client.get)
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        get('/api/auth/async/me/', headers=headers)
+        with self.assertNumQueries(0):
+            response = get('/api/auth/async/me/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['username'], 'alice')
+
+
+class RefreshTokenRevocationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        revoked_tokens.clear()
+        self.user = User.objects.create_user(username='alice', age=30)
+        self.client = APIClient()
+        self.refresh = RefreshToken.for_user(self.user)
+
+    def refresh_with(self, token):
+        return self.client.post('/api/auth/refresh/', {'refresh': str(token)})
+
+    def test_rotated_token_cannot_be_used_again(self):
+        response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': response.data['refresh']}).status_code,
+                         200)
+
+    def test_logout_revokes(self):
+        self.assertEqual(self.client.post('/api/auth/logout/', {'refresh': str(self.refresh)}).status_code, 204)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+        self.assertEqual(self.client.post('/api/auth/logout/', {'refresh': 'garbage'}).status_code, 400)
+
+    def test_revocations_of_other_workers_are_seen(self):
+        revoked_tokens.sync()
+        RevokedToken.objects.create(jti=self.refresh['jti'], expires_at=timezone.now() + timedelta(days=1))
+        self.assertTrue(is_revoked(self.refresh))
+
+    def test_check_cost_does_not_grow_with_the_table(self):
+        expires_at = timezone.now() + timedelta(days=1)
+        RevokedToken.objects.bulk_create([RevokedToken(jti=f'jti{index}', expires_at=expires_at)
+                                          for index in range(2000)])
+        self.assertFalse(is_revoked(self.refresh))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(is_revoked(self.refresh))
+        self.assertEqual(len(queries), 1)
+        self.assertIn('revoked_at', queries[0]['sql'])
+
+    def test_purge_deletes_expired_rows_in_batches(self):
+        now = timezone.now()
+        RevokedToken.objects.bulk_create(
+            [RevokedToken(jti=f'old{index}', expires_at=now - timedelta(minutes=1)) for index in range(5)]
+            + [RevokedToken(jti='live', expires_at=now + timedelta(days=1))])
+        with self.assertNumQueries(3 * 2 + 1):  # select and delete for each batch of 2, then an empty select
+            self.assertEqual(purge_expired_tokens(batch_size=2), 5)
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+
+
+@override_settings(DELETION={'RUN_IN_THREAD': False})
+class AccountDeletionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.user = User.objects.create_user(username='alice', age=30)
+        self.other = User.objects.create_user(username='bob', age=30)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+        self.own_project = Project.objects.create(title='Own', description='Description', type='BACKEND',
+                                                  author=self.user)
+        self.project = Project.objects.create(title='Shared', description='Description', type='BACKEND',
+                                              author=self.other)
+        for user, project in ((self.user, self.own_project), (self.other, self.own_project),
+                              (self.user, self.project), (self.other, self.project)):
+            Contributor.objects.create(user=user, project=project)
+        Issue.objects.create(title='Own issue', description='Description', priority='LOW', tag='BUG',
+                             project=self.own_project, author=self.other)
+        Issue.objects.create(title='Authored', description='Description', priority='LOW', tag='BUG',
+                             project=self.project, author=self.user)
+        Issue.objects.create(title='Assigned', description='Description', priority='LOW', tag='BUG',
+                             project=self.project, author=self.other, assignee=self.user)
+        self.kept = Issue.objects.create(title='Kept', description='Description', priority='LOW', tag='BUG',
+                                         project=self.project, author=self.other)
+        Comment.objects.create(description='Comment by alice', issue=self.kept, author=self.user)
+        Comment.objects.create(description='Comment by bob', issue=self.kept, author=self.other)
+
+    def assertAccountGone(self):
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Project.objects.filter(pk=self.own_project.pk).exists())
+        # Same rows as the foreign keys' CASCADE would remove, and the statistics and search documents follow
+        self.assertEqual(list(Issue.objects.values_list('title', flat=True)), ['Kept'])
+        self.assertEqual(list(Comment.objects.values_list('description', flat=True)), ['Comment by bob'])
+        self.assertEqual(list(Contributor.objects.values_list('user_id', flat=True)), [self.other.pk])
+        self.assertEqual(get_project_stats(self.project.pk)['total'], 1)
+        self.assertEqual(IssueSearchDocument.objects.get(pk=self.kept.pk).comments, 'Comment by bob')
+
+    def test_delete_account(self):
+        self.assertEqual(self.client.delete('/api/auth/me/').status_code, 204)
+        self.assertAccountGone()
+
+    def test_background_deletion(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/auth/me/?background=1')
+            # The account is disabled before the job runs
+            self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+        self.assertEqual(response.status_code, 202)
+        self.assertAccountGone()
+        self.assertEqual(APIClient().get(response['Location']).data['status'], 'DONE')
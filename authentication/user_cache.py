@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import User
+
+
+DEFAULTS = {
+    'MAX_SIZE': 1024,
+    # Seconds an entry is trusted; it also bounds how long another worker may serve a stale user
+    'TIMEOUT': 30,
+    # Name of a cache in settings.CACHES shared by every worker, or None to keep users in process only
+    'SHARED_CACHE_ALIAS': None,
+}
+
+SHARED_KEY = 'authentication:user:{user_id}'
+
+FIELD_NAMES = [field.attname for field in User._meta.concrete_fields]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+def user_to_values(user):
+    return tuple(getattr(user, name) for name in FIELD_NAMES)
+
+
+def values_to_user(values):
+    # A fresh instance per request, so a view changing request.user never touches the cached copy
+    return User.from_db('default', FIELD_NAMES, values)
+
+
+class UserCache:
+    """
+    Bounded in-process LRU of user rows with a TTL, optionally backed by a shared cache.
+    Rows are stored as tuples of field values and a new User is built on every hit.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        config = get_config()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires, values = entry
+                if expires > now:
+                    self._entries.move_to_end(user_id)
+                    return values_to_user(values)
+                del self._entries[user_id]
+
+        if config['SHARED_CACHE_ALIAS']:
+            values = caches[config['SHARED_CACHE_ALIAS']].get(SHARED_KEY.format(user_id=user_id))
+            if values is not None:
+                self._store(user_id, values, config)
+                return values_to_user(values)
+        return None
+
+    def set(self, user):
+        config = get_config()
+        values = user_to_values(user)
+        self._store(user.pk, values, config)
+        if config['SHARED_CACHE_ALIAS']:
+            caches[config['SHARED_CACHE_ALIAS']].set(SHARED_KEY.format(user_id=user.pk), values, config['TIMEOUT'])
+
+    def _store(self, user_id, values, config):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + config['TIMEOUT'], values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > config['MAX_SIZE']:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+        config = get_config()
+        if config['SHARED_CACHE_ALIAS']:
+            caches[config['SHARED_CACHE_ALIAS']].delete(SHARED_KEY.format(user_id=user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
@@ -1,7 +1,16 @@
+from django.views.decorators.http import require_GET
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
+from api.deletion import Deleter, is_background_request, start_deletion_job
+from api.events import LOGGED_OUT, publish_user_change
+from api.views import deletion_job_response
+from softdesk_api.db_router import ReplicaReadMixin
+from .authentication import async_jwt_required, json_response
+from .revocation import revoke_token
 from .serializers import UserSerializer, UserRegistrationSerializer
 
 
@@ -21,7 +30,7 @@ class RegisterView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserDetailView(APIView):
+class UserDetailView(ReplicaReadMixin, APIView):
 
     def get(self, request):
         serializer = UserSerializer(request.user)
@@ -35,5 +44,36 @@ class UserDetailView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request):
-        request.user.delete()
+        """ Delete the account by chunks (see api.deletion), or answer 202 with a deletion job with ?background=true """
+        user = request.user
+        if is_background_request(request):
+            # Deactivated at once, so the user's tokens stop working while the job runs
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+            return deletion_job_response(request, start_deletion_job('USER', user.pk))
+        Deleter().delete_user(user.pk)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class LogoutView(APIView):
+    permission_classes = []  # The refresh token is the credential
+
+    def post(self, request):
+        """ Revoke the given refresh token, so it can no longer be used to get access tokens """
+        if not request.data.get('refresh'):
+            return Response({'error': 'Refresh token is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            refresh = RefreshToken(request.data['refresh'])
+        except TokenError:
+            return Response({'error': 'Invalid or expired refresh token'}, status=status.HTTP_400_BAD_REQUEST)
+        revoke_token(refresh)
+        # The access tokens of the user stay valid until they expire, but their event streams end now
+        publish_user_change(refresh[api_settings.USER_ID_CLAIM], LOGGED_OUT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@require_GET
+@async_jwt_required
+async def user_detail_async(request):
+    """ Async version of UserDetailView.get; the user usually comes from the user cache without any query """
+    return json_response(UserSerializer(request.user).data)
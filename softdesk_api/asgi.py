@@ -3,6 +3,8 @@ ASGI config for softdesk_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The event stream (see api.events) is served in front of Django, at API_EVENTS['PATH'], over HTTP and WebSocket.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -13,4 +15,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'softdesk_api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are loaded by get_asgi_application()
+from api.events import EventStream, get_config  # noqa: E402
+
+event_stream = EventStream()
+events_path = get_config()['PATH']
+
+
+async def application(scope, receive, send):
+    # Outside Django's handler, which would keep a thread busy for each open stream
+    if scope['type'] in ('http', 'websocket') and scope['path'] == events_path:
+        await event_stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
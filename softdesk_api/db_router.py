@@ -0,0 +1,82 @@
+"""
+Read replica routing.
+
+Writes always go to the primary ('default'). Reads go to one of settings.READ_REPLICAS['ALIASES'] only while a
+view using ReplicaReadMixin serves a safe request, and only when its user has not written in the last
+STICKY_SECONDS (read-your-writes); everything else reads from the primary as well.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import permissions
+
+
+DEFAULTS = {
+    'ALIASES': [],
+    # Seconds during which a user who wrote reads from the primary, until the replicas have caught up
+    'STICKY_SECONDS': 10,
+}
+
+PIN_KEY = 'db:primary_pin:{user_id}'
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+def pin_to_primary(user):
+    """ Send the user's reads to the primary for STICKY_SECONDS """
+    cache.set(PIN_KEY.format(user_id=user.pk), True, get_config()['STICKY_SECONDS'])
+
+
+def is_pinned_to_primary(user):
+    return cache.get(PIN_KEY.format(user_id=user.pk)) is not None
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get():
+            aliases = get_config()['ALIASES']
+            if aliases:
+                return random.choice(aliases)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Serve the safe requests of a DRF view from the read replicas, once the user is authenticated (so their pin
+    is known; the authentication itself reads from the primary). Successful writes pin the user to the primary.
+    Streamed response bodies are read after the view returns, from the primary.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _read_from_replica.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS and get_config()['ALIASES']:
+            _read_from_replica.set(not (request.user.is_authenticated and is_pinned_to_primary(request.user)))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (request.method not in permissions.SAFE_METHODS and response.status_code < 400
+                and request.user.is_authenticated):
+            pin_to_primary(request.user)
+        return response
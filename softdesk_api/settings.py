@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'api',
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,9 +87,52 @@ DATABASES = {
         'PASSWORD': 'root',
         'HOST': 'localhost',
         'PORT': '5432',
+        # Persistent connections, checked before each request reuses them
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Reads of the api and authentication views go to the replicas listed in READ_REPLICAS (see softdesk_api.db_router).
+# A replica is declared like the primary, with 'TEST': {'MIRROR': 'default'}, and its alias added to ALIASES.
+# The primary pins are kept in the default cache, which must be shared by the workers for read-your-writes.
+DATABASE_ROUTERS = ['softdesk_api.db_router.ReplicaRouter']
+
+READ_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 10,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            # Least recently used entries are culled past this size
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Seconds a user's set of project IDs stays cached (see api.membership). Membership changes invalidate it in the
+# default cache, so with several workers that cache must be shared by them (Redis, Memcached...): with the
+# process-local cache above, the timeout is capped at a few seconds, during which a removed contributor may still
+# read a project on another worker.
+PROJECT_MEMBERSHIP_CACHE_TIMEOUT = 300
+
+
+# Opt-in cache of the api list responses (see api.response_cache). CACHE_ALIAS may point to any
+# cache configured above (locmem, file based, Redis...); MAX_ENTRY_SIZE is in bytes.
+API_RESPONSE_CACHE = {
+    'ENABLED': False,
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60,
+    'MAX_ENTRY_SIZE': 256 * 1024,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -133,7 +178,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
@@ -151,6 +196,42 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=10),
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
+    # Rotated and logged out refresh tokens are revoked through authentication.revocation
+    'TOKEN_REFRESH_SERIALIZER': 'authentication.serializers.RevokingTokenRefreshSerializer',
 }
 
 AUTH_USER_MODEL = 'authentication.User'
+
+# Users resolved by CachedJWTAuthentication (see authentication.user_cache)
+JWT_USER_CACHE = {
+    'MAX_SIZE': 1024,
+    'TIMEOUT': 30,
+    'SHARED_CACHE_ALIAS': None,
+}
+
+# Per-request instrumentation (see api.instrumentation): Server-Timing header, slow request log, /api/metrics/
+REQUEST_METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_THRESHOLD': 1.0,
+    'SLOWEST_QUERIES': 3,
+    # Token of the scraper; the endpoint refuses everyone else but staff users, unless PUBLIC is True
+    'SCRAPE_TOKEN': None,
+    'PUBLIC': False,
+}
+
+# Live events over Server-Sent Events and WebSocket, served by softdesk_api/asgi.py (see api.events). With more than
+# one web process, set BROKER to 'api.events.RedisBroker' and BROKER_OPTIONS to {'url': 'redis://...'}
+API_EVENTS = {
+    'BROKER': 'api.events.InMemoryBroker',
+    'BROKER_OPTIONS': {},
+    'QUEUE_SIZE': 100,
+    'HEARTBEAT': 15,
+}
+
+# Refresh token revocation (see authentication.revocation); expired rows are removed by purge_revoked_tokens
+JWT_REVOCATION = {
+    'SYNC_INTERVAL': 0,
+    'SYNC_OVERLAP': 60,
+    'PRUNE_INTERVAL': 300,
+    'PURGE_BATCH_SIZE': 1000,
+}
@@ -0,0 +1,24 @@
+"""
+Settings to run the test suite on two local SQLite databases, a primary and a replica:
+
+    python manage.py test --settings=softdesk_api.test_settings
+
+The replica is a separate database, so tests can tell which one a query read. Routing to it is enabled by the
+tests that need it (READ_REPLICAS['ALIASES']). Tables are built from the models, since no migrations are shipped.
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_primary.sqlite3',
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_replica.sqlite3',
+    },
+}
+
+MIGRATION_MODULES = {app: None for app in ['admin', 'auth', 'contenttypes', 'sessions', 'api', 'authentication']}
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']